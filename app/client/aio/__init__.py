@@ -0,0 +1 @@
+from app.client.aio.client import ClienteUrgencias, ClusterNoDisponible
@@ -0,0 +1,155 @@
+import asyncio
+import time
+import uuid
+
+from app.client.app import POSIBLES_NODOS, CLIENT_TIMEOUT, CLIENT_RONDAS, PAUSA_ENTRE_RONDAS, PLAZO_ACCION, TIPOS_MUTANTES
+from app.client.aio.connection import PoolConexiones
+from app.common.constants import MSG_NOT_LEADER, MSG_BUSY, MSG_DEADLINE_EXCEEDED, MSG_NEW_VISIT
+from app.common.protocol import codecs_disponibles
+
+CONEXIONES_POR_NODO = 32
+# Peticiones en vuelo a la vez en `en_paralelo`; las que pasan de las conexiones esperan turno
+CONCURRENCIA_FAN_OUT = 256
+
+class ClusterNoDisponible(Exception):
+    """Ningún nodo atendió la petición dentro de su plazo."""
+
+class ClienteUrgencias:
+    """
+    Cliente asíncrono para integraciones (kioscos de triage, puente con el
+    expediente clínico). Mantiene un pool de conexiones persistentes por nodo,
+    recuerda quién es el líder (el NOT_LEADER de un esclavo lo dice) y reintenta
+    como la terminal interactiva: misma clave de idempotencia en todos los
+    intentos, "plazo_ms" con lo que le queda a la acción y espera ante BUSY.
+
+        async with ClienteUrgencias.desde_config(load_cluster_config()) as cliente:
+            folio = (await cliente.nueva_visita("SS-123"))["folio"]
+    """
+    def __init__(self, nodos=None, conexiones_por_nodo=CONEXIONES_POR_NODO, timeout=CLIENT_TIMEOUT,
+                 plazo=PLAZO_ACCION):
+        # id de nodo -> (host, port_manager); sin nodos, los de la terminal interactiva
+        self.nodos = dict(nodos) if nodos else dict(enumerate(POSIBLES_NODOS, 1))
+        self.timeout = timeout
+        self.plazo = plazo
+        self._pools = {node_id: PoolConexiones(host, port, conexiones_por_nodo, timeout)
+                       for node_id, (host, port) in self.nodos.items()}
+        self.lider = None
+
+    @classmethod
+    def desde_config(cls, config, **opciones):
+        return cls({n["id"]: (n["host"], n["port_manager"]) for n in config["nodes"]}, **opciones)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.cerrar()
+
+    def cerrar(self):
+        for pool in self._pools.values():
+            pool.cerrar()
+
+    #   PETICIONES DEL MAESTRO
+
+    async def registrar_paciente(self, nombre, seguro, idempotency_key=None):
+        return await self.enviar(self._con_clave({"type": "REGISTER_PATIENT", "nombre": nombre, "seguro": seguro}, idempotency_key))
+
+    async def nueva_visita(self, seguro, idempotency_key=None):
+        return await self.enviar(self._con_clave({"type": MSG_NEW_VISIT, "seguro": seguro}, idempotency_key))
+
+    async def disponibilidad(self):
+        return await self.enviar({"type": "CHECK_AVAIL"})
+
+    async def visitas_activas(self):
+        return await self.enviar({"type": "GET_ACTIVE_VISITS"})
+
+    async def pacientes(self):
+        return await self.enviar({"type": "GET_ALL_PATIENTS"})
+
+    async def cerrar_visita(self, folio, idempotency_key=None):
+        return await self.enviar(self._con_clave({"type": "CLOSE_VISIT", "folio": folio.strip()}, idempotency_key))
+
+    @staticmethod
+    def _con_clave(mensaje, idempotency_key):
+        # Con clave propia, la integración puede reintentar la acción completa sin duplicarla
+        return dict(mensaje, idempotency_key=idempotency_key) if idempotency_key else mensaje
+
+    async def en_paralelo(self, mensajes, concurrencia=CONCURRENCIA_FAN_OUT):
+        """
+        Envía todas las peticiones con a lo más `concurrencia` en vuelo y devuelve
+        las respuestas en el mismo orden. Una que no se pudo atender aparece como
+        su excepción (ClusterNoDisponible) y no detiene a las demás.
+        """
+        cupo = asyncio.Semaphore(concurrencia)
+        async def una(mensaje):
+            async with cupo:
+                return await self.enviar(mensaje)
+        return await asyncio.gather(*(una(m) for m in mensajes), return_exceptions=True)
+
+    #   ENVÍO CON REINTENTOS
+
+    async def enviar(self, mensaje):
+        """Respuesta del nodo que atendió la petición; ClusterNoDisponible si se agotó el plazo."""
+        # La misma clave viaja en todos los reintentos de esta acción
+        if mensaje.get("type") in TIPOS_MUTANTES and "idempotency_key" not in mensaje:
+            mensaje = dict(mensaje, idempotency_key=uuid.uuid4().hex)
+        if "traza" not in mensaje:
+            mensaje = dict(mensaje, traza={"trace_id": uuid.uuid4().hex[:16]})
+        mensaje = dict(mensaje, compresion=codecs_disponibles())
+
+        vence = time.monotonic() + self.plazo
+        error = None
+        for ronda in range(CLIENT_RONDAS):
+            if ronda: await asyncio.sleep(min(PAUSA_ENTRE_RONDAS, max(0, vence - time.monotonic())))
+            pendientes = self._orden()
+            while pendientes:
+                node_id = pendientes.pop(0)
+                if vence <= time.monotonic():
+                    raise ClusterNoDisponible(f"{mensaje['type']}: plazo agotado ({error})")
+                try:
+                    respuesta = await self._pedir(node_id, mensaje, vence)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                    # Rechazo, timeout o reset de un nodo caído: probar el siguiente
+                    error = e
+                    if self.lider == node_id: self.lider = None
+                    continue
+                status = respuesta.get("status")
+                if status == MSG_NOT_LEADER:
+                    # El esclavo dice quién tiene el lease: ir directo a él
+                    self.lider = respuesta.get("leader_id") if respuesta.get("leader_id") in self.nodos else None
+                    if self.lider in pendientes:
+                        pendientes.remove(self.lider)
+                        pendientes.insert(0, self.lider)
+                    continue
+                if status == MSG_DEADLINE_EXCEEDED:
+                    continue
+                if status == MSG_BUSY:
+                    # Nodo saturado: esperar lo que pide antes de la siguiente ronda
+                    await asyncio.sleep(min(respuesta.get("retry_after", PAUSA_ENTRE_RONDAS), max(0, vence - time.monotonic())))
+                    break
+                self.lider = node_id
+                return respuesta
+        raise ClusterNoDisponible(f"{mensaje['type']}: ningún nodo atendió ({error})")
+
+    def _orden(self):
+        """Primero el líder conocido, luego los demás."""
+        return sorted(self.nodos, key=lambda node_id: node_id != self.lider)
+
+    async def _pedir(self, node_id, mensaje, vence):
+        pool = self._pools[node_id]
+        reutilizada = False
+        try:
+            async with pool.conexion(vence - time.monotonic()) as conn:
+                reutilizada = conn.usada
+                return await self._intento(conn, mensaje, vence)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # El maestro pudo cerrar la conexión ociosa justo antes: una vez más con una nueva
+            if not reutilizada: raise
+        async with pool.conexion(vence - time.monotonic(), nueva=True) as conn:
+            return await self._intento(conn, mensaje, vence)
+
+    async def _intento(self, conn, mensaje, vence):
+        # El timeout corre desde que hay conexión: esperar turno en el pool no es culpa del nodo
+        timeout = min(self.timeout, vence - time.monotonic())
+        if timeout <= 0: raise asyncio.TimeoutError()
+        return await asyncio.wait_for(conn.pedir(dict(mensaje, plazo_ms=int(timeout * 1000))), timeout)
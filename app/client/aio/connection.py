@@ -0,0 +1,87 @@
+import asyncio
+import json
+import struct
+import time
+from contextlib import asynccontextmanager
+
+from app.common.protocol import HEADER_LENGTH, BANDERA_CONTINUA, MASCARA_LONGITUD, marco_plano, cuerpo_marco
+
+# Menos que la inactividad que tolera el maestro (60 s): una conexión ociosa se
+# descarta aquí antes de que el maestro la cierre
+INACTIVIDAD_CONEXION = 45
+
+class ConexionMaestro:
+    """
+    Conexión persistente al puerto del maestro. Las peticiones van en marcos
+    (un primer byte que no es '{'), así el maestro no la cierra tras responder.
+    Una petición a la vez: la respuesta siempre es la de la última enviada.
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ultimo_uso = time.monotonic()
+        self.usada = False
+
+    @classmethod
+    async def abrir(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def pedir(self, mensaje):
+        self.writer.write(marco_plano(json.dumps(mensaje).encode("utf-8")))
+        await self.writer.drain()
+        partes = []
+        while True:
+            encabezado = struct.unpack(">I", await self.reader.readexactly(HEADER_LENGTH))[0]
+            cuerpo = await self.reader.readexactly(encabezado & MASCARA_LONGITUD)
+            partes.append(cuerpo_marco(encabezado, cuerpo))
+            if not encabezado & BANDERA_CONTINUA: break
+        self.ultimo_uso = time.monotonic()
+        self.usada = True
+        return json.loads(b"".join(partes).decode("utf-8"))
+
+    def vigente(self):
+        return time.monotonic() - self.ultimo_uso < INACTIVIDAD_CONEXION and not self.reader.at_eof()
+
+    def cerrar(self):
+        self.writer.close()
+
+class PoolConexiones:
+    """Hasta `maximo` conexiones a un nodo; las ociosas se reutilizan, la más reciente primero."""
+    def __init__(self, host, port, maximo, timeout_conexion):
+        self.host = host
+        self.port = port
+        self.timeout_conexion = timeout_conexion
+        self._libres = []
+        self._cupos = asyncio.Semaphore(maximo)
+
+    @asynccontextmanager
+    async def conexion(self, espera, nueva=False):
+        """
+        Una conexión en exclusiva mientras dure el bloque; se espera turno hasta
+        `espera` segundos. Si el bloque falla (o lo cancela un timeout) la conexión
+        se cierra: no se sabe qué quedó en el flujo.
+        """
+        await asyncio.wait_for(self._cupos.acquire(), max(0, espera))
+        try:
+            conn = None
+            while self._libres and not nueva:
+                candidata = self._libres.pop()
+                if candidata.vigente():
+                    conn = candidata
+                    break
+                candidata.cerrar()
+            conn = conn or await asyncio.wait_for(ConexionMaestro.abrir(self.host, self.port), self.timeout_conexion)
+            try:
+                yield conn
+            except BaseException:
+                conn.cerrar()
+                raise
+            self._libres.append(conn)
+        finally:
+            self._cupos.release()
+
+    def cerrar(self):
+        for conn in self._libres:
+            conn.cerrar()
+        self._libres = []
@@ -1,24 +1,58 @@
 import json
 import socket
 import time
+import uuid
+
+from app.common.protocol import codecs_disponibles, recv_respuesta
 
 POSIBLES_NODOS = [
     ("127.0.0.1", 8001), ("127.0.0.1", 8002), 
     ("127.0.0.1", 8003), ("127.0.0.1", 8004)
 ]
-CLIENT_TIMEOUT = 10
+# Timeout corto y varias vueltas: los reintentos son seguros gracias a la
+# clave de idempotencia, y una elección dura menos que las vueltas completas
+CLIENT_TIMEOUT = 2
+CLIENT_RONDAS = 8
+PAUSA_ENTRE_RONDAS = 0.5
+# Tiempo total que el operador espera por una acción. Cada intento le dice al
+# nodo cuánto le queda ("plazo_ms"), así el maestro no trabaja en peticiones
+# que ya nadie espera
+PLAZO_ACCION = 15
+TIPOS_MUTANTES = {"REGISTER_PATIENT", "NEW_VISIT", "CLOSE_VISIT"}
 
 def send_to_master(data):
-    for host, port in POSIBLES_NODOS:
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(CLIENT_TIMEOUT)
-                s.connect((host, port))
-                s.sendall(json.dumps(data).encode())
-                response_bytes = s.recv(4096)
-                if not response_bytes: continue
-                return json.loads(response_bytes.decode())
-        except (ConnectionRefusedError, socket.timeout): continue
+    # La misma clave viaja en todos los reintentos de esta acción
+    if data.get("type") in TIPOS_MUTANTES and "idempotency_key" not in data:
+        data = dict(data, idempotency_key=uuid.uuid4().hex)
+    # Una traza por acción del operador: se puede consultar con TRACES en el maestro
+    if "traza" not in data:
+        data = dict(data, traza={"trace_id": uuid.uuid4().hex[:16]})
+    # Listas de pacientes y visitas pueden ser grandes: respuesta comprimida y en fragmentos
+    data = dict(data, compresion=codecs_disponibles())
+
+    vence = time.monotonic() + PLAZO_ACCION
+    for ronda in range(CLIENT_RONDAS):
+        if ronda: time.sleep(PAUSA_ENTRE_RONDAS)
+        for host, port in POSIBLES_NODOS:
+            timeout = min(CLIENT_TIMEOUT, vence - time.monotonic())
+            if timeout <= 0: break
+            try:
+                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                    s.settimeout(timeout)
+                    s.connect((host, port))
+                    s.sendall(json.dumps(dict(data, plazo_ms=int(timeout * 1000))).encode())
+                    s.shutdown(socket.SHUT_WR)
+                    try:
+                        response = recv_respuesta(s)
+                    except ValueError: continue
+                    # Un nodo sin lease no atiende, o el intento se quedó sin plazo: probar el siguiente
+                    if response.get("status") in ("NOT_LEADER", "DEADLINE_EXCEEDED"): continue
+                    # Nodo saturado: esperar lo que pide antes de la siguiente ronda
+                    if response.get("status") == "BUSY":
+                        time.sleep(response.get("retry_after", PAUSA_ENTRE_RONDAS))
+                        break
+                    return response
+            except OSError: continue  # rechazo, timeout o reset de un nodo caído
     print("ERROR CRÍTICO: El sistema está caído.")
     return None
 
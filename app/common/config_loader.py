@@ -1,10 +1,127 @@
 import json
 import os
+import threading
+from types import MappingProxyType
+
+from app.common.log import get_logger
 
 CONFIG_PATH = "config/cluster_config.json"
+# Membresía de este nodo tras JOIN/LEAVE (data/nodo_N_membresia.json). El archivo
+# versionado es solo la semilla: lo comparten todos los nodos de una misma máquina
+MEMBRESIA_PATH = None
 
-def load_cluster_config():
+log = get_logger("CONFIG")
+
+# Copia en memoria de la configuración. Nunca se modifica en sitio: cada cambio
+# de membresía crea un dict nuevo, así quien ya tenga la referencia anterior no
+# ve estados a medias.
+_config_actual = None
+_topologia_actual = None
+_lock_config = threading.Lock()
+_suscriptores = []
+
+class Topologia:
+    """
+    Membresía vigente ya indexada, de solo lectura: se construye una vez por
+    versión de la configuración y la comparten todos los servicios del proceso
+    (elección, replicación, detector, sharding) sin volver a recorrer la lista.
+    """
+    __slots__ = ("version", "nodos", "_por_id")
+
+    def __init__(self, config):
+        self.version = config.get("membership_version", 0)
+        self.nodos = tuple(MappingProxyType(dict(n)) for n in config["nodes"])
+        self._por_id = MappingProxyType({n["id"]: n for n in self.nodos})
+
+    def __setattr__(self, nombre, valor):
+        if hasattr(self, "_por_id"):
+            raise AttributeError("La topología es inmutable")
+        object.__setattr__(self, nombre, valor)
+
+    def nodo(self, node_id):
+        return self._por_id.get(node_id)
+
+    def otros(self, node_id):
+        return [n for n in self.nodos if n["id"] != node_id]
+
+    def mayoria(self):
+        return len(self.nodos) // 2 + 1
+
+def set_membership_context(ruta):
+    """Archivo de membresía de este nodo; la siguiente lectura de la configuración ya lo aplica."""
+    global MEMBRESIA_PATH, _config_actual, _topologia_actual
+    with _lock_config:
+        MEMBRESIA_PATH = ruta
+        _config_actual = None
+        _topologia_actual = None
+
+def leer_config_en_disco():
+    """Semilla versionada con la membresía propia encima, si es más nueva."""
     if not os.path.exists(CONFIG_PATH):
         raise FileNotFoundError(f"No se encontró {CONFIG_PATH}")
     with open(CONFIG_PATH, 'r') as f:
-        return json.load(f)
\ No newline at end of file
+        config = json.load(f)
+    if MEMBRESIA_PATH and os.path.exists(MEMBRESIA_PATH):
+        with open(MEMBRESIA_PATH, 'r') as f:
+            membresia = json.load(f)
+        if membresia.get("membership_version", 0) > config.get("membership_version", 0):
+            config.update(membresia)
+    return config
+
+def load_cluster_config():
+    global _config_actual
+    with _lock_config:
+        if _config_actual is None:
+            _config_actual = leer_config_en_disco()
+        return _config_actual
+
+def get_topologia():
+    """Topología de la configuración vigente (se reconstruye solo si cambió la membresía)."""
+    global _topologia_actual
+    config = load_cluster_config()
+    topologia = _topologia_actual
+    if topologia is None or topologia.version != config.get("membership_version", 0):
+        topologia = _topologia_actual = Topologia(config)
+    return topologia
+
+def subscribe_topology_changes(callback):
+    """Registra una función callback(config) que se llama tras cada cambio de membresía."""
+    _suscriptores.append(callback)
+
+def update_cluster_config(new_config, persist=True):
+    """
+    Aplica una nueva configuración del clúster en caliente.
+    Se ignoran versiones de membresía viejas o repetidas (llegan por replicación
+    y pueden repetirse). Devuelve True si la configuración cambió.
+    """
+    global _config_actual, _topologia_actual
+    actual = load_cluster_config()
+    if new_config.get("membership_version", 0) <= actual.get("membership_version", 0):
+        return False
+
+    with _lock_config:
+        _config_actual = new_config
+        _topologia_actual = None
+        if persist and MEMBRESIA_PATH:
+            # Solo la membresía y en el archivo del nodo; escritura atómica para no
+            # dejar el JSON truncado si el nodo muere
+            tmp_path = MEMBRESIA_PATH + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({"membership_version": new_config.get("membership_version", 0),
+                           "nodes": new_config["nodes"]}, f, indent=4)
+            os.replace(tmp_path, MEMBRESIA_PATH)
+
+    for callback in list(_suscriptores):
+        try:
+            callback(new_config)
+        except Exception as e:
+            log.error("notificacion_fallida", error=e)
+    return True
+
+def with_nodes(nodes):
+    """Construye una nueva configuración con la lista de nodos dada y la versión incrementada."""
+    actual = load_cluster_config()
+    nueva = dict(actual)
+    nueva["nodes"] = sorted(nodes, key=lambda n: n["id"])
+    nueva["membership_version"] = actual.get("membership_version", 0) + 1
+    return nueva
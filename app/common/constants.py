@@ -1,6 +1,9 @@
 # Tipos de Mensajes
 MSG_LOGIN = "LOGIN"
 MSG_NEW_VISIT = "NEW_VISIT"       
+MSG_STATUS = "STATUS"             # Estado del nodo (rol, término); no requiere lease
+MSG_METRICS = "METRICS"           # Métricas del nodo (JSON o texto Prometheus); no requiere lease
+MSG_TRACES = "TRACES"             # Spans recientes y peticiones lentas del nodo; no requiere lease
 MSG_REPLICATE_INSERT = "REP_INS"  
 MSG_QUERY = "QUERY"               
 MSG_OK = "OK"
@@ -12,7 +15,50 @@ DOC_OCUPADO = "OCUPADO"
 CAMA_LIBRE = "LIBRE"
 CAMA_OCUPADA = "OCUPADA"
 
-# Mensajes de Elección (Bully Algorithm)
-MSG_ELECTION = "ELECTION"      
-MSG_ELECTION_OK = "ELECTION_OK" 
-MSG_COORDINATOR = "COORDINATOR" 
\ No newline at end of file
+# Mensajes de Elección (por términos, con lease del líder)
+MSG_REQUEST_VOTE = "REQUEST_VOTE"
+MSG_VOTE = "VOTE"
+MSG_COORDINATOR = "COORDINATOR"
+MSG_LEADER_HEARTBEAT = "LEADER_HEARTBEAT"
+MSG_HEARTBEAT_ACK = "HEARTBEAT_ACK"
+MSG_LEADER_QUERY = "LEADER_QUERY"
+MSG_LEADER_INFO = "LEADER_INFO"
+
+# Respuestas de fencing
+MSG_NOT_LEADER = "NOT_LEADER"
+MSG_STALE_TERM = "STALE_TERM"
+
+# Control de admisión: el nodo no acepta más trabajo; reintentar tras "retry_after" segundos
+MSG_BUSY = "BUSY"
+MSG_DEADLINE_EXCEEDED = "DEADLINE_EXCEEDED"
+
+# Mensajes de Membresía (altas/bajas de nodos en caliente)
+MSG_JOIN = "JOIN"
+MSG_LEAVE = "LEAVE"
+MSG_MEMBERSHIP = "MEMBERSHIP"
+
+# Archivo de visitas cerradas (replicado: todos los nodos mueven las mismas filas)
+MSG_ARCHIVE = "ARCHIVE"
+MSG_VISIT_HISTORY = "GET_VISIT_HISTORY"
+
+# Anti-entropía: el líder compara árboles de Merkle con cada réplica y repara rangos
+MSG_MERKLE = "MERKLE"                  # Hashes de nodos del árbol de una tabla (o su llave máxima)
+MSG_REPAIR = "REPAIR"                  # Reemplaza un rango de llaves por las filas del líder
+MSG_CHECK_REPLICAS = "CHECK_REPLICAS"  # Forzar una pasada ahora (requiere lease)
+
+# Reconciliación: cargas de doctores y camas recalculadas desde las visitas abiertas
+MSG_RECONCILE = "RECONCILE"            # Forzar una pasada ahora y ver el reporte
+MSG_WRITE_BATCH = "WRITE_BATCH"        # Varias escrituras replicadas que se aplican en una transacción
+MSG_OUT_OF_ORDER = "OUT_OF_ORDER"      # La réplica no tiene el lote anterior a este: responde con su posición
+MSG_POSITION = "POSITION"              # Posición (término, índice) del último lote del líder aplicado en un nodo
+
+# Reportes sobre el historial (los atienden las réplicas, nunca el líder)
+MSG_REPORT_LOS = "REPORT_LOS"              # Estancia (horas) por sala, según fecha de salida
+MSG_REPORT_OCCUPANCY = "REPORT_OCCUPANCY"  # Visitas presentes por sala en cada intervalo
+MSG_REPORT_DOCTORS = "REPORT_DOCTORS"      # Utilización de cada doctor (horas-paciente / capacidad)
+MSG_REPORT_TRIAGE = "REPORT_TRIAGE"        # Mezcla de triage de los ingresos
+MSG_USE_REPLICA = "USE_REPLICA"            # El líder no atiende reportes: pedirlo a "replica_id"
+
+# Sharding por sala: el coordinador global administra a los doctores
+MSG_RESERVE_DOCTOR = "RESERVE_DOCTOR"
+MSG_RELEASE_DOCTOR = "RELEASE_DOCTOR"
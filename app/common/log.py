@@ -0,0 +1,120 @@
+import atexit
+import os
+import queue
+import sys
+import threading
+import time
+
+from app.core.metrics import METRICAS
+
+# Niveles en orden creciente de severidad
+DEBUG, INFO, AVISO, ERROR = 10, 20, 30, 40
+_NOMBRES = {DEBUG: "DEBUG", INFO: "INFO", AVISO: "AVISO", ERROR: "ERROR"}
+_POR_NOMBRE = {"DEBUG": DEBUG, "INFO": INFO, "AVISO": AVISO, "WARNING": AVISO, "ERROR": ERROR}
+
+# Nivel global y por subsistema, p. ej. HOSPITAL_LOG="INFO,STORAGE=DEBUG,REPLICATION=AVISO"
+VARIABLE_ENTORNO = "HOSPITAL_LOG"
+CAPACIDAD_COLA = 10000
+LOTE_ESCRITURA = 256
+
+class _Salida:
+    """
+    Hilo escritor único: los hilos de petición solo encolan (sin bloquear) y
+    aquí se formatea y se escribe. Si la cola se llena, el registro se descarta
+    y se cuenta en la métrica `log_descartados_total`.
+    """
+    def __init__(self, flujo=None):
+        self.flujo = flujo or sys.stdout
+        self.cola = queue.Queue(maxsize=CAPACIDAD_COLA)
+        self._hilo = threading.Thread(target=self._escribir, daemon=True)
+        self._hilo.start()
+
+    def encolar(self, registro):
+        try:
+            self.cola.put_nowait(registro)
+        except queue.Full:
+            METRICAS.contador("log_descartados_total").inc()
+
+    def _escribir(self):
+        while True:
+            lote = [self.cola.get()]
+            try:
+                while len(lote) < LOTE_ESCRITURA:
+                    lote.append(self.cola.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                self.flujo.write("".join(_formatear(r) for r in lote))
+                self.flujo.flush()
+            except Exception:
+                pass
+            for _ in lote:
+                self.cola.task_done()
+
+    def vaciar(self, limite=2.0):
+        """Espera (con límite) a que se escriba lo encolado; se usa al salir."""
+        fin = time.monotonic() + limite
+        while self.cola.unfinished_tasks and time.monotonic() < fin:
+            time.sleep(0.01)
+
+def _formatear(registro):
+    t, nivel, subsistema, evento, campos = registro
+    marca = time.strftime("%H:%M:%S", time.localtime(t)) + f".{int(t % 1 * 1000):03d}"
+    texto = f"{marca} {_NOMBRES[nivel]:<5} [{subsistema}] {evento}"
+    if campos:
+        texto += " " + " ".join(f"{k}={v}" for k, v in campos.items())
+    return texto + "\n"
+
+def _leer_niveles(texto):
+    nivel_global, por_subsistema = INFO, {}
+    for parte in filter(None, (p.strip() for p in (texto or "").split(","))):
+        if "=" in parte:
+            nombre, nivel = parte.split("=", 1)
+            por_subsistema[nombre.strip().upper()] = _POR_NOMBRE.get(nivel.strip().upper(), INFO)
+        else:
+            nivel_global = _POR_NOMBRE.get(parte.upper(), INFO)
+    return nivel_global, por_subsistema
+
+_salida = _Salida()
+_nivel_global, _niveles = _leer_niveles(os.environ.get(VARIABLE_ENTORNO))
+_registradores = {}
+_lock = threading.Lock()
+atexit.register(_salida.vaciar)
+
+class Registrador:
+    """Logger de un subsistema (MASTER, STORAGE, ...). Los campos van como clave=valor."""
+    def __init__(self, subsistema):
+        self.subsistema = subsistema
+        self._contadores_muestreo = {}
+
+    def activo(self, nivel):
+        return nivel >= _niveles.get(self.subsistema, _nivel_global)
+
+    def registrar(self, nivel, evento, **campos):
+        if self.activo(nivel):
+            _salida.encolar((time.time(), nivel, self.subsistema, evento, campos))
+
+    def debug(self, evento, **campos): self.registrar(DEBUG, evento, **campos)
+    def info(self, evento, **campos): self.registrar(INFO, evento, **campos)
+    def aviso(self, evento, **campos): self.registrar(AVISO, evento, **campos)
+    def error(self, evento, **campos): self.registrar(ERROR, evento, **campos)
+
+    def muestreado(self, cada, nivel, evento, **campos):
+        """Para eventos de alta frecuencia: registra 1 de cada `cada` (con el total visto)."""
+        if not self.activo(nivel): return
+        n = self._contadores_muestreo.get(evento, 0) + 1
+        self._contadores_muestreo[evento] = n
+        if n % cada == 1 or cada == 1:
+            self.registrar(nivel, evento, muestra=f"1/{cada}", vistos=n, **campos)
+
+def get_logger(subsistema):
+    subsistema = subsistema.upper()
+    with _lock:
+        if subsistema not in _registradores:
+            _registradores[subsistema] = Registrador(subsistema)
+        return _registradores[subsistema]
+
+def configurar(texto):
+    """Cambia niveles en caliente con la misma sintaxis que HOSPITAL_LOG."""
+    global _nivel_global, _niveles
+    _nivel_global, _niveles = _leer_niveles(texto)
@@ -1,50 +1,143 @@
 import json
 import struct
 import socket
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+from app.common.log import get_logger
+
+log = get_logger("PROTOCOL")
 
 # Encabezado de 4 bytes para indicar el tamaño del mensaje
 HEADER_LENGTH = 4
 
-def send_json(sock, data):
+# Los dos bits altos del encabezado son banderas (un marco nunca pasa de 1 GB):
+#   COMPRIMIDO: el cuerpo empieza con un byte de códec y sigue comprimido
+#   CONTINUA:   el mensaje sigue en el siguiente marco
+# Solo se usan si el otro extremo lo pidió (campo "compresion" de la petición);
+# si no, se manda un único marco plano, como siempre.
+BANDERA_COMPRIMIDO = 0x80000000
+BANDERA_CONTINUA = 0x40000000
+MASCARA_LONGITUD = 0x3FFFFFFF
+
+UMBRAL_COMPRESION = 4096       # bytes de JSON a partir de los cuales se comprime
+TAM_FRAGMENTO = 256 * 1024     # bytes de JSON por marco en mensajes grandes
+NIVEL_ZLIB = 1                 # el JSON comprime bien aun en el nivel más rápido
+
+_CODEC_ID = {"lz4": 2, "zlib": 1}
+_ID_CODEC = {v: k for k, v in _CODEC_ID.items()}
+
+def codecs_disponibles():
+    """Códecs que este nodo entiende, en orden de preferencia (para el campo "compresion")."""
+    return (["lz4"] if lz4 is not None else []) + ["zlib"]
+
+def negociar(ofrecidos):
+    """Primer códec de los que ofrece el otro extremo que también tenemos."""
+    propios = codecs_disponibles()
+    return next((c for c in (ofrecidos or []) if c in propios), None)
+
+def _comprimir(codec, datos):
+    if codec == "lz4": return lz4.frame.compress(datos)
+    return zlib.compress(datos, NIVEL_ZLIB)
+
+def _descomprimir(codec, datos):
+    if codec == "lz4": return lz4.frame.decompress(datos)
+    return zlib.decompress(datos)
+
+def marco_plano(cuerpo):
+    """Un mensaje completo en un solo marco, sin banderas."""
+    return struct.pack('>I', len(cuerpo)) + cuerpo
+
+def cuerpo_marco(encabezado, cuerpo):
+    """Cuerpo de un marco ya leído, descomprimido si su encabezado lo indica."""
+    if encabezado & BANDERA_COMPRIMIDO:
+        return _descomprimir(_ID_CODEC[cuerpo[0]], cuerpo[1:])
+    return cuerpo
+
+def send_json(sock, data, compresion=None):
+    """
+    `compresion` es la lista de códecs que mandó el otro extremo en su petición.
+    Sin ella el mensaje va en un solo marco plano, que cualquier versión entiende;
+    con ella se fragmenta y, por encima del umbral, se comprime.
+    """
     try:
         # Convertir dict a bytes
         json_bytes = json.dumps(data).encode('utf-8')
-        
-        # Crear encabezado (Entero de 4 bytes, Big Endian)
-        header = struct.pack('>I', len(json_bytes))
-        
-        # Enviar todo junto
-        sock.sendall(header + json_bytes)
+        if compresion is None:
+            # Crear encabezado (Entero de 4 bytes, Big Endian) y enviar todo junto
+            sock.sendall(marco_plano(json_bytes))
+            return
+        codec = negociar(compresion) if len(json_bytes) >= UMBRAL_COMPRESION else None
+        for inicio in range(0, max(len(json_bytes), 1), TAM_FRAGMENTO):
+            cuerpo = json_bytes[inicio:inicio + TAM_FRAGMENTO]
+            banderas = BANDERA_CONTINUA if inicio + TAM_FRAGMENTO < len(json_bytes) else 0
+            if codec:
+                cuerpo = bytes([_CODEC_ID[codec]]) + _comprimir(codec, cuerpo)
+                banderas |= BANDERA_COMPRIMIDO
+            sock.sendall(struct.pack('>I', banderas | len(cuerpo)) + cuerpo)
     except Exception as e:
-        print(f"[Protocol Error] Fallo al enviar: {e}")
+        log.aviso("envio_fallido", error=e)
         raise
 
+def recv_fragmentos(sock, header_data=None):
+    """
+    Genera el JSON de un mensaje por partes, ya descomprimidas, conforme llegan
+    los marcos: un mensaje grande no necesita estar completo en el búfer del socket.
+    """
+    while True:
+        # Leer el encabezado para saber cuánto medir el marco
+        if header_data is None:
+            header_data = _recv_all(sock, HEADER_LENGTH)
+            if not header_data:
+                return
+        encabezado = struct.unpack('>I', header_data)[0]
+        header_data = None
+        cuerpo = _recv_all(sock, encabezado & MASCARA_LONGITUD)
+        if cuerpo is None:
+            raise ConnectionError("Marco incompleto")
+        yield cuerpo_marco(encabezado, cuerpo)
+        if not encabezado & BANDERA_CONTINUA:
+            return
+
 def recv_json(sock):
     try:
-        # Leer el encabezado para saber cuánto medir el mensaje
-        header_data = _recv_all(sock, HEADER_LENGTH)
-        if not header_data:
-            return None
-        
-        # Desempaquetar el tamaño
-        msg_length = struct.unpack('>I', header_data)[0]
-        
-        # Leer el cuerpo del mensaje
-        msg_data = _recv_all(sock, msg_length)
+        msg_data = b"".join(recv_fragmentos(sock))
         if not msg_data:
             return None
-            
         return json.loads(msg_data.decode('utf-8'))
     except Exception as e:
-        print(f"[Protocol Error] Fallo al recibir: {e}")
+        # Suele ser un timeout de un nodo caído: frecuente durante una elección
+        log.debug("recepcion_fallida", error=e)
         return None
 
+def recv_respuesta(sock):
+    """
+    Respuesta del puerto del maestro: JSON plano hasta que cierre, o en marcos si
+    la petición pidió compresión. Un JSON empieza con '{' y un encabezado nunca
+    (los marcos son pequeños), así que basta el primer byte para distinguirlos.
+    """
+    primero = _recv_all(sock, HEADER_LENGTH)
+    if not primero:
+        raise ConnectionError("Conexión cerrada sin respuesta")
+    if primero[:1] == b"{":
+        chunks = [primero]
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk: break
+            chunks.append(chunk)
+        return json.loads(b"".join(chunks).decode("utf-8"))
+    return json.loads(b"".join(recv_fragmentos(sock, primero)).decode("utf-8"))
+
 #Función auxiliar para asegurar lectura completa de n bytes
 def _recv_all(sock, n):
-    data = b''
+    data = bytearray()
     while len(data) < n:
         packet = sock.recv(n - len(data))
         if not packet:
             return None
         data += packet
-    return data
\ No newline at end of file
+    return bytes(data)
@@ -0,0 +1,178 @@
+import multiprocessing
+import queue
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from app.core.metrics import METRICAS
+from app.common.log import get_logger
+
+log = get_logger("ADMISION")
+
+# Sección opcional de cluster_config.json:
+#   "admision": {"master": {"hilos": 32, "cola": 256},
+#                "storage": {"hilos": 16, "cola": 1024},
+#                "tasa_cliente": 100, "rafaga_cliente": 200}
+# hilos = peticiones atendidas a la vez por el listener; cola = cuántas más
+# pueden esperar. Lo que no cabe se contesta BUSY con un retry_after.
+LIMITES_POR_DEFECTO = {
+    "master": {"hilos": 32, "cola": 256},
+    "storage": {"hilos": 16, "cola": 1024},
+}
+TASA_CLIENTE = 100      # peticiones/s sostenidas por cliente
+RAFAGA_CLIENTE = 200    # peticiones seguidas que se toleran por encima de la tasa
+CLIENTES_CAPACIDAD = 10000
+# Ranuras vecinas que se revisan al buscar la cubeta de un cliente en memoria compartida
+SONDEOS_CUBETA = 8
+REINTENTO_MINIMO = 0.05
+REINTENTO_MAXIMO = 5.0
+
+def limites_listener(nombre, config):
+    limites = dict(LIMITES_POR_DEFECTO[nombre])
+    limites.update(config.get("admision", {}).get(nombre, {}))
+    return limites["hilos"], limites["cola"]
+
+def _acotar(segundos):
+    return round(min(REINTENTO_MAXIMO, max(REINTENTO_MINIMO, segundos)), 3)
+
+class PoolAcotado:
+    """
+    Hilos fijos que consumen una cola acotada. Sustituye al hilo por conexión:
+    ante una avalancha el número de hilos no crece y lo aceptado se atiende con
+    poca espera; lo que no cabe en la cola se rechaza de inmediato.
+    """
+    def __init__(self, nombre, hilos, capacidad_cola):
+        self.nombre = nombre
+        self.hilos = hilos
+        self._cola = queue.Queue(maxsize=capacidad_cola)
+        # Media móvil del tiempo de servicio, para estimar el retry_after
+        self._servicio_s = 0.01
+        self._en_cola = METRICAS.medidor("pool_cola", pool=nombre)
+        self._rechazos = METRICAS.contador("pool_rechazos_total", pool=nombre)
+        for i in range(hilos):
+            threading.Thread(target=self._trabajar, name=f"{nombre}-{i}", daemon=True).start()
+
+    def enviar(self, funcion, *args):
+        """Encola el trabajo; False si la cola está llena (el llamador contesta BUSY)."""
+        try:
+            self._cola.put_nowait((funcion, args))
+        except queue.Full:
+            self._rechazos.inc()
+            return False
+        self._en_cola.inc()
+        return True
+
+    def reintentar_en(self):
+        """Segundos hasta que la cola actual se habrá vaciado, aproximadamente."""
+        return _acotar(self._cola.qsize() * self._servicio_s / self.hilos)
+
+    def _trabajar(self):
+        while True:
+            funcion, args = self._cola.get()
+            self._en_cola.dec()
+            inicio = time.perf_counter()
+            try:
+                funcion(*args)
+            except Exception as e:
+                log.error("trabajo_fallido", pool=self.nombre, error=e)
+            self._servicio_s += 0.05 * (time.perf_counter() - inicio - self._servicio_s)
+
+class CubetaTokens:
+    def __init__(self, tasa, rafaga):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self._tokens = rafaga
+        self._ultimo = time.monotonic()
+
+    def tomar(self):
+        """0 si hay token; si no, segundos hasta el siguiente."""
+        ahora = time.monotonic()
+        self._tokens = min(self.rafaga, self._tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.tasa
+
+class LimitadorClientes:
+    """Una cubeta de tokens por cliente (LRU acotado: un cliente olvidado vuelve con la cubeta llena)."""
+    def __init__(self, tasa=TASA_CLIENTE, rafaga=RAFAGA_CLIENTE, capacidad=CLIENTES_CAPACIDAD):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.capacidad = capacidad
+        self._lock = threading.Lock()
+        self._cubetas = OrderedDict()
+        self._limitadas = METRICAS.contador("clientes_limitados_total")
+
+    @classmethod
+    def desde_config(cls, config):
+        admision = config.get("admision", {})
+        return cls(admision.get("tasa_cliente", TASA_CLIENTE), admision.get("rafaga_cliente", RAFAGA_CLIENTE))
+
+    def permitir(self, cliente):
+        """0 si la petición pasa; si no, el retry_after en segundos."""
+        with self._lock:
+            cubeta = self._cubetas.get(cliente)
+            if cubeta is None:
+                cubeta = self._cubetas[cliente] = CubetaTokens(self.tasa, self.rafaga)
+                while len(self._cubetas) > self.capacidad:
+                    self._cubetas.popitem(last=False)
+            self._cubetas.move_to_end(cliente)
+            espera = cubeta.tomar()
+        if espera:
+            self._limitadas.inc()
+            return _acotar(espera)
+        return 0
+
+class LimitadorCompartido(LimitadorClientes):
+    """
+    Las mismas cubetas, en memoria compartida entre los procesos del puerto del
+    maestro (modo multiproceso): con una cubeta por proceso, la cuota de un cliente
+    se multiplicaría por el número de procesos. Cada ranura guarda (clave, tokens,
+    último); la clave es el crc32 de la dirección. Una cubeta que ya se rellenó
+    vale lo mismo que una olvidada, así que su ranura la puede tomar otro cliente.
+    """
+    def __init__(self, tasa=TASA_CLIENTE, rafaga=RAFAGA_CLIENTE, capacidad=CLIENTES_CAPACIDAD, memoria=None):
+        super().__init__(tasa, rafaga, capacidad)
+        if memoria is None:
+            contexto = multiprocessing.get_context("spawn")
+            memoria = (contexto.Array("d", 3 * capacidad, lock=False), contexto.Lock())
+        self.memoria = memoria
+        self._ranuras, self._lock = memoria
+
+    @classmethod
+    def desde_config(cls, config, memoria=None):
+        admision = config.get("admision", {})
+        return cls(admision.get("tasa_cliente", TASA_CLIENTE), admision.get("rafaga_cliente", RAFAGA_CLIENTE),
+                   memoria=memoria)
+
+    def _ranura(self, clave, ahora):
+        """Índice de la ranura del cliente; si no tiene, una libre o ya rellenada (se reinicia llena)."""
+        inicio = clave % self.capacidad
+        libre = None
+        for i in range(SONDEOS_CUBETA):
+            r = 3 * ((inicio + i) % self.capacidad)
+            if self._ranuras[r] == clave: return r
+            if libre is None and (self._ranuras[r] == 0 or
+                                  self._ranuras[r + 1] + (ahora - self._ranuras[r + 2]) * self.tasa >= self.rafaga):
+                libre = r
+        # Vecindario lleno de clientes activos: se comparte la primera ranura
+        if libre is None: return 3 * inicio
+        self._ranuras[libre:libre + 3] = [clave, self.rafaga, ahora]
+        return libre
+
+    def permitir(self, cliente):
+        """0 si la petición pasa; si no, el retry_after en segundos."""
+        clave = zlib.crc32(cliente.encode()) + 1  # 0 marca una ranura libre
+        with self._lock:
+            ahora = time.monotonic()
+            r = self._ranura(clave, ahora)
+            tokens = min(self.rafaga, self._ranuras[r + 1] + (ahora - self._ranuras[r + 2]) * self.tasa)
+            self._ranuras[r + 2] = ahora
+            if tokens >= 1:
+                self._ranuras[r + 1] = tokens - 1
+                return 0
+            self._ranuras[r + 1] = tokens
+        self._limitadas.inc()
+        return _acotar((1 - tokens) / self.tasa)
@@ -0,0 +1,57 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from app.core.metrics import METRICAS
+
+# Cuándo vence (reloj monotónico de este proceso) la petición que atiende este hilo.
+# Entre nodos viaja como presupuesto restante en el campo "plazo_ms": los relojes
+# de los nodos no están sincronizados, pero un intervalo se puede trasladar.
+_vence = contextvars.ContextVar("plazo", default=None)
+
+class PlazoVencido(Exception):
+    """El llamador original ya dejó de esperar: seguir solo gastaría recursos del maestro."""
+    def __init__(self, etapa):
+        super().__init__(f"Plazo vencido ({etapa})")
+        self.etapa = etapa
+
+def desde_mensaje(mensaje, llegada=None):
+    """Vencimiento local según el "plazo_ms" del mensaje, contado desde su llegada (None si no trae)."""
+    plazo_ms = mensaje.get("plazo_ms") if isinstance(mensaje, dict) else None
+    if plazo_ms is None: return None
+    return (time.monotonic() if llegada is None else llegada) + plazo_ms / 1000.0
+
+@contextmanager
+def con_plazo(vence):
+    token = _vence.set(vence)
+    try:
+        yield
+    finally:
+        _vence.reset(token)
+
+def restante():
+    """Segundos que le quedan a la petición en curso (None si no tiene plazo)."""
+    vence = _vence.get()
+    return None if vence is None else vence - time.monotonic()
+
+def vencido(etapa):
+    """Cuenta el abandono y devuelve la excepción para lanzarla."""
+    METRICAS.contador("plazos_vencidos_total", etapa=etapa).inc()
+    return PlazoVencido(etapa)
+
+def verificar(etapa):
+    r = restante()
+    if r is not None and r <= 0:
+        raise vencido(etapa)
+
+def acotar(timeout, etapa):
+    """`timeout` recortado a lo que le queda a la petición; PlazoVencido si ya no queda nada."""
+    r = restante()
+    if r is None: return timeout
+    if r <= 0: raise vencido(etapa)
+    return min(timeout, r)
+
+def para_mensaje():
+    """Campo "plazo_ms" para propagar el presupuesto restante a otro nodo ({} sin plazo)."""
+    r = restante()
+    return {} if r is None else {"plazo_ms": max(0, int(r * 1000))}
@@ -3,6 +3,11 @@ import time
 import socket
 import json
 
+from app.core.metrics import METRICAS
+from app.common.log import get_logger
+
+log = get_logger("DETECTOR")
+
 # CONSTANTES DE TIEMPO
 INTERVALO_PING = 2  
 TIEMPO_LIMITE = 10     
@@ -52,6 +57,17 @@ class DetectorFallas:
         self.id_maestro = str(nuevo_id)
         self.ultima_vez_visto[self.id_maestro] = time.time()
 
+    def actualizar_nodos(self, nodos_cluster):
+        """Recarga la topología en caliente (altas y bajas de nodos)."""
+        now = time.time()
+        for nid in nodos_cluster:
+            if nid != self.id_nodo and nid not in self.ultima_vez_visto:
+                self.ultima_vez_visto[nid] = now
+        for nid in list(self.ultima_vez_visto):
+            if nid not in nodos_cluster:
+                self.ultima_vez_visto.pop(nid, None)
+        self.nodos_cluster = nodos_cluster
+
     # LÓGICA INTERNA 
 
     def _listen_heartbeats(self):
@@ -75,13 +91,13 @@ class DetectorFallas:
                 except:
                     pass
         except Exception as e:
-            print(f"[Detector Error] Bind falló: {e}")
+            log.error("bind_fallido", puerto=self.puerto, error=e)
 
     def _send_heartbeats(self):
         """Envía PING a todos los vecinos relevantes."""
         while self.running:
             
-            for nid, (ip, port) in self.nodos_cluster.items():
+            for nid, (ip, port) in list(self.nodos_cluster.items()):
                 if nid == self.id_nodo: continue 
                 
                 self._send_ping(nid, ip, port)
@@ -89,6 +105,8 @@ class DetectorFallas:
             time.sleep(INTERVALO_PING)
 
     def _send_ping(self, target_id, ip, port):
+        # RTT aproximado: el handshake TCP es un viaje de ida y vuelta al vecino
+        inicio = time.perf_counter()
         try:
             s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             s.settimeout(TIMEOUT_SOCKET)
@@ -96,8 +114,9 @@ class DetectorFallas:
             msg = {"type": "PING", "sender_id": self.id_nodo}
             s.sendall(json.dumps(msg).encode())
             s.close()
+            METRICAS.histograma("detector_latido_rtt_segundos", nodo=target_id).observar(time.perf_counter() - inicio)
         except:
-            pass
+            METRICAS.contador("detector_latidos_fallidos_total", nodo=target_id).inc()
 
     def _check_timeouts(self):
         """Revisa periódicamente si alguien expiró."""
@@ -108,11 +127,12 @@ class DetectorFallas:
             nodos_ids = list(self.ultima_vez_visto.keys())
             
             for nid in nodos_ids:
-                last_seen = self.ultima_vez_visto[nid]
+                last_seen = self.ultima_vez_visto.get(nid)
+                if last_seen is None: continue
                 delta = now - last_seen
                 
                 if delta > TIEMPO_LIMITE:
-                    print(f"[Detector] Nodo {nid} ha muerto (Silencio por {int(delta)}s)")
+                    log.aviso("nodo_caido", nodo=nid, silencio_s=int(delta))
                     
                     self.ultima_vez_visto[nid] = time.time() 
                     
@@ -0,0 +1,47 @@
+import threading
+import time
+
+_DIGITOS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+ANCHO_TIEMPO = 9      # ms en base 36: alcanza hasta el año 5188
+ANCHO_SECUENCIA = 3   # 46656 folios por milisegundo y nodo
+MAX_SECUENCIA = 36 ** ANCHO_SECUENCIA
+
+def _base36(numero, ancho):
+    texto = ""
+    while numero:
+        numero, resto = divmod(numero, 36)
+        texto = _DIGITOS[resto] + texto
+    return texto.rjust(ancho, "0")
+
+def formatear_folio(ms, node_id, term, secuencia):
+    return f"{_base36(ms, ANCHO_TIEMPO)}-N{node_id}-T{term}-{_base36(secuencia, ANCHO_SECUENCIA)}"
+
+class GeneradorFolios:
+    """
+    Folios únicos en todo el clúster sin coordinación, al estilo Snowflake:
+    <milisegundos>-N<nodo>-T<término>-<secuencia>.
+
+    El prefijo de tiempo tiene ancho fijo, así que los folios se ordenan por
+    fecha de creación. El ID de nodo separa a los emisores y el término cubre
+    el caso de un reinicio con el reloj atrasado.
+    """
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self._lock = threading.Lock()
+        self._ultimo_ms = 0
+        self._secuencia = 0
+
+    def siguiente(self, term=0):
+        with self._lock:
+            # Si el reloj retrocede se sigue usando el último ms visto
+            ahora = max(int(time.time() * 1000), self._ultimo_ms)
+            if ahora == self._ultimo_ms:
+                self._secuencia += 1
+                if self._secuencia >= MAX_SECUENCIA:
+                    # Secuencia agotada en este ms: avanzar al siguiente
+                    ahora += 1
+                    self._secuencia = 0
+            else:
+                self._secuencia = 0
+            self._ultimo_ms = ahora
+            return formatear_folio(ahora, self.node_id, term, self._secuencia)
@@ -0,0 +1,142 @@
+import heapq
+import json
+import re
+import threading
+
+from app.common.constants import CAMA_LIBRE
+from app.core.idempotency_cache import CacheIdempotencia
+from app.core.patient_cache import CachePacientes
+
+# Tablas cuyos cambios afectan a los índices en memoria
+_TABLAS_CALIENTES = re.compile(r"\b(doctores|camas|visitas)\b", re.IGNORECASE)
+_TABLA_PACIENTES = re.compile(r"\bpacientes\b", re.IGNORECASE)
+
+class EstadoCaliente:
+    """
+    Índices en memoria que necesita el maestro para asignar sin consultar SQLite:
+    camas libres, carga de cada doctor, visitas activas por folio, respuestas
+    recientes por clave de idempotencia y pacientes por seguro social.
+
+    Todos los nodos los mantienen al día aplicando los eventos que viajan junto a
+    cada escritura replicada, así que un esclavo promovido ya los tiene listos.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.doctores = {}         # id_doctor -> {"carga_actual", "capacidad_max"}
+        self.camas = {}            # id_cama -> {"id_sala", "estado"}
+        self.visitas_activas = {}  # folio -> {"id_paciente", "id_doctor", "id_cama", "id_sala"}
+        self._heaps_libres = {}    # id_sala -> ids de camas candidatas a libres (borrado perezoso)
+        self.respuestas = CacheIdempotencia()
+        self.pacientes = CachePacientes()
+        self.sucio = True
+
+    def cargar_desde_bd(self, db):
+        """Reconstrucción completa; solo al arrancar o si llegó una escritura sin evento."""
+        doctores = db.ejecutar_lectura("SELECT id_doctor, carga_actual, capacidad_max FROM doctores", [])["data"]
+        camas = db.ejecutar_lectura("SELECT id_cama, id_sala, estado FROM camas", [])["data"]
+        visitas = db.ejecutar_lectura(
+            "SELECT folio, id_paciente, id_doctor, id_cama, id_sala FROM visitas WHERE estado = 'EN_PROCESO'", []
+        )["data"]
+        with self._lock:
+            self.doctores = {d["id_doctor"]: {"carga_actual": d["carga_actual"], "capacidad_max": d["capacidad_max"]} for d in doctores}
+            self.camas = {c["id_cama"]: {"id_sala": c["id_sala"], "estado": c["estado"]} for c in camas}
+            self.visitas_activas = {v.pop("folio"): v for v in visitas}
+            self._heaps_libres = {}
+            for id_cama, c in self.camas.items():
+                if c["estado"] == CAMA_LIBRE:
+                    self._heaps_libres.setdefault(c["id_sala"], []).append(id_cama)
+            for heap in self._heaps_libres.values():
+                heapq.heapify(heap)
+            self.sucio = False
+        # Se vuelve a poblar sola con las búsquedas (p. ej. tras cargar un snapshot)
+        self.pacientes.limpiar()
+
+        recientes = db.ejecutar_lectura(
+            "SELECT clave, respuesta, creado FROM idempotencia ORDER BY creado DESC LIMIT ?",
+            (self.respuestas.capacidad,)
+        )["data"]
+        self.respuestas.limpiar()
+        for r in reversed(recientes):
+            self.respuestas.guardar(r["clave"], json.loads(r["respuesta"]), r["creado"])
+
+    def marcar_sucio(self, sql=None):
+        """Una escritura sin evento tocó tablas calientes: recargar antes de usar."""
+        if sql is None or _TABLAS_CALIENTES.search(sql):
+            self.sucio = True
+        if sql is None or _TABLA_PACIENTES.search(sql):
+            self.pacientes.limpiar()
+
+    # CONSULTAS (las usa el maestro con el mutex de asignación tomado)
+
+    def elegir_doctor(self):
+        with self._lock:
+            candidatos = [
+                (d["carga_actual"], id_doctor) for id_doctor, d in self.doctores.items()
+                if d["carga_actual"] < d["capacidad_max"]
+            ]
+            if not candidatos: return None
+            _, id_doctor = min(candidatos)
+            return dict(self.doctores[id_doctor], id_doctor=id_doctor)
+
+    def _primera_libre(self, id_sala):
+        heap = self._heaps_libres.get(id_sala, [])
+        while heap:
+            cama = self.camas.get(heap[0])
+            if cama and cama["estado"] == CAMA_LIBRE and cama["id_sala"] == id_sala:
+                return heap[0]
+            heapq.heappop(heap)
+        return None
+
+    def elegir_cama(self, salas=None):
+        """Cama libre de menor ID, opcionalmente solo entre las salas indicadas."""
+        with self._lock:
+            candidatas = []
+            for id_sala in (self._heaps_libres.keys() if salas is None else salas):
+                id_cama = self._primera_libre(id_sala)
+                if id_cama is not None:
+                    candidatas.append((id_cama, id_sala))
+            if not candidatas: return None
+            id_cama, id_sala = min(candidatas)
+            return {"id_cama": id_cama, "id_sala": id_sala}
+
+    def salas(self):
+        with self._lock:
+            return {cama["id_sala"] for cama in self.camas.values()}
+
+    def camas_libres_por_sala(self):
+        with self._lock:
+            conteo = {}
+            for cama in self.camas.values():
+                if cama["estado"] == CAMA_LIBRE:
+                    conteo[cama["id_sala"]] = conteo.get(cama["id_sala"], 0) + 1
+            return conteo
+
+    def visita_activa(self, folio):
+        with self._lock:
+            visita = self.visitas_activas.get(folio)
+            return dict(visita) if visita else None
+
+    # EVENTOS DE REPLICACIÓN (valores absolutos: aplicarlos dos veces es inocuo)
+
+    def aplicar_evento(self, evento):
+        tipo = evento.get("tipo")
+        with self._lock:
+            if tipo == "doctor":
+                doctor = self.doctores.setdefault(evento["id_doctor"], {"carga_actual": 0, "capacidad_max": evento.get("capacidad_max", 0)})
+                doctor["carga_actual"] = evento["carga_actual"]
+            elif tipo == "cama":
+                cama = self.camas.setdefault(evento["id_cama"], {"id_sala": evento.get("id_sala"), "estado": evento["estado"]})
+                cama["estado"] = evento["estado"]
+                if evento["estado"] == CAMA_LIBRE:
+                    heapq.heappush(self._heaps_libres.setdefault(cama["id_sala"], []), evento["id_cama"])
+            elif tipo == "visita_abierta":
+                self.visitas_activas[evento["folio"]] = {
+                    "id_paciente": evento["id_paciente"], "id_doctor": evento["id_doctor"],
+                    "id_cama": evento["id_cama"], "id_sala": evento["id_sala"]
+                }
+            elif tipo == "visita_cerrada":
+                self.visitas_activas.pop(evento["folio"], None)
+            elif tipo == "paciente":
+                self.pacientes.guardar(evento["seguro"], evento["id_paciente"])
+            elif tipo == "idempotencia":
+                self.respuestas.guardar(evento["clave"], evento["respuesta"], evento["creado"])
@@ -0,0 +1,43 @@
+import threading
+import time
+from collections import OrderedDict
+
+IDEMPOTENCY_CAPACIDAD = 10000
+IDEMPOTENCY_TTL = 3600  # segundos que se recuerda una respuesta
+
+class CacheIdempotencia:
+    """
+    Respuestas ya enviadas, por clave de idempotencia del cliente (LRU + TTL).
+    Los tiempos son de reloj de pared porque las entradas viajan entre nodos
+    y se persisten en la tabla `idempotencia`.
+    """
+    def __init__(self, capacidad=IDEMPOTENCY_CAPACIDAD, ttl=IDEMPOTENCY_TTL):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # clave -> (creado, respuesta)
+
+    def vigente(self, creado):
+        return time.time() - creado < self.ttl
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None: return None
+            creado, respuesta = entrada
+            if not self.vigente(creado):
+                del self._entradas[clave]
+                return None
+            self._entradas.move_to_end(clave)
+            return respuesta
+
+    def guardar(self, clave, respuesta, creado=None):
+        with self._lock:
+            self._entradas[clave] = (creado or time.time(), respuesta)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.capacidad:
+                self._entradas.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
@@ -0,0 +1,175 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogramas al estilo HDR: cada potencia de 2 (en microsegundos) se divide en
+# 2^BITS_SUBCUBETA cubetas lineales, así el error relativo queda acotado (~3%)
+# sin importar si la latencia es de 50 µs o de 5 s.
+BITS_SUBCUBETA = 5
+CUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+def _clave(nombre, etiquetas):
+    return nombre, tuple(sorted(etiquetas.items()))
+
+class Contador:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.valor = 0
+
+    def inc(self, n=1):
+        with self._lock:
+            self.valor += n
+
+    def exportar(self):
+        return self.valor
+
+class Medidor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.valor = 0
+
+    def fijar(self, valor):
+        self.valor = valor
+
+    def inc(self, n=1):
+        with self._lock:
+            self.valor += n
+
+    def dec(self, n=1):
+        self.inc(-n)
+
+    def exportar(self):
+        return self.valor
+
+class Histograma:
+    """Latencias en segundos; internamente cubetas log-lineales en microsegundos."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cubetas = {}  # índice -> cuenta
+        self.cuenta = 0
+        self.suma = 0.0
+        self.minimo = None
+        self.maximo = None
+
+    @staticmethod
+    def _indice(us):
+        if us < (1 << BITS_SUBCUBETA):
+            return us
+        corrimiento = us.bit_length() - BITS_SUBCUBETA - 1
+        return ((corrimiento + 1) << BITS_SUBCUBETA) + (us >> corrimiento) - (1 << BITS_SUBCUBETA)
+
+    @staticmethod
+    def _limite_superior(indice):
+        """Mayor valor (µs) que cae en la cubeta `indice`."""
+        if indice < (1 << BITS_SUBCUBETA):
+            return indice
+        corrimiento = (indice >> BITS_SUBCUBETA) - 1
+        base = (indice & ((1 << BITS_SUBCUBETA) - 1)) + (1 << BITS_SUBCUBETA)
+        return ((base + 1) << corrimiento) - 1
+
+    def observar(self, segundos):
+        us = max(0, int(segundos * 1_000_000))
+        indice = self._indice(us)
+        with self._lock:
+            self._cubetas[indice] = self._cubetas.get(indice, 0) + 1
+            self.cuenta += 1
+            self.suma += segundos
+            if self.minimo is None or segundos < self.minimo: self.minimo = segundos
+            if self.maximo is None or segundos > self.maximo: self.maximo = segundos
+
+    def cuantil(self, q):
+        with self._lock:
+            if not self.cuenta: return None
+            objetivo = max(1, int(q * self.cuenta + 0.5))
+            acumulado = 0
+            for indice in sorted(self._cubetas):
+                acumulado += self._cubetas[indice]
+                if acumulado >= objetivo:
+                    return min(self._limite_superior(indice) / 1_000_000, self.maximo)
+            return self.maximo
+
+    def exportar(self):
+        datos = {"cuenta": self.cuenta, "suma": self.suma, "min": self.minimo, "max": self.maximo}
+        for q in CUANTILES:
+            datos[f"p{q * 100:g}"] = self.cuantil(q)
+        return datos
+
+class RegistroMetricas:
+    """
+    Métricas del proceso (un nodo): contadores, medidores e histogramas de
+    latencia identificados por nombre + etiquetas. Se consultan con una
+    petición METRICS al puerto del manager, en JSON o en texto Prometheus.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metricas = {}  # (nombre, etiquetas) -> métrica
+        self._tipos = {}     # nombre -> clase
+
+    def _obtener(self, clase, nombre, etiquetas):
+        clave = _clave(nombre, etiquetas)
+        metrica = self._metricas.get(clave)
+        if metrica is None:
+            with self._lock:
+                if self._tipos.setdefault(nombre, clase) is not clase:
+                    raise ValueError(f"La métrica {nombre} ya existe con otro tipo")
+                metrica = self._metricas.setdefault(clave, clase())
+        return metrica
+
+    def contador(self, nombre, **etiquetas):
+        return self._obtener(Contador, nombre, etiquetas)
+
+    def medidor(self, nombre, **etiquetas):
+        return self._obtener(Medidor, nombre, etiquetas)
+
+    def histograma(self, nombre, **etiquetas):
+        return self._obtener(Histograma, nombre, etiquetas)
+
+    @contextmanager
+    def cronometro(self, nombre, **etiquetas):
+        """Observa en el histograma la duración del bloque `with`."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histograma(nombre, **etiquetas).observar(time.perf_counter() - inicio)
+
+    def exportar(self):
+        with self._lock:
+            items = sorted(self._metricas.items())
+        salida = {}
+        for (nombre, etiquetas), metrica in items:
+            salida.setdefault(nombre, []).append({"etiquetas": dict(etiquetas), "valor": metrica.exportar()})
+        return salida
+
+    def prometheus(self):
+        """Volcado en formato de texto de Prometheus (los histogramas como summary)."""
+        with self._lock:
+            items = sorted(self._metricas.items())
+        lineas = []
+        anterior = None
+        for (nombre, etiquetas), metrica in items:
+            if nombre != anterior:
+                tipo = {Contador: "counter", Medidor: "gauge", Histograma: "summary"}[type(metrica)]
+                lineas.append(f"# TYPE {nombre} {tipo}")
+                anterior = nombre
+            if isinstance(metrica, Histograma):
+                for q in CUANTILES:
+                    valor = metrica.cuantil(q)
+                    etq = _etiquetas_texto(etiquetas + (("quantile", str(q)),))
+                    lineas.append(f"{nombre}{etq} {valor if valor is not None else 'NaN'}")
+                lineas.append(f"{nombre}_sum{_etiquetas_texto(etiquetas)} {metrica.suma}")
+                lineas.append(f"{nombre}_count{_etiquetas_texto(etiquetas)} {metrica.cuenta}")
+            else:
+                lineas.append(f"{nombre}{_etiquetas_texto(etiquetas)} {metrica.valor}")
+        return "\n".join(lineas) + "\n"
+
+def _etiquetas_texto(etiquetas):
+    if not etiquetas: return ""
+    partes = []
+    for k, v in etiquetas:
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        partes.append(f'{k}="{v}"')
+    return "{" + ",".join(partes) + "}"
+
+# Registro único del proceso
+METRICAS = RegistroMetricas()
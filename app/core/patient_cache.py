@@ -0,0 +1,39 @@
+import threading
+from collections import OrderedDict
+
+from app.core.metrics import METRICAS
+
+PACIENTES_CAPACIDAD = 50000
+
+class CachePacientes:
+    """
+    seguro_social -> id_paciente (LRU acotado). La identidad de un paciente no
+    cambia una vez registrado, así que no hace falta TTL: las altas llegan por
+    el evento replicado y cualquier otra escritura a `pacientes` vacía la caché.
+    Solo se guardan aciertos; un seguro desconocido siempre va a SQLite.
+    """
+    def __init__(self, capacidad=PACIENTES_CAPACIDAD):
+        self.capacidad = capacidad
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self._aciertos = METRICAS.contador("cache_pacientes_total", resultado="acierto")
+        self._fallos = METRICAS.contador("cache_pacientes_total", resultado="fallo")
+
+    def obtener(self, seguro):
+        with self._lock:
+            id_paciente = self._entradas.get(seguro)
+            if id_paciente is not None:
+                self._entradas.move_to_end(seguro)
+        (self._aciertos if id_paciente is not None else self._fallos).inc()
+        return id_paciente
+
+    def guardar(self, seguro, id_paciente):
+        with self._lock:
+            self._entradas[seguro] = id_paciente
+            self._entradas.move_to_end(seguro)
+            while len(self._entradas) > self.capacidad:
+                self._entradas.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
@@ -0,0 +1,25 @@
+from app.common.config_loader import load_cluster_config, get_topologia
+
+# Sección opcional de cluster_config.json:
+#   "sharding": {"habilitado": true, "duenos_sala": {"1": 1, "2": 2, ...}}
+# Cada sala (id_sala) tiene un nodo dueño que escribe sus camas y visitas.
+# Si una sala no aparece en el mapa, su dueño es el nodo con el mismo ID.
+
+def sharding_habilitado(config=None):
+    config = config or load_cluster_config()
+    return bool(config.get("sharding", {}).get("habilitado"))
+
+def dueno_de_sala(id_sala, config=None):
+    config = config or load_cluster_config()
+    duenos = config.get("sharding", {}).get("duenos_sala", {})
+    return duenos.get(str(id_sala), id_sala)
+
+def salas_de_nodo(node_id, salas_conocidas, config=None):
+    """Salas (de entre las conocidas) cuyo dueño es `node_id`."""
+    config = config or load_cluster_config()
+    return [s for s in salas_conocidas if dueno_de_sala(s, config) == node_id]
+
+def nodo_por_id(node_id, config=None):
+    if config is None:
+        return get_topologia().nodo(node_id)
+    return next((n for n in config["nodes"] if n["id"] == node_id), None)
@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+import time
+
+# Duración del lease del líder. El líder deja de aceptar escrituras antes de que
+# los seguidores dejen de respetarlo (margen), así nunca hay dos maestros escribiendo.
+LEASE_DURACION = 3.0
+LEASE_MARGEN = 0.5
+
+class EstadoTermino:
+    """
+    Estado de liderazgo de un nodo: término actual, voto emitido y lease.
+    El término y el voto se persisten en disco para no votar dos veces en el
+    mismo término tras un reinicio.
+    """
+    def __init__(self, ruta=None):
+        self.ruta = ruta
+        self._lock = threading.RLock()
+        self.current_term = 0
+        self.voted_for = None
+        self.leader_id = None
+        # Hasta cuándo (reloj monotónico) el líder puede escribir
+        self._lease_lider_hasta = 0.0
+        # Hasta cuándo este nodo prometió no votar por otro candidato
+        self._lease_seguidor_hasta = 0.0
+        self._cargar()
+
+    def _cargar(self):
+        if not self.ruta or not os.path.exists(self.ruta): return
+        with open(self.ruta, 'r') as f:
+            data = json.load(f)
+        self.current_term = data.get("current_term", 0)
+        self.voted_for = data.get("voted_for")
+
+    def _persistir(self):
+        if not self.ruta: return
+        tmp_path = self.ruta + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"current_term": self.current_term, "voted_for": self.voted_for}, f)
+        os.replace(tmp_path, self.ruta)
+
+    # TÉRMINOS
+
+    def observar_termino(self, term, leader_id=None):
+        """Adopta un término mayor si lo ve. Devuelve True si el término es vigente (no viejo)."""
+        with self._lock:
+            if term is None: return True
+            if term < self.current_term: return False
+            if term > self.current_term:
+                self.current_term = term
+                self.voted_for = None
+                self.leader_id = None
+                self._lease_lider_hasta = 0.0
+                self._persistir()
+            if leader_id is not None:
+                self.leader_id = leader_id
+            return True
+
+    def iniciar_candidatura(self, my_id):
+        """Pasa al siguiente término votando por sí mismo. Devuelve el término nuevo."""
+        with self._lock:
+            self.current_term += 1
+            self.voted_for = my_id
+            self.leader_id = None
+            self._lease_lider_hasta = 0.0
+            self._persistir()
+            return self.current_term
+
+    def conceder_voto(self, term, candidate_id, candidato_al_dia=True):
+        """
+        Regla de voto: un voto por término, nunca mientras se respeta el lease de otro
+        líder y nunca por un candidato que aplicó menos lotes que este nodo: toda
+        escritura confirmada está en una mayoría, así que el ganador la tiene.
+        """
+        with self._lock:
+            if term < self.current_term:
+                return False
+            if self.lease_seguidor_vigente() and self.leader_id != candidate_id:
+                return False
+            # Un líder con lease vigente tampoco vota por otros
+            if time.monotonic() < self._lease_lider_hasta:
+                return False
+            self.observar_termino(term)
+            if not candidato_al_dia:
+                return False
+            if self.voted_for in (None, candidate_id):
+                self.voted_for = candidate_id
+                self._persistir()
+                # Votar también es una promesa: no votar por otro durante un lease,
+                # así el candidato puede contar su lease desde que pidió los votos
+                self.leader_id = candidate_id
+                self._lease_seguidor_hasta = time.monotonic() + LEASE_DURACION
+                return True
+            return False
+
+    # LEASES
+
+    def asumir_liderazgo(self, term, my_id, inicio):
+        with self._lock:
+            if term != self.current_term: return False
+            self.leader_id = my_id
+            self.renovar_lease_lider(term, inicio)
+            return True
+
+    def renovar_lease_lider(self, term, inicio):
+        """`inicio` es el instante en que se enviaron los latidos confirmados por mayoría."""
+        with self._lock:
+            if term == self.current_term:
+                self._lease_lider_hasta = inicio + LEASE_DURACION - LEASE_MARGEN
+
+    def renovar_lease_seguidor(self, term, leader_id):
+        with self._lock:
+            if not self.observar_termino(term, leader_id): return False
+            self._lease_seguidor_hasta = time.monotonic() + LEASE_DURACION
+            return True
+
+    def tengo_lease(self, my_id):
+        with self._lock:
+            return self.leader_id == my_id and time.monotonic() < self._lease_lider_hasta
+
+    def instantanea(self):
+        """(líder, fin del lease de líder, término) leídos juntos, para publicarlos a otros procesos."""
+        with self._lock:
+            return self.leader_id, self._lease_lider_hasta, self.current_term
+
+    def lease_seguidor_vigente(self):
+        return time.monotonic() < self._lease_seguidor_hasta
+
+    def soltar_liderazgo(self):
+        with self._lock:
+            self._lease_lider_hasta = 0.0
+            self.leader_id = None
+
+# Estado global del proceso (análogo a CURRENT_DB_PATH en db_manager)
+_estado_actual = EstadoTermino()
+
+def set_term_context(ruta):
+    global _estado_actual
+    _estado_actual = EstadoTermino(ruta)
+    return _estado_actual
+
+def get_term_state():
+    return _estado_actual
@@ -0,0 +1,118 @@
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from app.common.log import get_logger
+
+log = get_logger("TRAZAS")
+
+# Spans recientes del proceso (se pierden los más viejos)
+CAPACIDAD_SPANS = 5000
+# Peticiones más lentas que esto guardan su árbol completo de spans
+UMBRAL_LENTA_MS = 200
+CAPACIDAD_LENTAS = 100
+
+# (trace_id, span_id) del span activo en este hilo
+_contexto = contextvars.ContextVar("traza", default=None)
+
+def _nuevo_id():
+    return f"{random.getrandbits(64):016x}"
+
+class RegistroTrazas:
+    """
+    Búfer circular de spans terminados y registro de peticiones lentas.
+    El contexto viaja en el campo "traza" de los mensajes ({"trace_id", "span_id"});
+    el StorageService devuelve sus spans en la respuesta, así el maestro arma el
+    árbol completo de una admisión (mutex, SQLite y cada ida y vuelta a un esclavo).
+    """
+    def __init__(self, capacidad=CAPACIDAD_SPANS, umbral_lenta_ms=UMBRAL_LENTA_MS):
+        self._lock = threading.Lock()
+        self.spans = deque(maxlen=capacidad)
+        self.lentas = deque(maxlen=CAPACIDAD_LENTAS)
+        self.umbral_lenta_ms = umbral_lenta_ms
+        self.node_id = None
+
+    def agregar(self, spans):
+        with self._lock:
+            self.spans.extend(spans)
+
+    def de_traza(self, trace_id):
+        with self._lock:
+            return [s for s in self.spans if s["trace_id"] == trace_id]
+
+    def exportar(self, trace_id=None, limite=500):
+        with self._lock:
+            spans = [s for s in self.spans if trace_id is None or s["trace_id"] == trace_id]
+            return {"spans": spans[-limite:], "lentas": list(self.lentas)}
+
+    def _registrar_lenta(self, raiz):
+        arbol = self.de_traza(raiz["trace_id"])
+        with self._lock:
+            self.lentas.append({"trace_id": raiz["trace_id"], "nombre": raiz["nombre"],
+                                "duracion_ms": raiz["duracion_ms"], "spans": arbol})
+        log.aviso("peticion_lenta", nombre=raiz["nombre"], ms=raiz["duracion_ms"], trace_id=raiz["trace_id"], spans=len(arbol))
+
+    @contextmanager
+    def span(self, nombre, traza_remota=None, **atributos):
+        """
+        Abre un span hijo del activo (o de `traza_remota`, si viene en el mensaje).
+        Si no hay ninguno, inicia una traza nueva; la raíz local revisa si fue lenta.
+        """
+        padre = _contexto.get()
+        if traza_remota and traza_remota.get("trace_id"):
+            trace_id, parent_id = traza_remota["trace_id"], traza_remota.get("span_id")
+        elif padre:
+            trace_id, parent_id = padre
+        else:
+            trace_id, parent_id = _nuevo_id(), None
+        span_id = _nuevo_id()
+        token = _contexto.set((trace_id, span_id))
+        inicio = time.time()
+        t0 = time.perf_counter()
+        try:
+            yield span_id
+        finally:
+            _contexto.reset(token)
+            registro = {
+                "trace_id": trace_id, "span_id": span_id, "parent_id": parent_id,
+                "nombre": nombre, "nodo": self.node_id, "inicio": inicio,
+                "duracion_ms": round((time.perf_counter() - t0) * 1000, 3),
+            }
+            if atributos: registro["atributos"] = atributos
+            with self._lock:
+                self.spans.append(registro)
+            # Raíz local (la petición que atiende este hilo): revisar si fue lenta
+            if padre is None and registro["duracion_ms"] >= self.umbral_lenta_ms:
+                self._registrar_lenta(registro)
+
+    @contextmanager
+    def subspan(self, nombre, **atributos):
+        """Span hijo solo si hay una traza activa (sin traza no hay nada que medir)."""
+        if _contexto.get() is None:
+            yield None
+            return
+        with self.span(nombre, **atributos) as span_id:
+            yield span_id
+
+    def subarbol(self, span_id):
+        """Spans de este proceso que cuelgan de `span_id` (incluido), para devolverlos al llamador."""
+        ids = {span_id}
+        resultado = []
+        with self._lock:
+            # Los hijos terminan antes que el padre: recorriendo al revés el padre aparece primero
+            for s in reversed(self.spans):
+                if s["span_id"] in ids or s["parent_id"] in ids:
+                    ids.add(s["span_id"])
+                    resultado.append(s)
+        return resultado[::-1]
+
+def contexto_actual():
+    """Contexto para propagar en un mensaje saliente (None si no hay span activo)."""
+    actual = _contexto.get()
+    return {"trace_id": actual[0], "span_id": actual[1]} if actual else None
+
+# Registro único del proceso
+TRAZAS = RegistroTrazas()
@@ -0,0 +1,126 @@
+import glob
+import os
+import sqlite3
+
+from app.data_access import db_manager
+from app.common.log import get_logger
+
+log = get_logger("ARCHIVO")
+
+# Visitas cerradas hace más de esto salen de la tabla caliente
+RETENCION_DIAS = 30
+INTERVALO_ARCHIVO = 600  # segundos entre pasadas del archivador (solo el líder)
+LOTE_ARCHIVO = 5000
+
+_ESQUEMA_ARCHIVO = """
+CREATE TABLE IF NOT EXISTS visitas (
+    id_visita INTEGER PRIMARY KEY,
+    folio TEXT,
+    id_paciente INTEGER,
+    id_doctor INTEGER,
+    id_cama INTEGER,
+    id_sala INTEGER,
+    fecha_ingreso TEXT,
+    fecha_salida TEXT,
+    estado TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_archivo_paciente ON visitas(id_paciente);
+"""
+_COLUMNAS = "id_visita, folio, id_paciente, id_doctor, id_cama, id_sala, fecha_ingreso, fecha_salida, estado"
+
+def directorio_archivo(db_path=None):
+    """data/nodo_1.db -> data/archivo_nodo_1/"""
+    db_path = db_path or db_manager.CURRENT_DB_PATH
+    base = os.path.splitext(os.path.basename(db_path))[0]
+    return os.path.join(os.path.dirname(db_path), f"archivo_{base}")
+
+def ruta_particion(mes, db_path=None):
+    """Una BD por mes de salida: visitas_2026_10.db"""
+    return os.path.join(directorio_archivo(db_path), f"visitas_{mes.replace('-', '_')}.db")
+
+def particiones(db_path=None):
+    """Meses archivados ('YYYY-MM'), en orden."""
+    rutas = glob.glob(os.path.join(directorio_archivo(db_path), "visitas_*.db"))
+    return sorted(os.path.basename(r)[len("visitas_"):-3].replace("_", "-") for r in rutas)
+
+def archivar_visitas(hasta):
+    """
+    Mueve a las BDs de archivo las visitas CERRADAS con salida anterior a `hasta`
+    ('YYYY-MM-DD HH:MM:SS'). Cada lote se copia y se borra de la tabla caliente en
+    una sola transacción (la partición va adjunta con ATTACH), y copiar es
+    INSERT OR IGNORE: repetir la operación con el mismo `hasta` es inocuo.
+    El maestro la ejecuta y la replica, así todos los nodos archivan lo mismo.
+    """
+    return _archivar("fecha_salida < ?", (hasta,), hasta=hasta)
+
+def archivar_folios(folios):
+    """
+    Mueve al archivo las visitas CERRADAS con esos folios, sin importar su fecha
+    de salida. La usa la anti-entropía cuando el líder ya no las tiene en la
+    tabla caliente: esta réplica se perdió el ARCHIVE que las movió.
+    """
+    movidas = 0
+    for i in range(0, len(folios), LOTE_ARCHIVO):
+        lote = folios[i:i + LOTE_ARCHIVO]
+        res = _archivar(f"folio IN ({','.join('?' * len(lote))})", tuple(lote))
+        if res["status"] != "OK": return res
+        movidas += res["archivadas"]
+    return {"status": "OK", "archivadas": movidas}
+
+def _archivar(condicion, params, **contexto):
+    os.makedirs(directorio_archivo(), exist_ok=True)
+    conn = db_manager.get_connection()
+    movidas = 0
+    try:
+        meses = [r[0] for r in conn.execute(
+            f"SELECT DISTINCT substr(fecha_salida, 1, 7) FROM visitas WHERE estado = 'CERRADA' "
+            f"AND fecha_salida IS NOT NULL AND {condicion}", params
+        )]
+        for mes in meses:
+            conn.execute("ATTACH DATABASE ? AS archivo", (ruta_particion(mes),))
+            try:
+                conn.executescript(_ESQUEMA_ARCHIVO.replace("EXISTS visitas", "EXISTS archivo.visitas")
+                                                   .replace("EXISTS idx_", "EXISTS archivo.idx_"))
+                while True:
+                    ids = [r[0] for r in conn.execute(
+                        f"SELECT id_visita FROM visitas WHERE estado = 'CERRADA' AND {condicion} "
+                        f"AND substr(fecha_salida, 1, 7) = ? LIMIT ?", (*params, mes, LOTE_ARCHIVO)
+                    )]
+                    if not ids: break
+                    marcas = ",".join("?" * len(ids))
+                    with conn:
+                        conn.execute(f"INSERT OR IGNORE INTO archivo.visitas ({_COLUMNAS}) "
+                                     f"SELECT {_COLUMNAS} FROM main.visitas WHERE id_visita IN ({marcas})", ids)
+                        conn.execute(f"DELETE FROM main.visitas WHERE id_visita IN ({marcas})", ids)
+                    movidas += len(ids)
+            finally:
+                conn.execute("DETACH DATABASE archivo")
+        if movidas:
+            log.info("visitas_archivadas", cantidad=movidas, particiones=len(meses), **contexto)
+        return {"status": "OK", "archivadas": movidas}
+    except Exception as e:
+        log.error("archivado_fallido", error=e)
+        return {"status": "ERROR", "msg": str(e)}
+    finally:
+        conn.close()
+
+def conexion_historica(desde=None, hasta=None):
+    """
+    Conexión de solo lectura con la BD del nodo y las particiones de archivo de
+    los meses [desde, hasta] ('YYYY-MM') adjuntas, más la vista temporal
+    `visitas_historicas` (activas + archivadas). SQLite limita cuántas BDs se
+    pueden adjuntar: para rangos más largos hay que consultar por tramos.
+    """
+    meses = [m for m in particiones() if (not desde or m >= desde) and (not hasta or m <= hasta)]
+    conn = sqlite3.connect(f"file:{db_manager.CURRENT_DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    limite = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(meses) > limite:
+        conn.close()
+        raise ValueError(f"El rango abarca {len(meses)} particiones (máximo {limite})")
+    selects = [f"SELECT {_COLUMNAS} FROM main.visitas"]
+    for i, mes in enumerate(meses):
+        conn.execute(f"ATTACH DATABASE ? AS a{i}", (f"file:{ruta_particion(mes)}?mode=ro",))
+        selects.append(f"SELECT {_COLUMNAS} FROM a{i}.visitas")
+    conn.execute("CREATE TEMP VIEW visitas_historicas AS " + " UNION ALL ".join(selects))
+    return conn
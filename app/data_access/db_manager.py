@@ -1,5 +1,12 @@
 import sqlite3
 import os
+import time
+
+from app.core.metrics import METRICAS
+from app.core.tracing import TRAZAS
+from app.common.log import get_logger
+
+log = get_logger("DB")
 
 CURRENT_DB_PATH = None
 
@@ -19,6 +26,8 @@ def get_connection():
 
 def execute_sql(sql, params=()):
     """Ejecuta INSERT, UPDATE, DELETE"""
+    operacion = sql.split(None, 1)[0].upper() if sql.strip() else "?"
+    inicio = time.perf_counter()
     conn = get_connection()
     try:
         cursor = conn.cursor()
@@ -26,10 +35,32 @@ def execute_sql(sql, params=()):
         conn.commit()
         return {"status": "OK", "id": cursor.lastrowid, "rows": cursor.rowcount}
     except Exception as e:
-        print(f"[DB Error] SQL: {sql} | Error: {e}")
+        # Sin parámetros: son datos de pacientes
+        log.error("escritura_fallida", op=operacion, error=e)
+        METRICAS.contador("sql_errores_total", op=operacion).inc()
         return {"status": "ERROR", "msg": str(e)}
     finally:
         conn.close()
+        METRICAS.histograma("sql_escritura_segundos", op=operacion).observar(time.perf_counter() - inicio)
+
+def execute_batch(ops):
+    """Ejecuta varias escrituras [(sql, params), ...] en una sola transacción: todas o ninguna."""
+    inicio = time.perf_counter()
+    conn = get_connection()
+    try:
+        filas = 0
+        for sql, params in ops:
+            filas += conn.execute(sql, tuple(params)).rowcount
+        conn.commit()
+        return {"status": "OK", "rows": filas}
+    except Exception as e:
+        conn.rollback()
+        log.error("lote_fallido", escrituras=len(ops), error=e)
+        METRICAS.contador("sql_errores_total", op="LOTE").inc()
+        return {"status": "ERROR", "msg": str(e)}
+    finally:
+        conn.close()
+        METRICAS.histograma("sql_escritura_segundos", op="LOTE").observar(time.perf_counter() - inicio)
 
 def fetch_one(sql, params=()):
     conn = get_connection()
@@ -39,7 +70,7 @@ def fetch_one(sql, params=()):
         row = cursor.fetchone()
         return row if row else None
     except Exception as e:
-        print(f"[DB Error] {e}")
+        log.error("lectura_fallida", error=e)
         return None
     finally:
         conn.close()
@@ -52,12 +83,64 @@ def fetch_all(sql, params=()):
         rows = cursor.fetchall()
         return [dict(row) for row in rows]
     except Exception as e:
-        print(f"[DB Error] {e}")
+        log.error("lectura_fallida", error=e)
         return []
     finally:
         conn.close()
 
+#   POSICIÓN DE REPLICACIÓN
+
+SQL_AVANZAR_POSICION = "UPDATE registro_replicacion SET term = ?, indice = ? WHERE id = 1"
+
+def leer_posicion():
+    """(término, índice) del último lote del líder aplicado en esta BD."""
+    fila = fetch_one("SELECT term, indice FROM registro_replicacion WHERE id = 1")
+    return (fila[0], fila[1]) if fila else (0, 0)
+
+# Orden respetando llaves foráneas (se borra en orden inverso). La posición viaja con el
+# snapshot: un nodo que se une queda justo donde estaba el líder al tomarlo
+SNAPSHOT_TABLES = ["nodos", "pacientes", "doctores", "camas", "visitas", "idempotencia", "registro_replicacion"]
+
+def export_snapshot(tables=SNAPSHOT_TABLES):
+    """Copia completa de las tablas en formato serializable a JSON."""
+    conn = get_connection()
+    try:
+        snapshot = {}
+        for table in tables:
+            cursor = conn.execute(f"SELECT * FROM {table}")
+            columns = [d[0] for d in cursor.description]
+            snapshot[table] = {"columns": columns, "rows": [list(row) for row in cursor.fetchall()]}
+        return snapshot
+    finally:
+        conn.close()
+
+def import_snapshot(snapshot):
+    """Reemplaza el contenido de las tablas por el snapshot en una sola transacción."""
+    conn = get_connection()
+    try:
+        tables = [t for t in SNAPSHOT_TABLES if t in snapshot]
+        for table in reversed(tables):
+            conn.execute(f"DELETE FROM {table}")
+        for table in tables:
+            columns = snapshot[table]["columns"]
+            placeholders = ", ".join("?" for _ in columns)
+            conn.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                snapshot[table]["rows"]
+            )
+        conn.commit()
+        return {"status": "OK"}
+    except Exception as e:
+        conn.rollback()
+        log.error("snapshot_fallido", error=e)
+        return {"status": "ERROR", "msg": str(e)}
+    finally:
+        conn.close()
+
 class DatabaseManager:
+    # BDs cuyo esquema ya se aplicó en este proceso (storage y maestro comparten la misma)
+    _esquemas_aplicados = set()
+
     def __init__(self, db_path, schema_path):
         self.db_path = db_path
         self.schema_path = schema_path
@@ -66,14 +149,27 @@ class DatabaseManager:
 
     def _init_schema(self):
         if not os.path.exists(self.schema_path): return
+        if (self.db_path, self.schema_path) in self._esquemas_aplicados: return
+        self._esquemas_aplicados.add((self.db_path, self.schema_path))
         conn = sqlite3.connect(self.db_path)
-        with open(self.schema_path, 'r') as f:
-            conn.executescript(f.read())
-        conn.close()
+        try:
+            with open(self.schema_path, 'r') as f:
+                conn.executescript(f.read())
+        except sqlite3.IntegrityError as e:
+            # BD previa con folios repetidos: el índice único no se puede crear
+            log.aviso("esquema_parcial", bd=self.db_path, error=e)
+        finally:
+            conn.close()
 
     def ejecutar_escritura(self, sql, params):
-        return execute_sql(sql, params) # Redirige a la función global
+        with TRAZAS.subspan("sql.escritura"):
+            return execute_sql(sql, params) # Redirige a la función global
+
+    def ejecutar_lote(self, ops):
+        with TRAZAS.subspan("sql.lote"):
+            return execute_batch(ops)
 
     def ejecutar_lectura(self, sql, params):
-        res = fetch_all(sql, params)
+        with TRAZAS.subspan("sql.lectura"):
+            res = fetch_all(sql, params)
         return {"status": "OK", "data": res}
\ No newline at end of file
@@ -0,0 +1,180 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+from app.data_access import db_manager
+from app.data_access.archive import archivar_folios
+
+# Tablas comparadas entre réplicas y la llave que las identifica en todas
+TABLAS_MERKLE = {"pacientes": "id_paciente", "doctores": "id_doctor", "camas": "id_cama", "visitas": "folio"}
+# Llaves de texto: la hoja sale de un hash de la llave, no de su valor
+LLAVES_TEXTO = {"visitas"}
+# Columnas que cada réplica asigna por su cuenta (AUTOINCREMENT): ni se comparan ni se copian
+COLUMNAS_LOCALES = {"visitas": {"id_visita"}}
+FILAS_POR_HOJA = 256
+# Una comparación desciende el árbol en varias peticiones: todas deben ver la misma versión
+VIGENCIA_ARBOL = 10.0
+
+_VACIO = hashlib.blake2b(b"", digest_size=8).digest()
+
+def _hash(datos):
+    return hashlib.blake2b(datos, digest_size=8).digest()
+
+def hojas_para(tamano):
+    """Número de hojas (potencia de 2) que cubre las llaves 0..tamano."""
+    necesarias = tamano // FILAS_POR_HOJA + 1
+    hojas = 1
+    while hojas < necesarias:
+        hojas *= 2
+    return hojas
+
+def rango_hoja(hoja):
+    """Llaves enteras [desde, hasta] que cubre la hoja."""
+    return hoja * FILAS_POR_HOJA, (hoja + 1) * FILAS_POR_HOJA - 1
+
+def _hoja_texto(llave, hojas):
+    return int.from_bytes(_hash(llave.encode("utf-8")), "big") % hojas
+
+def hoja_de(tabla, llave, hojas):
+    if tabla in LLAVES_TEXTO:
+        return _hoja_texto(llave, hojas)
+    return llave // FILAS_POR_HOJA
+
+def tamano(tabla):
+    """Llave más alta; con llave de texto, el número de filas. Fija cuántas hojas tiene el árbol."""
+    llave = TABLAS_MERKLE[tabla]
+    consulta = "COUNT(*)" if tabla in LLAVES_TEXTO else f"COALESCE(MAX({llave}), 0)"
+    fila = db_manager.fetch_one(f"SELECT {consulta} FROM {tabla}")
+    return fila[0] if fila else 0
+
+def columnas_comparadas(conn, tabla):
+    locales = COLUMNAS_LOCALES.get(tabla, set())
+    return [c[1] for c in conn.execute(f"PRAGMA table_info({tabla})") if c[1] not in locales]
+
+def _filtro_hojas(conn, tabla, hojas, primera, ultima):
+    """Condición SQL (y sus parámetros) de las filas que caen en las hojas [primera, ultima]."""
+    llave = TABLAS_MERKLE[tabla]
+    if tabla not in LLAVES_TEXTO:
+        return f"{llave} BETWEEN ? AND ?", (rango_hoja(primera)[0], rango_hoja(ultima)[1])
+    conn.create_function("hoja_merkle", 2, _hoja_texto, deterministic=True)
+    return f"hoja_merkle({llave}, ?) BETWEEN ? AND ?", (hojas, primera, ultima)
+
+def construir_arbol(tabla, hojas):
+    """
+    Árbol de Merkle completo en forma de heap: el nodo i tiene hijos 2i+1 y 2i+2,
+    la raíz es 0 y las hojas ocupan [hojas-1, 2*hojas-2]. Cada hoja resume las
+    filas de FILAS_POR_HOJA llaves enteras consecutivas (o las llaves de texto
+    cuyo hash cae en ella), en orden de llave; una hoja sin filas vale _VACIO.
+    """
+    llave = TABLAS_MERKLE[tabla]
+    resumenes = {}
+    conn = db_manager.get_connection()
+    try:
+        columnas = columnas_comparadas(conn, tabla)
+        cursor = conn.execute(f"SELECT {', '.join(columnas)} FROM {tabla} ORDER BY {llave}")
+        posicion = columnas.index(llave)
+        while True:
+            filas = cursor.fetchmany(5000)
+            if not filas: break
+            for fila in filas:
+                hoja = hoja_de(tabla, fila[posicion], hojas)
+                if hoja >= hojas: continue  # insertada después de fijar el tamaño: entra en la siguiente pasada
+                if hoja not in resumenes:
+                    resumenes[hoja] = hashlib.blake2b(digest_size=8)
+                resumenes[hoja].update(repr(tuple(fila)).encode("utf-8"))
+    finally:
+        conn.close()
+
+    arbol = [None] * (hojas - 1) + [resumenes[i].digest() if i in resumenes else _VACIO for i in range(hojas)]
+    for i in range(hojas - 2, -1, -1):
+        arbol[i] = _hash(arbol[2 * i + 1] + arbol[2 * i + 2])
+    return arbol
+
+class CacheArboles:
+    """Árboles recientes por (tabla, hojas); así un descenso completo usa una sola lectura de la tabla."""
+    def __init__(self, vigencia=VIGENCIA_ARBOL):
+        self.vigencia = vigencia
+        self._lock = threading.Lock()
+        self._arboles = {}
+
+    def obtener(self, tabla, hojas, nuevo=False):
+        with self._lock:
+            entrada = self._arboles.get((tabla, hojas))
+            if nuevo or entrada is None or time.monotonic() - entrada[0] > self.vigencia:
+                entrada = (time.monotonic(), construir_arbol(tabla, hojas))
+                self._arboles[(tabla, hojas)] = entrada
+            return entrada[1]
+
+    def invalidar(self):
+        with self._lock:
+            self._arboles.clear()
+
+def filas_hojas(tabla, hojas, primera, ultima):
+    """Columnas y filas de las hojas [primera, ultima], para mandarlas a una réplica."""
+    llave = TABLAS_MERKLE[tabla]
+    conn = db_manager.get_connection()
+    try:
+        columnas = columnas_comparadas(conn, tabla)
+        filtro, params = _filtro_hojas(conn, tabla, hojas, primera, ultima)
+        cursor = conn.execute(f"SELECT {', '.join(columnas)} FROM {tabla} WHERE {filtro} ORDER BY {llave}", params)
+        return columnas, [tuple(f) for f in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def reparar_hojas(tabla, hojas, primera, ultima, columnas, filas):
+    """
+    Lleva a las hojas [primera, ultima] las filas del maestro, en una transacción:
+    las que faltan se insertan y las distintas se actualizan en sitio. No se borra
+    nada: una fila que el maestro no tiene pudo ser una escritura que solo esta
+    réplica recibió, así que se conserva y se reporta ("conservadas"). Una visita
+    CERRADA que el maestro ya no tiene sí sale de la tabla caliente: lo normal es que
+    la archivó y esta réplica no recibió el ARCHIVE, así que se archiva aquí también.
+    Una fila del maestro que choca en otra llave única con una conservada (el mismo
+    seguro con otro id) no se aplica y se reporta ("en_conflicto").
+    """
+    llave = TABLAS_MERKLE[tabla]
+    posicion = columnas.index(llave)
+    llaves_lider = {f[posicion] for f in filas}
+    archivadas = 0
+    conn = db_manager.get_connection()
+    try:
+        filtro, params = _filtro_hojas(conn, tabla, hojas, primera, ultima)
+        cerrada = "estado = 'CERRADA'" if tabla == "visitas" else "0"
+        sobrantes = {r[0]: r[1] for r in conn.execute(f"SELECT {llave}, {cerrada} FROM {tabla} WHERE {filtro}", params)
+                     if r[0] not in llaves_lider}
+    finally:
+        conn.close()
+    cerradas = [k for k, cerrada in sobrantes.items() if cerrada]
+    if cerradas:
+        res = archivar_folios(cerradas)
+        if res["status"] != "OK": return res
+        archivadas = res["archivadas"]
+    conservadas = sorted(k for k, cerrada in sobrantes.items() if not cerrada)
+
+    actualizar = ", ".join(f"{c} = excluded.{c}" for c in columnas if c != llave)
+    upsert = (f"INSERT INTO {tabla} ({', '.join(columnas)}) VALUES ({', '.join('?' for _ in columnas)}) "
+              f"ON CONFLICT({llave}) DO UPDATE SET {actualizar}")
+    en_conflicto = []
+    conn = db_manager.get_connection()
+    try:
+        # Las llaves foráneas se validan al confirmar (el pragma dura solo la transacción)
+        conn.execute("BEGIN")
+        conn.execute("PRAGMA defer_foreign_keys = ON")
+        try:
+            conn.executemany(upsert, filas)
+        except sqlite3.IntegrityError:
+            # Fila por fila para saber cuál choca; las que ya entraron se reescriben igual
+            for fila in filas:
+                try:
+                    conn.execute(upsert, fila)
+                except sqlite3.IntegrityError:
+                    en_conflicto.append(fila[posicion])
+        conn.commit()
+        return {"status": "OK", "filas": len(filas) - len(en_conflicto), "archivadas": archivadas,
+                "conservadas": conservadas, "en_conflicto": en_conflicto}
+    except Exception as e:
+        conn.rollback()
+        return {"status": "ERROR", "msg": str(e)}
+    finally:
+        conn.close()
@@ -6,11 +6,15 @@ import threading
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from app.services.storage_service import StorageService
-from app.services.master_service import start_master_listener
+from app.services.master_service import MasterService
 from app.services.election_service import ElectionService
 from app.core.detector_failure import DetectorFallas 
 from app.data_access.db_manager import set_db_context, DatabaseManager 
-from app.common.config_loader import load_cluster_config
+from app.core.term_state import set_term_context, get_term_state
+from app.core.tracing import TRAZAS
+from app.core.hot_state import EstadoCaliente
+from app.common.config_loader import load_cluster_config, subscribe_topology_changes, update_cluster_config, set_membership_context
+from app.services.membership_service import solicitar_union, solicitar_salida
 
 DB_DIR = "data"
 SCHEMA_PATH = "config/schema.sql"
@@ -19,9 +23,11 @@ SCHEMA_PATH = "config/schema.sql"
 current_master_id = None
 soy_maestro = False
 election_service = None
+servicio_maestro = None
 detector = None
 my_node_id = None
 my_node_config = None
+fuera_del_cluster = threading.Event()
 
 # --- FUNCIONES AUXILIARES
 
@@ -33,6 +39,33 @@ def preparar_topologia_detector(config):
         mapa_nodos[str(node["id"])] = (node["host"], puerto_detector)
     return mapa_nodos
 
+def al_cambiar_topologia(config):
+    """Se ejecuta tras cada JOIN/LEAVE replicado: recarga la topología en memoria."""
+    ids = [n["id"] for n in config["nodes"]]
+    print(f"\n [TOPOLOGÍA] Membresía v{config.get('membership_version', 0)}: nodos {ids}")
+    if my_node_id not in ids:
+        retirar_nodo()
+        return
+    if detector:
+        detector.actualizar_nodos(preparar_topologia_detector(config))
+
+def retirar_nodo():
+    """Este nodo ya no es miembro (LEAVE): deja de votar, vigilar y atender como maestro."""
+    global soy_maestro
+    if fuera_del_cluster.is_set(): return
+    print(f"\n [TOPOLOGÍA] El Nodo {my_node_id} salió del clúster. Deteniendo servicios...")
+    soy_maestro = False
+    if election_service:
+        election_service.detener()
+    if detector:
+        detector.detener()
+    # El bucle principal termina el proceso (y con él sus trabajadores) tras responder el MEMBERSHIP
+    fuera_del_cluster.set()
+
+def _parse_direccion(texto):
+    host, port = texto.rsplit(":", 1)
+    return host, int(port)
+
 # CALLBACKS DE EVENTOS (Ciclo de Vida)
 
 def on_me_convierto_en_maestro():
@@ -44,13 +77,9 @@ def on_me_convierto_en_maestro():
     current_master_id = my_node_id
     print(f"\n [ROL] ¡He ganado la elección! Ascendiendo a MAESTRO (Nodo {my_node_id})...")
     
-    # Iniciar servicio Maestro 
-    t_maestro = threading.Thread(
-        target=start_master_listener, 
-        args=(my_node_config['port_manager'], my_node_id), 
-        daemon=True
-    )
-    t_maestro.start()
+    # El listener ya escucha desde el arranque y los índices están calientes
+    if servicio_maestro:
+        servicio_maestro.promover()
     
     # Actualizar detector: Ahora yo vigilo a los esclavos
     if detector:
@@ -68,6 +97,15 @@ def on_nuevo_maestro_electo(new_master_id):
     if detector:
         detector.set_target_maestro(str(new_master_id))
 
+def on_pierdo_liderazgo():
+    """Se ejecuta cuando el lease expira o aparece un término mayor."""
+    global soy_maestro, current_master_id
+    print(f"\n [ROL] Perdí el lease de líder. Degradando a ESCLAVO (Nodo {my_node_id})...")
+    soy_maestro = False
+    current_master_id = None
+    if detector:
+        detector.set_rol_maestro(False)
+
 def al_detectar_fallo_maestro(id_nodo_caido):
     """Callback que dispara el Detector de Fallas cuando alguien muere."""
     global current_master_id
@@ -77,7 +115,7 @@ def al_detectar_fallo_maestro(id_nodo_caido):
     # Convertimos a string para asegurar comparación correcta
     if str(id_nodo_caido) == str(current_master_id):
         print(f" [ALERTA CRÍTICA] ¡El Maestro (Nodo {id_nodo_caido}) ha muerto!")
-        print(" Iniciando Algoritmo de Elección (Bully)...")
+        print(" Iniciando elección por términos...")
         
         if election_service:
             election_service.start_election()
@@ -86,18 +124,21 @@ def al_detectar_fallo_maestro(id_nodo_caido):
 
 # MAIN
 
-def main(node_id):
-    global election_service, detector, my_node_id, my_node_config, current_master_id, soy_maestro
+def main(node_id, join_master=None, join_node=None, procesos=0):
+    global election_service, detector, my_node_id, my_node_config, current_master_id, soy_maestro, servicio_maestro
     
     my_node_id = node_id
     print(f"\n===  INICIANDO NODO {node_id} ===\n")
     
-    # Cargar Configuración
+    # Cargar Configuración: la versionada es la semilla, la membresía vigente es la de este nodo
+    set_membership_context(os.path.join(DB_DIR, f"nodo_{node_id}_membresia.json"))
     config = load_cluster_config()
     # Buscar mi configuración específica
     my_node_config = next((n for n in config["nodes"] if n["id"] == node_id), None)
+    if join_node:
+        my_node_config = join_node
     if not my_node_config:
-        print(f" Error: ID {node_id} no encontrado en configuración.")
+        print(f" Error: ID {node_id} no encontrado en configuración (use --join para unirse).")
         return
 
     current_master_id = config["initial_master_id"]
@@ -107,17 +148,57 @@ def main(node_id):
     if not os.path.exists(DB_DIR): os.makedirs(DB_DIR)
     ruta_db = os.path.join(DB_DIR, f"nodo_{node_id}.db")
     set_db_context(ruta_db)
+    set_term_context(os.path.join(DB_DIR, f"nodo_{node_id}_term.json"))
+    TRAZAS.node_id = node_id
     
     # Si no existe, la creamos
     if not os.path.exists(ruta_db): 
         DatabaseManager(ruta_db, SCHEMA_PATH)
 
-    # SERVICIO DE ALMACENAMIENTO (Siempre activo, puerto 900X)
-    servicio_storage = StorageService(ruta_db, my_node_config["port_db"], "0.0.0.0")
+    # ÍNDICES DEL MAESTRO: se construyen ya y la replicación los mantiene al día
+    estado_caliente = EstadoCaliente()
+
+    # SERVICIO DE ALMACENAMIENTO (Siempre activo, puerto 900X): el puerto se abre
+    # antes de cargar los índices; lo que llegue mientras espera en el backlog
+    servicio_storage = StorageService(ruta_db, my_node_config["port_db"], "0.0.0.0", estado_caliente)
+    servicio_storage.escuchar()
+    estado_caliente.cargar_desde_bd(servicio_storage.db)
     threading.Thread(target=servicio_storage.start, daemon=True).start()
+
+    # ALTA EN CALIENTE: pedir al maestro el snapshot y la nueva membresía
+    if join_master:
+        servicio_storage.begin_bootstrap()
+        try:
+            nueva_config, snapshot, current_master_id = solicitar_union(join_master[0], join_master[1], my_node_config)
+        except Exception as e:
+            print(f" Error: no fue posible unirse al clúster: {e}")
+            return
+        update_cluster_config(nueva_config)
+        servicio_storage.finish_bootstrap(snapshot)
+        config = load_cluster_config()
+        print(f" Unido al clúster. Nodos: {[n['id'] for n in config['nodes']]}")
     
+    # SERVICIO MAESTRO (warm standby, puerto 800X): escucha desde ya y responde
+    # NOT_LEADER hasta que este nodo obtenga el lease
+    servicio_maestro = MasterService(node_id, ruta_db, my_node_config["port_manager"], estado_caliente, reuseport=procesos > 0)
+    threading.Thread(target=servicio_maestro.start, daemon=True).start()
+
+    # MODO MULTIPROCESO: más procesos en el mismo puerto para las lecturas;
+    # las escrituras vuelven a este proceso, dueño del estado de asignación
+    if procesos > 0:
+        from app.services.master_workers import EspejoLease, publicar_lease, lanzar_trabajadores, ruta_canal
+        from app.core.admission_control import LimitadorCompartido
+        espejo = EspejoLease()
+        espejo.publicar(get_term_state())
+        # Una sola cubeta por cliente para todos los procesos del puerto
+        servicio_maestro.limitador = LimitadorCompartido.desde_config(load_cluster_config())
+        threading.Thread(target=servicio_maestro.recibir_delegadas, args=(ruta_canal(node_id),), daemon=True).start()
+        threading.Thread(target=publicar_lease, args=(espejo, get_term_state()), daemon=True).start()
+        lanzar_trabajadores(node_id, ruta_db, my_node_config["port_manager"], procesos, espejo,
+                            servicio_maestro.limitador.memoria)
+
     # SERVICIO DE ELECCIÓN (Siempre activo, puerto 910X)
-    election_service = ElectionService(node_id, on_me_convierto_en_maestro, on_nuevo_maestro_electo)
+    election_service = ElectionService(node_id, on_me_convierto_en_maestro, on_nuevo_maestro_electo, on_pierdo_liderazgo)
     election_service.start()
 
     # DETECTOR DE FALLAS (Siempre activo, puerto 820X)
@@ -134,23 +215,45 @@ def main(node_id):
         al_detectar_fallo=al_detectar_fallo_maestro
     )
     detector.iniciar()
+    subscribe_topology_changes(al_cambiar_topologia)
 
-    # LÓGICA DE MAESTRO INICIAL
-    print(f"Iniciando nodo. Estado: Indeterminado. Buscando líder...")
-    if election_service:
-        election_service.start_election()
-    else:
+    # LÓGICA DE MAESTRO INICIAL: el servicio de elección primero pregunta por un
+    # líder vigente y solo se postula si no lo hay (no bloquea el arranque)
+    if join_master:
+        # Ya conocemos al maestro por la respuesta del JOIN
         print(f" Iniciando como Esclavo (Monitor del Maestro {current_master_id})")
+    else:
+        print(f"Iniciando nodo. Estado: Indeterminado. Buscando líder...")
 
     # BUCLE PRINCIPAL
     try:
-        while True: time.sleep(1)
+        while not fuera_del_cluster.wait(1): pass
+        time.sleep(1)
+        print("\n Nodo fuera del clúster: apagando.")
     except KeyboardInterrupt:
         print("\n Apagando nodo...")
         detector.detener()
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Uso: python -m app.main <ID>")
+    import argparse
+    parser = argparse.ArgumentParser(description="Nodo del sistema distribuido de urgencias")
+    parser.add_argument("id", type=int, help="ID de este nodo")
+    parser.add_argument("--join", metavar="HOST:PUERTO", help="Unirse en caliente vía el maestro indicado")
+    parser.add_argument("--leave", metavar="HOST:PUERTO", help="Dar de baja este nodo vía el maestro indicado y salir")
+    parser.add_argument("--host", default="127.0.0.1", help="IP anunciada al unirse")
+    parser.add_argument("--port-db", type=int, help="Puerto de almacenamiento al unirse")
+    parser.add_argument("--port-manager", type=int, help="Puerto de gestión al unirse")
+    parser.add_argument("--procesos", type=int, default=0, help="Procesos trabajadores extra para el puerto del maestro (Linux)")
+    args = parser.parse_args()
+
+    if args.leave:
+        host, port = _parse_direccion(args.leave)
+        solicitar_salida(host, port, args.id)
+        print(f"Nodo {args.id} dado de baja del clúster; el nodo se apaga al recibir la nueva membresía.")
+    elif args.join:
+        if not (args.port_db and args.port_manager):
+            parser.error("--join requiere --port-db y --port-manager")
+        nodo = {"id": args.id, "host": args.host, "port_db": args.port_db, "port_manager": args.port_manager}
+        main(args.id, join_master=_parse_direccion(args.join), join_node=nodo, procesos=args.procesos)
     else:
-        main(int(sys.argv[1]))
\ No newline at end of file
+        main(args.id, procesos=args.procesos)
\ No newline at end of file
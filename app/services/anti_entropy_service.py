@@ -0,0 +1,168 @@
+import socket
+import time
+from contextlib import nullcontext
+
+from app.common.protocol import send_json, recv_json, codecs_disponibles
+from app.common.config_loader import get_topologia
+from app.common.constants import MSG_OK, MSG_MERKLE, MSG_REPAIR, MSG_POSITION
+from app.core.term_state import get_term_state
+from app.core.sharding import sharding_habilitado
+from app.core.metrics import METRICAS
+from app.common.log import get_logger
+from app.data_access import merkle
+from app.data_access.db_manager import leer_posicion
+from app.services.replication_service import REGISTRO
+
+log = get_logger("ANTIENTROPIA")
+
+INTERVALO_ANTIENTROPIA = 60  # segundos entre revisiones (solo el líder)
+ANTIENTROPIA_TIMEOUT = 5
+# Hojas contiguas que se reparan en un solo mensaje
+HOJAS_POR_REPARACION = 16
+
+class ServicioAntiEntropia:
+    """
+    Compara las tablas de cada réplica con las del líder mediante árboles de Merkle
+    y reescribe solo los rangos de llaves que difieren. Nunca borra: las filas que la
+    réplica tiene y el líder no se conservan y se reportan. El descenso pide los hashes
+    de los nodos que no coinciden, nivel por nivel: si las réplicas están al día
+    basta la raíz (8 bytes por tabla).
+
+    Las reparaciones se hacen con el mutex de asignación tomado: como las
+    escrituras se replican dentro de ese mutex, ninguna está a medio camino
+    mientras se copian las filas del líder.
+
+    También pone al día la posición de replicación de una réplica que perdió
+    lotes que el líder ya no guarda (ver RegistroLotes).
+    """
+    def __init__(self, node_id, mutex_escrituras):
+        self.node_id = node_id
+        self.mutex = mutex_escrituras
+
+    def tablas(self):
+        # Con sharding, camas y visitas las escribe el dueño de cada sala: el líder no es la referencia
+        if sharding_habilitado():
+            return ["pacientes", "doctores"]
+        return list(merkle.TABLAS_MERKLE)
+
+    def revisar(self):
+        """Una pasada sobre todas las réplicas vivas; devuelve lo reparado por nodo."""
+        resultado = {}
+        for nodo in get_topologia().otros(self.node_id):
+            try:
+                resultado[nodo["id"]] = self.revisar_nodo(nodo)
+            except (OSError, ValueError) as e:
+                resultado[nodo["id"]] = {"error": str(e)}
+        return resultado
+
+    def revisar_nodo(self, nodo):
+        reporte = {}
+        if self._pasada(nodo, reporte):
+            self._alinear_posicion(nodo, reporte)
+        return reporte
+
+    def _pasada(self, nodo, reporte, con_mutex=True):
+        """Compara y repara todas las tablas; True si ninguna quedó fallida."""
+        # Una tabla que no se pudo reparar no detiene a las demás. Se reintenta una vez al
+        # final: una visita no entra mientras a la réplica le falte su paciente
+        pendientes = self.tablas()
+        for intento in range(2):
+            pendientes = [tabla for tabla in pendientes if not self._revisar_tabla(nodo, tabla, reporte, intento, con_mutex)]
+            if not pendientes: break
+        return not pendientes
+
+    def _alinear_posicion(self, nodo, reporte):
+        """
+        Sin su posición al día, una réplica rechaza los lotes siguientes y no cuenta
+        para la mayoría. Tras la pasada se repite con las escrituras detenidas (ya solo
+        quedan las diferencias de los últimos segundos) y, con todas las filas del líder
+        en la réplica, se le fija la posición del líder.
+        """
+        if tuple(self._pedir(nodo, {"type": MSG_POSITION})["posicion"]) == leer_posicion(): return
+        with self.mutex, REGISTRO.lock:
+            estado = get_term_state()
+            if not estado.tengo_lease(self.node_id): return
+            remota = tuple(self._pedir(nodo, {"type": MSG_POSITION})["posicion"])
+            posicion = leer_posicion()
+            if remota == posicion: return
+            if not self._pasada(nodo, reporte, con_mutex=False) or not estado.tengo_lease(self.node_id): return
+            self._pedir(nodo, {"type": MSG_POSITION, "fijar": list(posicion), "term": estado.current_term})
+        reporte["posicion"] = {"antes": list(remota), "ahora": list(posicion)}
+        METRICAS.contador("antientropia_posiciones_alineadas_total").inc()
+        log.aviso("posicion_alineada", nodo=nodo["id"], antes=list(remota), ahora=list(posicion))
+
+    def _revisar_tabla(self, nodo, tabla, reporte, intento, con_mutex=True):
+        inicio = time.perf_counter()
+        try:
+            hojas, bytes_recibidos, diferentes = self._comparar(nodo, tabla)
+            reparadas, conservadas, en_conflicto = self._reparar(nodo, tabla, hojas, diferentes, con_mutex) if diferentes else (0, [], [])
+        except ValueError as e:
+            log.error("reparacion_fallida", nodo=nodo["id"], tabla=tabla, intento=intento + 1, error=e)
+            reporte[tabla] = {"error": str(e)}
+            return False
+        METRICAS.histograma("antientropia_segundos", tabla=tabla).observar(time.perf_counter() - inicio)
+        if diferentes:
+            METRICAS.contador("antientropia_rangos_reparados_total", tabla=tabla).inc(len(diferentes))
+            log.aviso("divergencia_reparada", nodo=nodo["id"], tabla=tabla, hojas=len(diferentes), filas=reparadas)
+        if conservadas or en_conflicto:
+            # Filas que solo tiene la réplica: pueden ser escrituras que el líder perdió, las revisa un humano
+            METRICAS.contador("antientropia_filas_conservadas_total", tabla=tabla).inc(len(conservadas) + len(en_conflicto))
+            log.aviso("filas_solo_en_replica", nodo=nodo["id"], tabla=tabla, conservadas=conservadas, en_conflicto=en_conflicto)
+        reporte[tabla] = {"hojas": hojas, "hojas_diferentes": len(diferentes),
+                          "filas_reparadas": reparadas, "bytes_digest": bytes_recibidos,
+                          "conservadas": conservadas, "en_conflicto": en_conflicto}
+        return True
+
+    def _pedir(self, nodo, mensaje):
+        with socket.create_connection((nodo["host"], nodo["port_db"]), timeout=ANTIENTROPIA_TIMEOUT) as sock:
+            # Los hashes de un nivel profundo y los acuses pueden ser grandes: respuesta comprimida
+            send_json(sock, dict(mensaje, compresion=codecs_disponibles()))
+            respuesta = recv_json(sock)
+        if not respuesta or respuesta.get("status") != MSG_OK:
+            raise ValueError(f"Nodo {nodo['id']}: {respuesta and (respuesta.get('msg') or respuesta.get('status'))}")
+        return respuesta
+
+    def _comparar(self, nodo, tabla):
+        """Desciende por los nodos distintos; devuelve (hojas, bytes recibidos, hojas que difieren)."""
+        remoto = self._pedir(nodo, {"type": MSG_MERKLE, "tabla": tabla})
+        hojas = merkle.hojas_para(max(merkle.tamano(tabla), remoto["tamano"]))
+        local = merkle.construir_arbol(tabla, hojas)
+        primera_hoja = hojas - 1
+
+        pendientes, diferentes, recibidos = [0], [], 0
+        while pendientes:
+            respuesta = self._pedir(nodo, {"type": MSG_MERKLE, "tabla": tabla, "hojas": hojas, "indices": pendientes})
+            recibidos += 8 * len(respuesta["hashes"])
+            siguientes = []
+            for i, h in zip(pendientes, respuesta["hashes"]):
+                if bytes.fromhex(h) == local[i]: continue
+                if i >= primera_hoja:
+                    diferentes.append(i - primera_hoja)
+                else:
+                    siguientes += [2 * i + 1, 2 * i + 2]
+            pendientes = siguientes
+        return hojas, recibidos, sorted(diferentes)
+
+    def _reparar(self, nodo, tabla, hojas, hojas_diferentes, con_mutex=True):
+        """
+        Manda las filas del líder por tramos de hojas contiguas (`con_mutex`: tomarlo en
+        cada tramo). Devuelve (filas enviadas, llaves conservadas, llaves en conflicto).
+        """
+        tramos = []
+        for hoja in hojas_diferentes:
+            if tramos and hoja == tramos[-1][1] + 1 and hoja - tramos[-1][0] < HOJAS_POR_REPARACION:
+                tramos[-1][1] = hoja
+            else:
+                tramos.append([hoja, hoja])
+        filas_enviadas, conservadas, en_conflicto = 0, [], []
+        for primera, ultima in tramos:
+            with self.mutex if con_mutex else nullcontext():
+                # Se revalida el lease: un líder depuesto no debe pisar a las réplicas
+                if not get_term_state().tengo_lease(self.node_id): break
+                columnas, filas = merkle.filas_hojas(tabla, hojas, primera, ultima)
+                respuesta = self._pedir(nodo, {"type": MSG_REPAIR, "tabla": tabla, "hojas": hojas, "primera": primera, "ultima": ultima,
+                                   "columnas": columnas, "filas": filas, "term": get_term_state().current_term})
+            filas_enviadas += len(filas)
+            conservadas += respuesta.get("conservadas", [])
+            en_conflicto += respuesta.get("en_conflicto", [])
+        return filas_enviadas, conservadas, en_conflicto
@@ -1,37 +1,80 @@
 import socket
 import threading
-import json
+import random
 import time
-from app.common.config_loader import load_cluster_config
+from app.common.config_loader import get_topologia
 from app.common.protocol import send_json, recv_json
-from app.common.constants import MSG_ELECTION, MSG_ELECTION_OK, MSG_COORDINATOR
+from app.common.constants import (
+    MSG_REQUEST_VOTE, MSG_VOTE, MSG_COORDINATOR, MSG_LEADER_HEARTBEAT, MSG_HEARTBEAT_ACK,
+    MSG_LEADER_QUERY, MSG_LEADER_INFO
+)
+from app.core.term_state import get_term_state, LEASE_DURACION
+from app.data_access.db_manager import leer_posicion
+from app.common.log import get_logger
+
+log = get_logger("ELECCION")
+
+RPC_TIMEOUT = 0.5
+INTERVALO_LATIDO = LEASE_DURACION / 3
+INTERVALO_VIGILANCIA = 0.25
+# Espera antes de postularse por cada nodo con ID mayor: conserva la preferencia
+# del Bully por el ID más alto sin tormentas de mensajes ni votos divididos
+PRIORIDAD_POR_RANGO = 0.15
 
 class ElectionService:
-    def __init__(self, my_id, on_promotion_callback, on_new_master_callback):
+    """
+    Elección por términos: el candidato pide votos a todos en paralelo y gana con
+    mayoría en un solo viaje de ida y vuelta. El líder mantiene un lease renovado
+    con latidos confirmados por mayoría; sin lease no acepta escrituras.
+    """
+    def __init__(self, my_id, on_promotion_callback, on_new_master_callback, on_demotion_callback=None):
         self.my_id = my_id
-        self.config = load_cluster_config()
-        self.my_info = next(n for n in self.config["nodes"] if n["id"] == my_id)
+        self.my_info = get_topologia().nodo(my_id)
         self.port = self.my_info["port_db"] + 100 # Puerto 910X
-        
-        self.on_promotion = on_promotion_callback    
-        self.on_new_master = on_new_master_callback   
-        
+
+        self.on_promotion = on_promotion_callback
+        self.on_new_master = on_new_master_callback
+        self.on_demotion = on_demotion_callback
+
+        self.estado = get_term_state()
         self.running = True
-        self.election_in_progress = False
+        self.soy_lider = False
+        self._lider_notificado = None
+        self._lock_eleccion = threading.Lock()
+        self._server = None
+
+    @property
+    def election_in_progress(self):
+        return self._lock_eleccion.locked()
+
+    def _mayoria(self):
+        # Siempre la membresía vigente (puede cambiar con JOIN/LEAVE)
+        return get_topologia().mayoria()
 
     def start(self):
         threading.Thread(target=self._listen, daemon=True).start()
+        threading.Thread(target=self._vigilar_lider, daemon=True).start()
+        threading.Thread(target=self._enviar_latidos, daemon=True).start()
+
+    def detener(self):
+        """Tras salir del clúster: ni votar, ni postularse, ni mandar latidos."""
+        self.running = False
+        if self.soy_lider:
+            self._dejar_liderazgo("el nodo salió del clúster")
+        if self._server:
+            self._server.close()
 
     def _listen(self):
-        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server = self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         server.bind(("0.0.0.0", self.port))
         server.listen(5)
-        print(f"[Elección] Escuchando en puerto {self.port}")
+        log.info("escuchando", puerto=self.port)
 
         while self.running:
             try:
                 conn, _ = server.accept()
-                threading.Thread(target=self._handle_message, args=(conn,)).start()
+                threading.Thread(target=self._handle_message, args=(conn,), daemon=True).start()
             except:
                 break
 
@@ -39,75 +82,161 @@ class ElectionService:
         try:
             msg = recv_json(conn)
             if not msg: return
-            
+
             msg_type = msg.get("type")
             sender_id = msg.get("sender_id")
+            term = msg.get("term", 0)
+            # Un nodo dado de baja (o que nunca entró) no vota ni es reconocido como líder
+            miembro = self.running and get_topologia().nodo(sender_id) is not None
+            if msg_type in (MSG_REQUEST_VOTE, MSG_COORDINATOR, MSG_LEADER_HEARTBEAT) and not miembro:
+                log.aviso("remitente_ajeno", tipo=msg_type, remitente=sender_id, term=term)
+
+            if msg_type == MSG_REQUEST_VOTE:
+                # Posición (término, índice) del último lote que aplicó el candidato contra la de este nodo
+                al_dia = tuple(msg.get("posicion") or (0, 0)) >= leer_posicion()
+                concedido = miembro and self.estado.conceder_voto(term, sender_id, al_dia)
+                log.info("voto", candidato=sender_id, term=term, al_dia=al_dia, concedido=concedido)
+                send_json(conn, {"type": MSG_VOTE, "granted": concedido,
+                                 "term": self.estado.current_term, "sender_id": self.my_id})
+
+            elif msg_type in (MSG_COORDINATOR, MSG_LEADER_HEARTBEAT):
+                vigente = miembro and sender_id != self.my_id and self.estado.renovar_lease_seguidor(term, sender_id)
+                if vigente:
+                    self._reconocer_lider(sender_id, term)
+                send_json(conn, {"type": MSG_HEARTBEAT_ACK, "ok": vigente,
+                                 "term": self.estado.current_term, "sender_id": self.my_id})
 
-            if msg_type == MSG_ELECTION:
-                print(f"[Elección] Recibido desafío de Nodo {sender_id}")
-                if sender_id < self.my_id:
-                    send_json(conn, {"type": MSG_ELECTION_OK, "sender_id": self.my_id})
-                    self.start_election() # Yo tomo el relevo
-            
-            elif msg_type == MSG_COORDINATOR:
-                print(f"[Elección] Nuevo Líder Es el Nodo {sender_id}")
-                self.election_in_progress = False
-                self.on_new_master(sender_id)
+            elif msg_type == MSG_LEADER_QUERY:
+                send_json(conn, {"type": MSG_LEADER_INFO, "es_lider": self.soy_lider and self.estado.tengo_lease(self.my_id),
+                                 "term": self.estado.current_term, "sender_id": self.my_id})
 
         except Exception as e:
-            print(f"[Elección Error] {e}")
+            log.error("peticion_fallida", error=e)
         finally:
             conn.close()
 
-    def start_election(self):
-        if self.election_in_progress: return
-        self.election_in_progress = True
-        print("[Elección] --- INICIANDO ELECCIÓN (Bully) ---")
-
-        higher_nodes = [n for n in self.config["nodes"] if n["id"] > self.my_id]
-        
-        if not higher_nodes:
-            self._declare_victory()
-            return
-
-        anyone_answered = False
-        for node in higher_nodes:
-            try:
-                # Puerto de elección = port_db + 100
-                target_port = node["port_db"] + 100
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(1.0) 
-                sock.connect((node["host"], target_port))
-                
-                send_json(sock, {"type": MSG_ELECTION, "sender_id": self.my_id})
+    def _reconocer_lider(self, leader_id, term):
+        if self.soy_lider:
+            self._dejar_liderazgo(f"el Nodo {leader_id} es líder del término {term}")
+        if leader_id != self._lider_notificado:
+            self._lider_notificado = leader_id
+            log.info("nuevo_lider", lider=leader_id, term=term)
+            self.on_new_master(leader_id)
+
+    def _dejar_liderazgo(self, motivo):
+        log.aviso("dejo_liderazgo", motivo=motivo)
+        self.soy_lider = False
+        self._lider_notificado = None
+        self.estado.soltar_liderazgo()
+        if self.on_demotion:
+            self.on_demotion()
+
+    #   RPC EN PARALELO
+
+    def _rpc(self, node, msg, resultados):
+        try:
+            with socket.create_connection((node["host"], node["port_db"] + 100), timeout=RPC_TIMEOUT) as sock:
+                sock.settimeout(RPC_TIMEOUT)
+                send_json(sock, msg)
                 resp = recv_json(sock)
-                
-                if resp and resp.get("type") == MSG_ELECTION_OK:
-                    print(f"[Elección] Nodo {node['id']} respondió. Me retiro.")
-                    anyone_answered = True
-                sock.close()
-            except (ConnectionRefusedError, socket.timeout):
-                pass 
-        
-        if not anyone_answered:
-            self._declare_victory()
-
-    def _declare_victory(self):
-        print("[Elección] Ahora soy el nodo maestro")
-        self.election_in_progress = False
-        
-        # Avisar a todos los nodos (menores)
-        lower_nodes = [n for n in self.config["nodes"] if n["id"] != self.my_id]
-        for node in lower_nodes:
-            try:
-                target_port = node["port_db"] + 100
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(0.5)
-                sock.connect((node["host"], target_port))
-                send_json(sock, {"type": MSG_COORDINATOR, "sender_id": self.my_id})
-                sock.close()
-            except:
-                pass
-        
+                if resp: resultados.append(resp)
+        except (OSError, ValueError):
+            pass
+
+    def _rpc_paralelo(self, msg):
+        """Envía `msg` a todos los demás nodos a la vez; espera a lo sumo un timeout."""
+        resultados = []
+        hilos = [
+            threading.Thread(target=self._rpc, args=(n, msg, resultados), daemon=True)
+            for n in get_topologia().otros(self.my_id)
+        ]
+        for h in hilos: h.start()
+        limite = time.monotonic() + RPC_TIMEOUT * 2
+        for h in hilos:
+            h.join(max(0, limite - time.monotonic()))
+        return list(resultados)
+
+    #   ELECCIÓN
+
+    def start_election(self):
+        if not self._lock_eleccion.acquire(blocking=False): return
+        try:
+            mayores = sum(1 for n in get_topologia().nodos if n["id"] > self.my_id)
+            time.sleep(mayores * PRIORIDAD_POR_RANGO + random.uniform(0, 0.05))
+            # Alguien pudo ganar mientras esperaba mi turno (o este nodo ya salió del clúster)
+            if self.soy_lider or self.estado.lease_seguidor_vigente(): return
+            if not self.running or get_topologia().nodo(self.my_id) is None: return
+
+            term = self.estado.iniciar_candidatura(self.my_id)
+            inicio = time.monotonic()
+            log.info("inicio_eleccion", term=term)
+
+            respuestas = self._rpc_paralelo({"type": MSG_REQUEST_VOTE, "term": term, "sender_id": self.my_id,
+                                             "posicion": list(leer_posicion())})
+            votos = 1
+            for r in respuestas:
+                self.estado.observar_termino(r.get("term"))
+                if r.get("granted") and r.get("term") == term:
+                    votos += 1
+
+            if votos >= self._mayoria() and self.estado.asumir_liderazgo(term, self.my_id, inicio):
+                self._declare_victory(term)
+            else:
+                log.aviso("sin_mayoria", term=term, votos=votos, nodos=len(get_topologia().nodos))
+        finally:
+            self._lock_eleccion.release()
+
+    def _declare_victory(self, term):
+        log.info("soy_maestro", term=term)
+        self.soy_lider = True
+        self._lider_notificado = self.my_id
+
+        # Avisar a todos en paralelo; las confirmaciones también renuevan el lease
+        self._latido(MSG_COORDINATOR)
+
         # Ejecutar lógica de promoción local
-        self.on_promotion()
\ No newline at end of file
+        self.on_promotion()
+
+    #   LEASE DEL LÍDER
+
+    def _latido(self, msg_type=MSG_LEADER_HEARTBEAT):
+        term = self.estado.current_term
+        inicio = time.monotonic()
+        respuestas = self._rpc_paralelo({"type": msg_type, "term": term, "sender_id": self.my_id})
+        confirmaciones = 1
+        for r in respuestas:
+            if not self.estado.observar_termino(r.get("term")) or r.get("term", 0) > term:
+                continue
+            if r.get("ok"): confirmaciones += 1
+        if self.estado.current_term == term and confirmaciones >= self._mayoria():
+            self.estado.renovar_lease_lider(term, inicio)
+
+    def _enviar_latidos(self):
+        while self.running:
+            time.sleep(INTERVALO_LATIDO)
+            if not self.soy_lider: continue
+            self._latido()
+            if not self.estado.tengo_lease(self.my_id):
+                self._dejar_liderazgo("lease expirado (sin mayoría o término superado)")
+
+    def buscar_lider(self):
+        """
+        Al arrancar, pregunta si ya hay un líder con lease. Postularse de entrada
+        subiría el término y depondría a un líder sano con el primer latido; así
+        un nodo que se reinicia se suma al líder actual en un solo viaje.
+        """
+        respuestas = self._rpc_paralelo({"type": MSG_LEADER_QUERY, "sender_id": self.my_id})
+        lider = next((r for r in respuestas if r.get("es_lider")), None)
+        if lider and self.estado.renovar_lease_seguidor(lider["term"], lider["sender_id"]):
+            self._reconocer_lider(lider["sender_id"], lider["term"])
+            return True
+        return False
+
+    def _vigilar_lider(self):
+        """Sin latidos del líder durante un lease completo, postularse."""
+        if not self.buscar_lider():
+            self.start_election()
+        while self.running:
+            time.sleep(INTERVALO_VIGILANCIA)
+            if self.soy_lider or self.estado.lease_seguidor_vigente(): continue
+            self.start_election()
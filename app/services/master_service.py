@@ -1,84 +1,489 @@
+import os
+import selectors
 import socket
+import struct
 import json
 import threading
 import datetime
+import time
+import itertools
+from contextlib import contextmanager
 from app.data_access.db_manager import DatabaseManager
-from app.services.replication_service import broadcast_to_slaves
+from app.data_access.archive import archivar_visitas, conexion_historica, RETENCION_DIAS, INTERVALO_ARCHIVO
+from app.services.replication_service import broadcast_to_slaves, confirmar_lote, REGISTRO
+from app.services.membership_service import procesar_join, procesar_leave
+from app.services.report_service import ServicioReportes, REPORTES
+from app.services.anti_entropy_service import ServicioAntiEntropia, INTERVALO_ANTIENTROPIA
+from app.services.reconciler_service import ServicioReconciliacion, INTERVALO_RECONCILIACION, ESTANCIA_MAX_HORAS
+from app.core.term_state import get_term_state
+from app.core.hot_state import EstadoCaliente
+from app.core.folios import GeneradorFolios
+from app.core.sharding import sharding_habilitado, dueno_de_sala, salas_de_nodo, nodo_por_id
+from app.common.config_loader import load_cluster_config, get_topologia
+from app.core.metrics import METRICAS
+from app.core.tracing import TRAZAS, contexto_actual
+from app.core.admission_control import PoolAcotado, LimitadorClientes, limites_listener
+from app.core import deadlines as plazos
+from app.common.protocol import send_json, recv_respuesta, recv_fragmentos, marco_plano, HEADER_LENGTH
+from app.common.log import get_logger
 from app.common.constants import (
-    MSG_OK, MSG_ERROR, MSG_NEW_VISIT, 
+    MSG_OK, MSG_ERROR, MSG_NEW_VISIT, MSG_JOIN, MSG_LEAVE, MSG_NOT_LEADER,
+    MSG_RESERVE_DOCTOR, MSG_RELEASE_DOCTOR, MSG_STATUS, MSG_METRICS, MSG_TRACES,
+    MSG_ARCHIVE, MSG_VISIT_HISTORY, MSG_BUSY, MSG_CHECK_REPLICAS, MSG_DEADLINE_EXCEEDED, MSG_RECONCILE,
+    MSG_USE_REPLICA,
     DOC_DISPONIBLE, DOC_OCUPADO, CAMA_LIBRE, CAMA_OCUPADA
 )
 
+log = get_logger("MASTER")
+
 MASTER_PORT = 8000
 BUFFER_SIZE = 4096
-DB_PATH = "data/nodo_1.db" 
+# Paquetes del canal con los procesos trabajadores: el primero de cada petición lleva
+# el descriptor y la longitud total; una petición más grande sigue en paquetes de este tamaño
+TAM_PAQUETE_CANAL = 64 * 1024
 SCHEMA_PATH = "config/schema.sql"
+# Cada cuántas respuestas recordadas se purgan de la BD las ya expiradas
+PURGA_IDEMPOTENCIA_CADA = 500
+REENVIO_TIMEOUT = 5
+# retry_after cuando un lote no llegó a la mayoría: lo que tarda la anti-entropía en alinear una réplica
+ESPERA_SIN_MAYORIA = 1.0
+# Segundos sin peticiones tras los que se cierra una conexión persistente
+INACTIVIDAD_PERSISTENTE = 60
+# Cada cuánto se reintentan los RELEASE_DOCTOR que el coordinador no confirmó (sharding)
+REINTENTO_LIBERACIONES = 2.0
+# Con sharding, cualquier réplica puede contestar las lecturas
+LECTURAS = {"CHECK_AVAIL", "GET_ACTIVE_VISITS", "GET_ALL_PATIENTS", MSG_VISIT_HISTORY}
+LIMITE_HISTORIAL = 1000
+# Observabilidad: no cuenta contra la cuota del cliente (sirve justo cuando hay saturación)
+SIN_CUOTA = {MSG_STATUS, MSG_METRICS, MSG_TRACES}
+
+class MasterService:
+    """
+    Lógica de maestro de un nodo, con su propia BD e índices en memoria.
+    Todos los nodos la levantan al arrancar: el listener queda escuchando y los
+    índices se mantienen calientes por replicación, así que ser promovido es solo
+    obtener el lease. Sin lease se responde NOT_LEADER.
+    """
+    def __init__(self, node_id, db_path, port=MASTER_PORT, estado_caliente=None, reuseport=False):
+        self.node_id = node_id
+        self.port = port
+        # Modo multiproceso: procesos trabajadores escuchan en el mismo puerto
+        self.reuseport = reuseport
+        self.db = DatabaseManager(db_path, SCHEMA_PATH)
+        self.estado = estado_caliente or EstadoCaliente()
+        self.mutex_asignacion = threading.Lock()
+        # Con sharding: el coordinador serializa solo a los doctores
+        self.mutex_doctores = threading.Lock()
+        self.folios = GeneradorFolios(node_id)
+        self.reportes = ServicioReportes()
+        self.antientropia = ServicioAntiEntropia(node_id, self.mutex_asignacion)
+        self.reconciliacion = ServicioReconciliacion(node_id, self.estado, self.mutex_asignacion, self.mutex_doctores)
+        self.pool = None
+        # Conexiones persistentes esperando su siguiente petición
+        self._persistentes = selectors.DefaultSelector()
+        self.limitador = LimitadorClientes.desde_config(load_cluster_config())
+
+        # Medición de failover: promoción -> primera admisión atendida
+        self._t_promocion = None
+        self.ultimo_failover_ms = None
+        self._respuestas_guardadas = 0
+        # Hay un lote numerado aquí que la mayoría todavía no confirma
+        self._lote_sin_mayoria = False
+        # Réplica a la que se manda el siguiente reporte que llegue al líder
+        self._turno_reportes = itertools.count()
+        # Sharding: folio -> id_doctor de las altas cuyo RELEASE_DOCTOR falló
+        self._liberaciones_pendientes = {}
+        self._lock_liberaciones = threading.Lock()
+
+    def start(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuseport:
+            # El kernel reparte las conexiones entre todos los procesos del puerto
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        try:
+            server.bind(("0.0.0.0", self.port))
+            server.listen(128)
+            hilos, cola = limites_listener("master", load_cluster_config())
+            self.pool = PoolAcotado("master", hilos, cola)
+            log.info("listo", nodo=self.node_id, puerto=self.port, hilos=hilos, cola=cola)
+            threading.Thread(target=self._vigilar_persistentes, daemon=True).start()
+            self._tareas_de_fondo()
+            while True:
+                conn, addr = server.accept()
+                # El plazo del cliente se cuenta desde aquí: incluye la espera en la cola
+                if not self.pool.enviar(self.handle_request, conn, None, time.monotonic()):
+                    self._rechazar(conn)
+        except Exception as e: log.error("listener_caido", error=e)
+        finally: server.close()
 
-mutex_asignacion = threading.Lock()
-db = DatabaseManager(DB_PATH, SCHEMA_PATH)
-MY_NODE_ID = None 
-
-def start_master_listener(port=MASTER_PORT, node_id=None):
-    global MY_NODE_ID
-    if node_id: MY_NODE_ID = node_id
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    try:
-        print(f"[MASTER] Nodo Maestro (ID: {MY_NODE_ID}) escuchando en puerto {port}...")
-        server.bind(("0.0.0.0", port))
-        server.listen(10)
+    def _tareas_de_fondo(self):
+        threading.Thread(target=self._archivar_periodicamente, daemon=True).start()
+        threading.Thread(target=self._revisar_replicas_periodicamente, daemon=True).start()
+        threading.Thread(target=self._reconciliar_periodicamente, daemon=True).start()
+        threading.Thread(target=self._poner_al_dia_desfasadas, daemon=True).start()
+        threading.Thread(target=self._reintentar_liberaciones, daemon=True).start()
+
+    def recibir_delegadas(self, ruta):
+        """
+        Modo multiproceso: los trabajadores atienden las lecturas y pasan aquí (por
+        un socket Unix, con SCM_RIGHTS) la conexión y los bytes ya leídos de todo lo
+        que toca el estado de asignación, que vive solo en este proceso.
+        """
+        if os.path.exists(ruta): os.remove(ruta)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        server.bind(ruta)
+        server.listen(16)
         while True:
-            conn, addr = server.accept()
-            threading.Thread(target=handle_request, args=(conn,)).start()
-    except Exception as e: print(f"[MASTER Error] {e}")
-    finally: server.close()
-
-def handle_request(conn):
-    try:
-        data = conn.recv(BUFFER_SIZE).decode("utf-8")
-        if not data: return
-        request = json.loads(data)
-        req_type = request.get("type")
-        print(f"\n[MASTER] Solicitud: {req_type}")
+            canal, _ = server.accept()
+            threading.Thread(target=self._atender_canal, args=(canal,), daemon=True).start()
+
+    def _atender_canal(self, canal):
+        with canal:
+            while True:
+                paquete, fds, banderas, _ = socket.recv_fds(canal, TAM_PAQUETE_CANAL, 1)
+                if not fds: return  # el trabajador cerró
+                conn = socket.socket(fileno=fds[0])
+                if banderas & socket.MSG_TRUNC or len(paquete) < HEADER_LENGTH:
+                    # El trabajador nunca manda paquetes más grandes: el canal quedó desalineado
+                    log.error("canal_desalineado", bytes=len(paquete))
+                    self._responder(conn, None, {"status": MSG_ERROR, "msg": "Petición delegada incompleta"})
+                    conn.close()
+                    return
+                total = struct.unpack(">I", paquete[:HEADER_LENGTH])[0]
+                partes, recibidos = [paquete[HEADER_LENGTH:]], len(paquete) - HEADER_LENGTH
+                while recibidos < total:
+                    parte = canal.recv(TAM_PAQUETE_CANAL)
+                    if not parte:
+                        conn.close()
+                        return
+                    partes.append(parte)
+                    recibidos += len(parte)
+                data = b"".join(partes)
+                if not self.pool.enviar(self.handle_request, conn, data, time.monotonic()):
+                    self._rechazar(conn, data)
+
+    def _rechazar(self, conn, data=None):
+        """Cola llena: BUSY sin atender. Se descarta lo ya recibido para que el cierre no sea un RST."""
+        request = None
+        try:
+            conn.setblocking(False)
+            try: request, _ = self._decodificar(data or self._recibir(conn))
+            except ValueError: pass
+            conn.setblocking(True)
+            self._responder(conn, request, self._ocupado(self.pool.reintentar_en(), "Nodo saturado"))
+        except OSError: pass
+        finally: conn.close()
+
+    @staticmethod
+    def _responder(conn, request, response):
+        """JSON plano hasta cerrar, o en marcos comprimidos si la petición trae "compresion"."""
+        if isinstance(request, dict) and "compresion" in request:
+            send_json(conn, response, request["compresion"])
+        else:
+            conn.sendall(json.dumps(response).encode("utf-8"))
+
+    def _recibir(self, conn):
+        """
+        Bytes de la siguiente petición. Un primer byte '{' es la petición de siempre:
+        JSON plano y se cierra tras responder. Si no, es un marco de una conexión
+        persistente, que se devuelve descomprimido en un solo marco plano (así se
+        puede pasar tal cual a otro proceso). b"" si el cliente cerró.
+        """
+        try:
+            primero = conn.recv(1, socket.MSG_PEEK)
+            if primero in (b"", b"{"):
+                return conn.recv(BUFFER_SIZE)
+            return marco_plano(b"".join(recv_fragmentos(conn)))
+        except OSError:
+            return b""
+
+    @staticmethod
+    def _decodificar(data):
+        """(petición, persistente) a partir de lo que devolvió `_recibir`."""
+        if not data or data[:1] == b"{":
+            return (json.loads(data.decode("utf-8")) if data else None), False
+        request = json.loads(data[HEADER_LENGTH:].decode("utf-8"))
+        if isinstance(request, dict):
+            # En una conexión persistente las respuestas también van en marcos
+            request.setdefault("compresion", [])
+        return request, True
+
+    #   CONEXIONES PERSISTENTES
+    #   Entre una petición y la siguiente la conexión espera en un selector, no en
+    #   un hilo del pool: cientos de clientes conectados no ocupan hilos ociosos.
+
+    def _esperar_siguiente(self, conn):
+        try:
+            self._persistentes.register(conn, selectors.EVENT_READ, time.monotonic())
+        except (ValueError, KeyError, OSError):
+            conn.close()
+
+    def _vigilar_persistentes(self):
+        while True:
+            for clave, _ in self._persistentes.select(timeout=1):
+                self._persistentes.unregister(clave.fileobj)
+                # Cada petición entra a la cola como una conexión nueva, con su propio plazo
+                if not self.pool.enviar(self.handle_request, clave.fileobj, None, time.monotonic()):
+                    self._rechazar(clave.fileobj)
+            limite = time.monotonic() - INACTIVIDAD_PERSISTENTE
+            for clave in list(self._persistentes.get_map().values()):
+                if clave.data < limite:
+                    self._persistentes.unregister(clave.fileobj)
+                    clave.fileobj.close()
+
+    @staticmethod
+    def _ocupado(retry_after, msg):
+        return {"status": MSG_BUSY, "retry_after": retry_after, "msg": msg}
+
+    def promover(self):
+        """Conmutación O(1): listener ya enlazado e índices ya calientes."""
+        self._t_promocion = time.monotonic()
+        log.info("promovido", nodo=self.node_id)
+        # Primer lote del término, vacío: las réplicas se ponen al día con este nodo y, si la
+        # mayoría lo aplica, todo lo que el líder anterior confirmó ya está en ella. Con los
+        # dos mutex tomados, ninguna petición se atiende antes
+        with self.mutex_asignacion, self.mutex_doctores:
+            res = self._confirmar([])
+        if res["status"] != MSG_OK:
+            log.aviso("inicio_de_termino_fallido", status=res["status"], msg=res.get("msg"))
+
+    def estado_nodo(self):
+        estado = get_term_state()
+        return {
+            "status": MSG_OK,
+            "node_id": self.node_id,
+            "es_lider": estado.tengo_lease(self.node_id),
+            "leader_id": estado.leader_id,
+            "term": estado.current_term,
+            "ultimo_failover_ms": self.ultimo_failover_ms
+        }
+
+    def metricas_nodo(self, formato=None):
+        if formato == "prometheus":
+            return {"status": MSG_OK, "node_id": self.node_id, "texto": METRICAS.prometheus()}
+        return {"status": MSG_OK, "node_id": self.node_id, "metricas": METRICAS.exportar()}
+
+    @contextmanager
+    def _mutex_medido(self, mutex, op):
+        """
+        Toma el mutex registrando cuánto se esperó por él y cuánto se retuvo.
+        Con plazo, la espera no pasa de lo que le queda a la petición: tomar el
+        mutex es el punto sin retorno, antes de él abandonar no deja rastro.
+        """
+        inicio = time.perf_counter()
+        restante = plazos.restante()
+        with TRAZAS.subspan("mutex.espera", op=op):
+            tomado_a_tiempo = mutex.acquire() if restante is None else mutex.acquire(timeout=max(0, restante))
+        if not tomado_a_tiempo:
+            raise plazos.vencido("mutex")
+        tomado = time.perf_counter()
+        METRICAS.histograma("master_mutex_espera_segundos", op=op).observar(tomado - inicio)
+        try:
+            with TRAZAS.subspan("mutex.retencion", op=op):
+                yield
+        finally:
+            mutex.release()
+            METRICAS.histograma("master_mutex_retencion_segundos", op=op).observar(time.perf_counter() - tomado)
+
+    def _sin_lease(self):
+        """Fencing: sin lease vigente este nodo no puede atender (evita dos maestros)."""
+        estado = get_term_state()
+        if estado.tengo_lease(self.node_id):
+            return None
+        return {"status": MSG_NOT_LEADER, "msg": "Este nodo no tiene el liderazgo", "leader_id": estado.leader_id}
+
+    def _reporte_a_replica(self):
+        """Con el lease, el reporte se manda a una réplica (por turnos); sin él, None."""
+        if not self.estado_lider():
+            return None
+        replicas = get_topologia().otros(self.node_id)
+        if not replicas:
+            return {"status": MSG_USE_REPLICA, "msg": "No hay réplicas: el líder no atiende reportes", "replica_id": None}
+        replica = replicas[next(self._turno_reportes) % len(replicas)]
+        return {"status": MSG_USE_REPLICA, "msg": "El líder no atiende reportes", "replica_id": replica["id"],
+                "host": replica["host"], "port": replica["port_manager"]}
+
+    def _asegurar_indices(self):
+        if self.estado.sucio:
+            self.estado.cargar_desde_bd(self.db)
+
+    def _confirmar(self, ops):
+        """
+        Escribe las operaciones de una petición en una sola transacción local y las
+        replica como un solo WRITE_BATCH: en cada réplica la respuesta recordada
+        queda junto con las escrituras que la produjeron, o no queda nada.
+        El líder responde OK solo si la mayoría (contando a este nodo) aplicó el lote:
+        el siguiente líder, que debe estar tan al día como quienes lo votan, lo tiene.
+        Si no, el lote queda aquí y se responde BUSY; el cliente reintenta con la
+        misma clave y recibe la respuesta recordada cuando la mayoría ya la tenga.
+        """
+        res, confirmaciones = confirmar_lote(ops, self.node_id)
+        if res["status"] != MSG_OK:
+            return res
+        for op in ops:
+            if op.get("evento"):
+                self.estado.aplicar_evento(op["evento"])
+        if confirmaciones is None:
+            return res
+        self._lote_sin_mayoria = confirmaciones < get_topologia().mayoria()
+        if not self._lote_sin_mayoria:
+            return res
+        log.aviso("lote_sin_mayoria", confirmaciones=confirmaciones, nodos=len(get_topologia().nodos))
+        METRICAS.contador("master_lotes_sin_mayoria_total").inc()
+        return self._ocupado(ESPERA_SIN_MAYORIA, "La escritura no llegó a la mayoría de las réplicas")
+
+    @staticmethod
+    def _fallo(res):
+        """Respuesta al cliente de un lote no confirmado; BUSY pasa tal cual (el cliente reintenta)."""
+        if res["status"] == MSG_BUSY:
+            return res
+        return {"status": MSG_ERROR, "msg": res.get("msg")}
+
+    #   IDEMPOTENCIA (llamar con el mutex de asignación tomado)
+
+    def _respuesta_previa(self, clave):
+        """Respuesta original si esta clave ya se procesó (memoria y, si no, BD)."""
+        if not clave: return None
+        respuesta = self.estado.respuestas.obtener(clave)
+        if respuesta is None:
+            res = self.db.ejecutar_lectura("SELECT respuesta, creado FROM idempotencia WHERE clave = ?", (clave,))
+            if not (res["data"] and self.estado.respuestas.vigente(res["data"][0]["creado"])):
+                return None
+            respuesta = json.loads(res["data"][0]["respuesta"])
+        if self._lote_sin_mayoria:
+            # Pudo ser la escritura que no llegó a la mayoría: un lote vacío la empuja (las
+            # réplicas se ponen al día antes de aplicarlo) y solo con mayoría se repite el OK
+            res = self._confirmar([])
+            if res["status"] != MSG_OK: return res
+        return respuesta
+
+    def _op_recordar(self, clave, respuesta):
+        """Operación replicable que persiste la respuesta junto con la escritura que la produjo."""
+        creado = time.time()
+        return {
+            "sql": "INSERT OR REPLACE INTO idempotencia (clave, respuesta, creado) VALUES (?, ?, ?)",
+            "params": (clave, json.dumps(respuesta), creado),
+            "evento": {"tipo": "idempotencia", "clave": clave, "respuesta": respuesta, "creado": creado}
+        }
+
+    def _recordar(self, clave, respuesta, ops):
+        """Agrega a `ops` la respuesta a recordar: se confirma en la misma transacción que ellas."""
+        if not clave: return
+        ops.append(self._op_recordar(clave, respuesta))
+
+        self._respuestas_guardadas += 1
+        if self._respuestas_guardadas % PURGA_IDEMPOTENCIA_CADA == 0:
+            ops.append({"sql": "DELETE FROM idempotencia WHERE creado < ?",
+                        "params": (time.time() - self.estado.respuestas.ttl,)})
+
+    def handle_request(self, conn, data=None, llegada=None):
+        """
+        `data`: la petición ya leída (conexiones que delega un proceso trabajador).
+        `llegada`: cuándo se aceptó la conexión; el "plazo_ms" del cliente corre desde ahí.
+        """
+        inicio = time.perf_counter()
+        req_type = None
+        status = MSG_ERROR
+        en_curso = METRICAS.medidor("master_peticiones_en_curso")
+        en_curso.inc()
+        request = None
+        persistente = False
+        try:
+            data = data or self._recibir(conn)
+            if not data: return
+            request, persistente = self._decodificar(data)
+            req_type = request.get("type")
+            log.debug("solicitud", tipo=req_type)
+            with plazos.con_plazo(plazos.desde_mensaje(request, llegada)):
+                # Si el cliente ya se rindió mientras esperaba en la cola, no empezar
+                plazos.verificar("cola")
+                response = self._atender(conn, req_type, request)
+            status = response.get("status")
+            self._responder(conn, request, response)
+        except plazos.PlazoVencido as e:
+            status = MSG_DEADLINE_EXCEEDED
+            self._responder(conn, request, {"status": MSG_DEADLINE_EXCEEDED, "msg": str(e)})
+        except Exception as e:
+            # No se sabe en qué punto quedó el flujo: la conexión no se reutiliza
+            persistente = False
+            log.error("solicitud_fallida", tipo=req_type, error=e)
+            self._responder(conn, request, {"status": MSG_ERROR, "msg": str(e)})
+        finally:
+            if persistente:
+                self._esperar_siguiente(conn)
+            else:
+                conn.close()
+            en_curso.dec()
+            if req_type is not None:
+                METRICAS.histograma("master_peticion_segundos", tipo=req_type).observar(time.perf_counter() - inicio)
+                METRICAS.contador("master_peticiones_total", tipo=req_type, status=status).inc()
+
+    def _atender(self, conn, req_type, request):
+        espera = 0
+        origen = self._origen_con_cuota(conn, request) if req_type not in SIN_CUOTA else None
+        if origen:
+            espera = self.limitador.permitir(origen)
+        if espera:
+            return self._ocupado(espera, "Demasiadas peticiones de este cliente")
+        if req_type == MSG_STATUS:
+            return self.estado_nodo()
+        if req_type == MSG_METRICS:
+            return self.metricas_nodo(request.get("formato"))
+        if req_type == MSG_TRACES:
+            return dict(TRAZAS.exportar(request.get("trace_id")), status=MSG_OK, node_id=self.node_id)
+        if req_type in REPORTES:
+            # Solo lectura sobre la BD local y el archivo; en el líder competiría con las admisiones
+            return self._reporte_a_replica() or self.reportes.atender(req_type, request)
+        with TRAZAS.span(f"master.{req_type}", traza_remota=request.get("traza")):
+            if sharding_habilitado():
+                return self._enrutar_shard(req_type, request)
+            return self._sin_lease() or self._despachar(req_type, request)
+
+    @staticmethod
+    def _origen_con_cuota(conn, request):
+        """
+        Dirección de origen de la conexión, que es la llave de la cuota; None si no
+        cuenta contra ella. Nada de lo que trae la petición sirve de identidad: un
+        cliente que la cambia en cada petición tendría siempre la cubeta llena.
+        """
+        origen = conn.getpeername()[0]
+        # Las reenviadas entre nodos ya pasaron la cuota en el nodo de entrada
+        if request.get("reenviada") and origen in {n["host"] for n in get_topologia().nodos}:
+            return None
+        return origen
+
+    def _despachar(self, req_type, request):
+        db = self.db
         response = {"status": MSG_ERROR, "msg": "Petición no reconocida"}
 
         if req_type == "REGISTER_PATIENT":
-            sql_local = "INSERT INTO pacientes (nombre, seguro_social) VALUES (?, ?)"
-            params_local = (request["nombre"], request["seguro"])
-            res_db = db.ejecutar_escritura(sql_local, params_local)
-            if res_db["status"] == "OK":
-                id_generado = res_db["id"]
-                sql_rep = "INSERT INTO pacientes (id_paciente, nombre, seguro_social) VALUES (?, ?, ?)"
-                broadcast_to_slaves({"type": "WRITE", "sql": sql_rep, "params": (id_generado, request["nombre"], request["seguro"])}, sender_id=MY_NODE_ID)
-                response = {"status": MSG_OK, "id": id_generado, "msg": "Paciente registrado"}
-            else:
-                response = {"status": MSG_ERROR, "msg": res_db.get("error")}
+            response = self.register_patient_transaction(request["nombre"], request["seguro"], request.get("idempotency_key"))
 
         elif req_type == MSG_NEW_VISIT:
-            seguro = request.get("seguro")
-            paciente = db.ejecutar_lectura("SELECT id_paciente FROM pacientes WHERE seguro_social = ?", (seguro,))
-            if paciente["status"] == "OK" and len(paciente["data"]) > 0:
-                response = create_visit_transaction(paciente["data"][0]["id_paciente"])
+            id_paciente = self._id_paciente(request.get("seguro"))
+            if id_paciente is not None:
+                response = self.create_visit_transaction(id_paciente, request.get("idempotency_key"))
             else:
                 response = {"status": MSG_ERROR, "msg": "Paciente no encontrado"}
 
         elif req_type == "CHECK_AVAIL":
             sql_camas = """
-                SELECT n.nombre as sala, 
+                SELECT n.nombre as sala,
                        SUM(CASE WHEN c.estado = 'LIBRE' THEN 1 ELSE 0 END) as libres,
                        SUM(CASE WHEN c.estado = 'OCUPADA' THEN 1 ELSE 0 END) as ocupadas
                 FROM camas c JOIN nodos n ON c.id_sala = n.id_sala GROUP BY n.nombre
             """
             sql_docs = "SELECT SUM(capacidad_max - carga_actual) as cupos FROM doctores WHERE carga_actual < capacidad_max"
-            
+
             res_camas = db.ejecutar_lectura(sql_camas, [])
             res_docs = db.ejecutar_lectura(sql_docs, [])
             total_cupos = res_docs["data"][0]["cupos"] if res_docs["data"][0]["cupos"] else 0
-            
+
             response = {
                 "status": MSG_OK,
                 "desglose_camas": res_camas["data"],
-                "doctores_libres": total_cupos 
+                "doctores_libres": total_cupos
             }
 
         elif req_type == "GET_ACTIVE_VISITS":
@@ -98,139 +503,495 @@ def handle_request(conn):
              res = db.ejecutar_lectura(sql, [])
              response = {"status": MSG_OK, "pacientes": res["data"] if res["status"] == "OK" else []}
 
+        elif req_type == MSG_VISIT_HISTORY:
+            response = self.historial_visitas(request.get("seguro"), request.get("desde"), request.get("hasta"))
+
         elif req_type == "CLOSE_VISIT":
             folio = request.get("folio")
-            response = close_visit_transaction(folio)
-
-        conn.sendall(json.dumps(response).encode("utf-8"))
-    except Exception as e:
-        print(f"[MASTER Error] {e}")
-        conn.sendall(json.dumps({"status": MSG_ERROR, "msg": str(e)}).encode("utf-8"))
-    finally: conn.close()
-
-def create_visit_transaction(id_paciente):
-    with mutex_asignacion:
-        print("[MASTER] Iniciando asignación")
-        
-        # BUSCAR DOCTOR
-        sql_doc = """
-            SELECT id_doctor, carga_actual, capacidad_max 
-            FROM doctores 
-            WHERE carga_actual < capacidad_max 
-            ORDER BY carga_actual ASC LIMIT 1
-        """
-        res_doc = db.ejecutar_lectura(sql_doc, [])
-        
-        # BUSCAR CAMA Y SU SALA
-        sql_cama = """
-            SELECT id_cama, id_sala 
-            FROM camas 
-            WHERE estado = 'LIBRE' 
-            LIMIT 1
-        """
-        res_cama = db.ejecutar_lectura(sql_cama, [])
-
-        if not (res_doc["data"] and res_cama["data"]):
-            return {"status": "ERROR", "msg": "No hay recursos (Cama o Doctor saturados)"}
-
-        doctor = res_doc["data"][0]
-        cama = res_cama["data"][0]  # Datos de la cama
-        
-        id_doctor = doctor["id_doctor"]
-        id_cama = cama["id_cama"]
-        
-        id_sala_real = cama["id_sala"] 
-
-        folio = generate_folio(id_paciente, id_doctor, id_sala_real)
-        fecha_actual = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
+            response = self.close_visit_transaction(folio, request.get("idempotency_key"))
+
+        elif req_type == MSG_CHECK_REPLICAS:
+            response = {"status": MSG_OK, "reporte": self.antientropia.revisar()}
+
+        elif req_type == MSG_RECONCILE:
+            horas = request.get("estancia_max_horas") or load_cluster_config().get("reconciliacion", {}).get("estancia_max_horas", ESTANCIA_MAX_HORAS)
+            response = self.reconciliacion.revisar(horas)
+
+        elif req_type == MSG_JOIN:
+            # Congelar escrituras mientras se toma el snapshot y se publica la membresía
+            # (REGISTRO.lock: tampoco hay lotes numerados a medio difundir)
+            with self.mutex_asignacion, REGISTRO.lock:
+                response = self._sin_lease() or procesar_join(request, self.node_id)
+
+        elif req_type == MSG_LEAVE:
+            with self.mutex_asignacion:
+                response = self._sin_lease() or procesar_leave(request, self.node_id)
+
+        return response
+
+    def _id_paciente(self, seguro):
+        """Búsqueda por seguro social: caché en memoria y, si falla, SQLite."""
+        id_paciente = self.estado.pacientes.obtener(seguro)
+        if id_paciente is not None: return id_paciente
+        res = self.db.ejecutar_lectura("SELECT id_paciente FROM pacientes WHERE seguro_social = ?", (seguro,))
+        if not res["data"]: return None
+        id_paciente = res["data"][0]["id_paciente"]
+        self.estado.pacientes.guardar(seguro, id_paciente)
+        return id_paciente
+
+    #   ARCHIVO DE VISITAS CERRADAS
+
+    def _archivar_periodicamente(self):
+        while True:
+            config_archivo = load_cluster_config().get("archivo", {})
+            time.sleep(config_archivo.get("intervalo_s", INTERVALO_ARCHIVO))
+            if get_term_state().tengo_lease(self.node_id):
+                self.archivar(config_archivo.get("retencion_dias", RETENCION_DIAS))
+
+    def _revisar_replicas_periodicamente(self):
+        while True:
+            time.sleep(load_cluster_config().get("antientropia", {}).get("intervalo_s", INTERVALO_ANTIENTROPIA))
+            self._revisar_replicas()
+
+    def _poner_al_dia_desfasadas(self):
+        """Réplicas que perdieron lotes que ya no están en el registro: anti-entropía para ellas ya."""
+        while True:
+            REGISTRO.hay_desfasadas.wait()
+            desfasadas = REGISTRO.tomar_desfasadas()
+            if not get_term_state().tengo_lease(self.node_id): continue
+            for nodo in get_topologia().otros(self.node_id):
+                if nodo["id"] not in desfasadas: continue
+                try:
+                    self.antientropia.revisar_nodo(nodo)
+                except (OSError, ValueError) as e:
+                    log.error("antientropia_fallida", nodo=nodo["id"], error=e)
+
+    def _revisar_replicas(self):
+        if get_term_state().tengo_lease(self.node_id):
+            try:
+                self.antientropia.revisar()
+            except Exception as e:
+                log.error("antientropia_fallida", error=e)
+
+    def _reconciliar_periodicamente(self):
+        while True:
+            config_reconciliacion = load_cluster_config().get("reconciliacion", {})
+            time.sleep(config_reconciliacion.get("intervalo_s", INTERVALO_RECONCILIACION))
+            # Con sharding cada dueño revisa las camas de sus salas aunque no sea el coordinador
+            if sharding_habilitado() or get_term_state().tengo_lease(self.node_id):
+                try:
+                    self.reconciliacion.revisar(config_reconciliacion.get("estancia_max_horas", ESTANCIA_MAX_HORAS))
+                except Exception as e:
+                    log.error("reconciliacion_fallida", error=e)
+
+    def archivar(self, retencion_dias=RETENCION_DIAS):
+        """El líder fija el corte y lo replica: cada nodo mueve las mismas filas a su archivo."""
+        hasta = (datetime.datetime.now() - datetime.timedelta(days=retencion_dias)).strftime("%Y-%m-%d %H:%M:%S")
+        res = archivar_visitas(hasta)
+        # Se difunde aunque aquí no hubiera filas: un esclavo pudo perderse una pasada anterior
+        broadcast_to_slaves({"type": MSG_ARCHIVE, "hasta": hasta}, sender_id=self.node_id)
+        return res
+
+    def historial_visitas(self, seguro=None, desde=None, hasta=None):
+        """Visitas activas y archivadas; `desde`/`hasta` son meses de salida ('YYYY-MM')."""
+        condiciones, params = [], []
+        if seguro:
+            id_paciente = self._id_paciente(seguro)
+            if id_paciente is None:
+                return {"status": MSG_ERROR, "msg": "Paciente no encontrado"}
+            condiciones.append("id_paciente = ?")
+            params.append(id_paciente)
+        if desde:
+            condiciones.append("(fecha_salida IS NULL OR substr(fecha_salida, 1, 7) >= ?)")
+            params.append(desde)
+        if hasta:
+            condiciones.append("substr(fecha_salida, 1, 7) <= ?")
+            params.append(hasta)
+        sql = "SELECT folio, id_paciente, id_sala, id_doctor, fecha_ingreso, fecha_salida, estado FROM visitas_historicas"
+        if condiciones:
+            sql += " WHERE " + " AND ".join(condiciones)
+        sql += " ORDER BY fecha_ingreso DESC LIMIT ?"
+        params.append(LIMITE_HISTORIAL)
         try:
-            # ACTUALIZAR RECURSOS
-            nueva_carga = doctor["carga_actual"] + 1
-            nuevo_estado = "SATURADO" if nueva_carga >= doctor["capacidad_max"] else "DISPONIBLE"
-            
-            sql_update_doc = "UPDATE doctores SET carga_actual = ?, estado = ? WHERE id_doctor = ?"
-            params_doc = (nueva_carga, nuevo_estado, id_doctor)
-            
-            sql_update_cama = "UPDATE camas SET estado = ? WHERE id_cama = ?"
-            params_cama = (CAMA_OCUPADA, id_cama)
+            conn = conexion_historica(desde, hasta)
+        except ValueError as e:
+            return {"status": MSG_ERROR, "msg": str(e)}
+        try:
+            return {"status": MSG_OK, "visitas": [dict(r) for r in conn.execute(sql, params)]}
+        finally:
+            conn.close()
+
+    def register_patient_transaction(self, nombre, seguro, clave=None):
+        # Bajo el mutex para que un JOIN concurrente no pierda esta escritura
+        with self._mutex_medido(self.mutex_asignacion, "registro"):
+            sin_lease = self._sin_lease()
+            if sin_lease: return sin_lease
+            previa = self._respuesta_previa(clave)
+            if previa: return previa
+
+            # El id se asigna aquí (con el mutex tomado) para que el paciente y la
+            # respuesta que lo contiene se confirmen en la misma transacción
+            id_generado = self.db.ejecutar_lectura(
+                "SELECT COALESCE(MAX(id_paciente), 0) + 1 AS id FROM pacientes", ())["data"][0]["id"]
+            sql_insert = "INSERT INTO pacientes (id_paciente, nombre, seguro_social) VALUES (?, ?, ?)"
+            response = {"status": MSG_OK, "id": id_generado, "msg": "Paciente registrado"}
+            ops = [{"sql": sql_insert, "params": (id_generado, nombre, seguro),
+                    "evento": {"tipo": "paciente", "seguro": seguro, "id_paciente": id_generado}}]
+            self._recordar(clave, response, ops)
+            res_db = self._confirmar(ops)
+            if res_db["status"] != MSG_OK:
+                return self._fallo(res_db)
+            return response
+
+    def create_visit_transaction(self, id_paciente, clave=None):
+        with self._mutex_medido(self.mutex_asignacion, "admision"):
+            sin_lease = self._sin_lease()
+            if sin_lease: return sin_lease
+            # Un reintento del cliente no debe ocupar otra cama ni otro cupo de doctor
+            previa = self._respuesta_previa(clave)
+            if previa: return previa
+            self._asegurar_indices()
+
+            # BUSCAR DOCTOR Y CAMA en los índices en memoria (sin consultar SQLite)
+            doctor = self.estado.elegir_doctor()
+            cama = self.estado.elegir_cama()
+
+            if not (doctor and cama):
+                return {"status": "ERROR", "msg": "No hay recursos (Cama o Doctor saturados)"}
+
+            id_doctor = doctor["id_doctor"]
+            id_cama = cama["id_cama"]
+
+            id_sala_real = cama["id_sala"]
+
+            folio = self.folios.siguiente(get_term_state().current_term)
+            fecha_actual = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+            try:
+                # ACTUALIZAR RECURSOS
+                nueva_carga = doctor["carga_actual"] + 1
+                nuevo_estado = "SATURADO" if nueva_carga >= doctor["capacidad_max"] else "DISPONIBLE"
+
+                sql_update_doc = "UPDATE doctores SET carga_actual = ?, estado = ? WHERE id_doctor = ?"
+                params_doc = (nueva_carga, nuevo_estado, id_doctor)
+
+                sql_update_cama = "UPDATE camas SET estado = ? WHERE id_cama = ?"
+                params_cama = (CAMA_OCUPADA, id_cama)
+
+                # Insertar Visita usando id_sala_real
+                sql_insert = """
+                    INSERT INTO visitas (folio, id_paciente, id_doctor, id_cama, id_sala, fecha_ingreso, estado)
+                    VALUES (?, ?, ?, ?, ?, ?, 'EN_PROCESO')
+                """
+                params_insert = (folio, id_paciente, id_doctor, id_cama, id_sala_real, fecha_actual)
+
+                # Cada escritura lleva el evento que actualiza los índices de los esclavos
+                ops = [
+                    {"sql": sql_update_doc, "params": params_doc,
+                     "evento": {"tipo": "doctor", "id_doctor": id_doctor, "carga_actual": nueva_carga, "capacidad_max": doctor["capacidad_max"]}},
+                    {"sql": sql_update_cama, "params": params_cama,
+                     "evento": {"tipo": "cama", "id_cama": id_cama, "id_sala": id_sala_real, "estado": CAMA_OCUPADA}},
+                    {"sql": sql_insert, "params": params_insert,
+                     "evento": {"tipo": "visita_abierta", "folio": folio, "id_paciente": id_paciente,
+                                "id_doctor": id_doctor, "id_cama": id_cama, "id_sala": id_sala_real}}
+                ]
+                response = {"status": MSG_OK, "folio": folio, "fecha_ingreso": fecha_actual}
+                self._recordar(clave, response, ops)
+                res = self._confirmar(ops)
+                if res["status"] != MSG_OK:
+                    return self._fallo(res)
+
+                log.debug("visita_creada", folio=folio, sala=id_sala_real)
+                self._medir_primera_admision()
+                return response
+
+            except Exception as e:
+                return {"status": "ERROR", "msg": str(e)}
+
+    def _buscar_visita_activa(self, folio):
+        visita = self.estado.visita_activa(folio)
+        if visita: return visita
+        # Respaldo por si el índice no conoce el folio
+        sql_get = "SELECT id_doctor, id_cama, id_sala FROM visitas WHERE folio = ? AND estado = 'EN_PROCESO'"
+        res = self.db.ejecutar_lectura(sql_get, (folio,))
+        return res["data"][0] if res["data"] else None
+
+    def _medir_primera_admision(self):
+        if self._t_promocion is None: return
+        self.ultimo_failover_ms = (time.monotonic() - self._t_promocion) * 1000
+        self._t_promocion = None
+        log.info("primera_admision", ms=round(self.ultimo_failover_ms, 1))
+
+    def close_visit_transaction(self, folio, clave=None):
+        with self._mutex_medido(self.mutex_asignacion, "alta"):
+            folio = folio.strip()
+            log.debug("cerrando_visita", folio=folio)
+            sin_lease = self._sin_lease()
+            if sin_lease: return sin_lease
+            previa = self._respuesta_previa(clave)
+            if previa: return previa
+            self._asegurar_indices()
+
+            visita = self._buscar_visita_activa(folio)
+            if not visita:
+                return {"status": "ERROR", "msg": "Folio no encontrado"}
 
-            # Insertar Visita usando id_sala_real
+            id_doctor = visita["id_doctor"]
+            id_cama = visita["id_cama"]
+            fecha_salida = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+            try:
+                # 1. Liberar Doctor
+                doctor = self.estado.doctores.get(id_doctor) or self.db.ejecutar_lectura(
+                    "SELECT carga_actual FROM doctores WHERE id_doctor=?", (id_doctor,))["data"][0]
+                nueva_carga = max(0, doctor["carga_actual"] - 1)
+
+                sql_doc = "UPDATE doctores SET carga_actual = ?, estado = 'DISPONIBLE' WHERE id_doctor = ?"
+                params_doc = (nueva_carga, id_doctor)
+
+                # 2. Liberar Cama
+                sql_cama = "UPDATE camas SET estado = ? WHERE id_cama = ?"
+                params_cama = (CAMA_LIBRE, id_cama)
+
+                # 3. Cerrar Visita
+                sql_visita = "UPDATE visitas SET estado = 'CERRADA', fecha_salida = ? WHERE folio = ?"
+                params_visita = (fecha_salida, folio)
+
+                ops = [
+                    {"sql": sql_doc, "params": params_doc,
+                     "evento": {"tipo": "doctor", "id_doctor": id_doctor, "carga_actual": nueva_carga}},
+                    {"sql": sql_cama, "params": params_cama,
+                     "evento": {"tipo": "cama", "id_cama": id_cama, "id_sala": visita["id_sala"], "estado": CAMA_LIBRE}},
+                    {"sql": sql_visita, "params": params_visita,
+                     "evento": {"tipo": "visita_cerrada", "folio": folio}}
+                ]
+                response = {"status": "OK", "msg": "Alta procesada"}
+                self._recordar(clave, response, ops)
+                res = self._confirmar(ops)
+                if res["status"] != MSG_OK:
+                    return self._fallo(res)
+                return response
+            except Exception as e:
+                return {"status": "ERROR", "msg": str(e)}
+
+    #   SHARDING POR SALA
+    #   Cada nodo escribe las camas y visitas de sus salas; el líder electo
+    #   (con lease) es el coordinador global de doctores, pacientes y membresía.
+
+    def _enrutar_shard(self, req_type, request):
+        if req_type == MSG_NEW_VISIT:
+            return self._nueva_visita_shard(request)
+        if req_type == "CLOSE_VISIT":
+            return self._cerrar_visita_shard(request)
+        if req_type == MSG_RESERVE_DOCTOR:
+            return self._sin_lease() or self.reservar_doctor(request.get("idempotency_key"))
+        if req_type == MSG_RELEASE_DOCTOR:
+            return self._sin_lease() or self.liberar_doctor(request["id_doctor"], request.get("idempotency_key"))
+        if req_type in LECTURAS:
+            return self._despachar(req_type, request)
+        # Pacientes y membresía: los atiende el coordinador global
+        sin_lease = self._sin_lease()
+        if not sin_lease:
+            return self._despachar(req_type, request)
+        if request.get("reenviada") or sin_lease["leader_id"] is None:
+            return sin_lease
+        return self._reenviar(sin_lease["leader_id"], request)
+
+    def _reenviar(self, node_id, request):
+        """Reenvía la petición tal cual al nodo indicado y devuelve su respuesta."""
+        nodo = nodo_por_id(node_id)
+        if not nodo:
+            return {"status": MSG_ERROR, "msg": f"Nodo {node_id} desconocido"}
+        # Nunca esperar más de lo que el cliente original sigue esperando
+        timeout = plazos.acotar(REENVIO_TIMEOUT, "reenvio")
+        try:
+            with TRAZAS.subspan("reenvio", nodo=node_id), \
+                 socket.create_connection((nodo["host"], nodo["port_manager"]), timeout=timeout) as s:
+                # El shard destino continúa la misma traza y el mismo plazo
+                s.sendall(json.dumps(dict(request, reenviada=True, traza=contexto_actual(), **plazos.para_mensaje())).encode("utf-8"))
+                s.shutdown(socket.SHUT_WR)
+                # Si el cliente pidió compresión, el shard destino también contesta en marcos
+                return recv_respuesta(s)
+        except (OSError, ValueError) as e:
+            return {"status": MSG_ERROR, "msg": f"Nodo {node_id} no disponible: {e}"}
+
+    def _pedir_al_coordinador(self, request):
+        # Se pide con el mutex de asignación tomado, ya pasado el punto sin retorno:
+        # cortarla por plazo podría dejar un cupo de doctor reservado y sin visita
+        with plazos.con_plazo(None):
+            if self.estado_lider():
+                if request["type"] == MSG_RESERVE_DOCTOR: return self.reservar_doctor(request.get("idempotency_key"))
+                return self.liberar_doctor(request["id_doctor"], request.get("idempotency_key"))
+            leader_id = get_term_state().leader_id
+            if leader_id is None:
+                return {"status": MSG_NOT_LEADER, "msg": "No hay coordinador electo", "leader_id": None}
+            return self._reenviar(leader_id, request)
+
+    def estado_lider(self):
+        return get_term_state().tengo_lease(self.node_id)
+
+    def _nueva_visita_shard(self, request):
+        id_sala = request.get("id_sala")
+        if id_sala is None:
+            libres = self.estado.camas_libres_por_sala()
+            propias = [s for s in salas_de_nodo(self.node_id, self.estado.salas()) if libres.get(s)]
+            if propias:
+                salas = propias
+            elif libres and not request.get("reenviada"):
+                # Sin camas propias: mandar al shard con más camas libres
+                id_sala = max(libres, key=libres.get)
+            else:
+                return {"status": "ERROR", "msg": "No hay recursos (Cama o Doctor saturados)"}
+        if id_sala is not None:
+            dueno = dueno_de_sala(id_sala)
+            if dueno != self.node_id:
+                if request.get("reenviada"):
+                    return {"status": MSG_ERROR, "msg": f"La sala {id_sala} no pertenece a este nodo"}
+                return self._reenviar(dueno, dict(request, id_sala=id_sala))
+            salas = [id_sala]
+
+        id_paciente = self._id_paciente(request.get("seguro"))
+        if id_paciente is None:
+            return {"status": MSG_ERROR, "msg": "Paciente no encontrado"}
+        return self.create_visit_shard(id_paciente, salas, request.get("idempotency_key"))
+
+    def create_visit_shard(self, id_paciente, salas, clave=None):
+        with self._mutex_medido(self.mutex_asignacion, "admision_shard"):
+            previa = self._respuesta_previa(clave)
+            if previa: return previa
+            self._asegurar_indices()
+
+            cama = self.estado.elegir_cama(salas)
+            if not cama:
+                return {"status": "ERROR", "msg": "No hay camas libres en la sala"}
+
+            # El folio es la clave de la reserva y de su liberación en el coordinador
+            folio = self.folios.siguiente(get_term_state().current_term)
+            doctor = self._pedir_al_coordinador({"type": MSG_RESERVE_DOCTOR, "idempotency_key": f"reservar:{folio}"})
+            if doctor.get("status") != MSG_OK:
+                return doctor
+
+            id_doctor, id_cama, id_sala = doctor["id_doctor"], cama["id_cama"], cama["id_sala"]
+            fecha_actual = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+            sql_update_cama = "UPDATE camas SET estado = ? WHERE id_cama = ?"
             sql_insert = """
                 INSERT INTO visitas (folio, id_paciente, id_doctor, id_cama, id_sala, fecha_ingreso, estado)
                 VALUES (?, ?, ?, ?, ?, ?, 'EN_PROCESO')
             """
-            params_insert = (folio, id_paciente, id_doctor, id_cama, id_sala_real, fecha_actual)
-            
-            # Ejecutar local
-            db.ejecutar_escritura(sql_update_doc, params_doc)
-            db.ejecutar_escritura(sql_update_cama, params_cama)
-            db.ejecutar_escritura(sql_insert, params_insert)
-
-            # Replicar
             ops = [
-                {"sql": sql_update_doc, "params": params_doc},
-                {"sql": sql_update_cama, "params": params_cama},
-                {"sql": sql_insert, "params": params_insert}
+                {"sql": sql_update_cama, "params": (CAMA_OCUPADA, id_cama),
+                 "evento": {"tipo": "cama", "id_cama": id_cama, "id_sala": id_sala, "estado": CAMA_OCUPADA}},
+                {"sql": sql_insert, "params": (folio, id_paciente, id_doctor, id_cama, id_sala, fecha_actual),
+                 "evento": {"tipo": "visita_abierta", "folio": folio, "id_paciente": id_paciente,
+                            "id_doctor": id_doctor, "id_cama": id_cama, "id_sala": id_sala}}
             ]
-            for op in ops:
-                broadcast_to_slaves({"type": "WRITE", "sql": op["sql"], "params": op["params"]}, sender_id=MY_NODE_ID)
-
-            print(f"[MASTER] Visita creada: {folio} en Sala {id_sala_real}")
-            return {"status": MSG_OK, "folio": folio, "fecha_ingreso": fecha_actual}
+            response = {"status": MSG_OK, "folio": folio, "fecha_ingreso": fecha_actual}
+            self._recordar(clave, response, ops)
+            res = self._confirmar(ops)
+            if res["status"] == MSG_ERROR:
+                # Devolver el cupo del doctor: la visita no se registró
+                self._liberar_doctor_de(folio, id_doctor)
+            if res["status"] != MSG_OK:
+                return self._fallo(res)
+            log.debug("visita_creada", folio=folio, sala=id_sala, shard=self.node_id)
+            return response
 
-        except Exception as e:
-            return {"status": "ERROR", "msg": str(e)}
-
-def close_visit_transaction(folio):
-    with mutex_asignacion:
-        folio = folio.strip()
-        print(f"[MASTER] Cerrando visita: '{folio}'")
-        
-        sql_get = "SELECT id_doctor, id_cama FROM visitas WHERE folio = ? AND estado = 'EN_PROCESO'"
-        visita = db.ejecutar_lectura(sql_get, (folio,))
-        
-        if not visita or not visita["data"]:
+    def _cerrar_visita_shard(self, request):
+        folio = (request.get("folio") or "").strip()
+        visita = self._buscar_visita_activa(folio)
+        if not visita:
             return {"status": "ERROR", "msg": "Folio no encontrado"}
-            
-        id_doctor = visita["data"][0]["id_doctor"]
-        id_cama = visita["data"][0]["id_cama"]
-        fecha_salida = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        try:
-            # 1. Liberar Doctor 
-            doc_data = db.ejecutar_lectura("SELECT carga_actual FROM doctores WHERE id_doctor=?", (id_doctor,))["data"][0]
-            nueva_carga = max(0, doc_data["carga_actual"] - 1)
-            
-            sql_doc = "UPDATE doctores SET carga_actual = ?, estado = 'DISPONIBLE' WHERE id_doctor = ?"
-            params_doc = (nueva_carga, id_doctor)
-            
-            # 2. Liberar Cama
-            sql_cama = "UPDATE camas SET estado = ? WHERE id_cama = ?"
-            params_cama = (CAMA_LIBRE, id_cama)
-            
-            # 3. Cerrar Visita
-            sql_visita = "UPDATE visitas SET estado = 'CERRADA', fecha_salida = ? WHERE folio = ?"
-            params_visita = (fecha_salida, folio)
-
-            db.ejecutar_escritura(sql_doc, params_doc)
-            db.ejecutar_escritura(sql_cama, params_cama)
-            db.ejecutar_escritura(sql_visita, params_visita)
-            
+        dueno = dueno_de_sala(visita["id_sala"])
+        if dueno != self.node_id:
+            if request.get("reenviada"):
+                return {"status": MSG_ERROR, "msg": f"La sala {visita['id_sala']} no pertenece a este nodo"}
+            return self._reenviar(dueno, request)
+        return self.close_visit_shard(folio, visita, request.get("idempotency_key"))
+
+    def close_visit_shard(self, folio, visita, clave=None):
+        with self._mutex_medido(self.mutex_asignacion, "alta_shard"):
+            previa = self._respuesta_previa(clave)
+            if previa: return previa
+            # Pudo cerrarse mientras esperábamos el mutex
+            if not self._buscar_visita_activa(folio):
+                return {"status": "ERROR", "msg": "Folio no encontrado"}
+
+            fecha_salida = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             ops = [
-                {"sql": sql_doc, "params": params_doc},
-                {"sql": sql_cama, "params": params_cama},
-                {"sql": sql_visita, "params": params_visita}
+                {"sql": "UPDATE camas SET estado = ? WHERE id_cama = ?", "params": (CAMA_LIBRE, visita["id_cama"]),
+                 "evento": {"tipo": "cama", "id_cama": visita["id_cama"], "id_sala": visita["id_sala"], "estado": CAMA_LIBRE}},
+                {"sql": "UPDATE visitas SET estado = 'CERRADA', fecha_salida = ? WHERE folio = ?", "params": (fecha_salida, folio),
+                 "evento": {"tipo": "visita_cerrada", "folio": folio}}
             ]
-            for op in ops:
-                broadcast_to_slaves({"type": "WRITE", "sql": op["sql"], "params": op["params"]}, sender_id=MY_NODE_ID)
+            response = {"status": "OK", "msg": "Alta procesada"}
+            self._recordar(clave, response, ops)
+            res = self._confirmar(ops)
+            if res["status"] != MSG_OK:
+                return self._fallo(res)
 
-            return {"status": "OK", "msg": "Alta procesada"}
-        except Exception as e:
-            return {"status": "ERROR", "msg": str(e)}
+        self._liberar_doctor_de(folio, visita["id_doctor"])
+        return response
+
+    def _liberar_doctor_de(self, folio, id_doctor):
+        """RELEASE_DOCTOR con el folio como clave; si el coordinador no lo confirma, queda pendiente."""
+        liberado = self._pedir_al_coordinador({"type": MSG_RELEASE_DOCTOR, "id_doctor": id_doctor,
+                                               "idempotency_key": f"liberar:{folio}"})
+        if liberado.get("status") == MSG_OK:
+            return True
+        log.aviso("doctor_no_liberado", doctor=id_doctor, folio=folio, msg=liberado.get("msg"))
+        with self._lock_liberaciones:
+            self._liberaciones_pendientes[folio] = id_doctor
+        METRICAS.contador("master_liberaciones_pendientes_total").inc()
+        return False
+
+    def _reintentar_liberaciones(self):
+        """
+        Reintenta las liberaciones pendientes hasta que el coordinador las confirme. Con
+        la misma clave, una que sí se aplicó pero cuya respuesta se perdió no descuenta
+        otra vez: el coordinador devuelve la respuesta recordada.
+        """
+        while True:
+            time.sleep(REINTENTO_LIBERACIONES)
+            with self._lock_liberaciones:
+                pendientes, self._liberaciones_pendientes = self._liberaciones_pendientes, {}
+            for folio, id_doctor in pendientes.items():
+                if self._liberar_doctor_de(folio, id_doctor):
+                    log.info("doctor_liberado_tarde", doctor=id_doctor, folio=folio)
+
+    def reservar_doctor(self, clave=None):
+        """Coordinador global: suma un paciente al doctor menos cargado (una vez por clave)."""
+        with self._mutex_medido(self.mutex_doctores, "reservar_doctor"):
+            previa = self._respuesta_previa(clave)
+            if previa: return previa
+            self._asegurar_indices()
+            doctor = self.estado.elegir_doctor()
+            if not doctor:
+                return {"status": "ERROR", "msg": "No hay recursos (Doctores saturados)"}
+            nueva_carga = doctor["carga_actual"] + 1
+            return self._actualizar_carga_doctor(doctor["id_doctor"], nueva_carga, doctor["capacidad_max"], clave)
 
-def generate_folio(paciente, doctor, sala):
-    import random
-    return f"P{paciente}-D{doctor}-S{sala}-{random.randint(1000, 9999)}"
+    def liberar_doctor(self, id_doctor, clave=None):
+        """Coordinador global: resta un paciente al doctor (una vez por clave)."""
+        with self._mutex_medido(self.mutex_doctores, "liberar_doctor"):
+            previa = self._respuesta_previa(clave)
+            if previa: return previa
+            doctor = self.estado.doctores.get(id_doctor)
+            if not doctor:
+                return {"status": "ERROR", "msg": f"Doctor {id_doctor} desconocido"}
+            nueva_carga = max(0, doctor["carga_actual"] - 1)
+            return self._actualizar_carga_doctor(id_doctor, nueva_carga, doctor["capacidad_max"], clave)
 
-if __name__ == "__main__": start_master_listener()
\ No newline at end of file
+    def _actualizar_carga_doctor(self, id_doctor, nueva_carga, capacidad_max, clave=None):
+        """La respuesta se recuerda con la carga nueva: un reintento con la misma clave no la cambia otra vez."""
+        nuevo_estado = "SATURADO" if nueva_carga >= capacidad_max else "DISPONIBLE"
+        ops = [{"sql": "UPDATE doctores SET carga_actual = ?, estado = ? WHERE id_doctor = ?",
+                "params": (nueva_carga, nuevo_estado, id_doctor),
+                "evento": {"tipo": "doctor", "id_doctor": id_doctor, "carga_actual": nueva_carga, "capacidad_max": capacidad_max}}]
+        response = {"status": MSG_OK, "id_doctor": id_doctor, "carga_actual": nueva_carga}
+        self._recordar(clave, response, ops)
+        res = self._confirmar(ops)
+        if res["status"] != MSG_OK:
+            return self._fallo(res)
+        return response
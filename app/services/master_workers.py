@@ -0,0 +1,166 @@
+import multiprocessing
+import os
+import socket
+import struct
+import threading
+import time
+
+from app.services.master_service import MasterService, LECTURAS, TAM_PAQUETE_CANAL
+from app.services.report_service import REPORTES
+from app.data_access.db_manager import set_db_context
+from app.core.tracing import TRAZAS
+from app.core.sharding import sharding_habilitado
+from app.core.admission_control import LimitadorCompartido
+from app.common.config_loader import (
+    get_topologia, update_cluster_config, load_cluster_config, leer_config_en_disco, set_membership_context
+)
+from app.common.constants import MSG_ERROR, MSG_NOT_LEADER
+from app.common.log import get_logger
+
+log = get_logger("TRABAJADOR")
+
+# Un trabajador resuelve lecturas y reportes con su propia conexión a SQLite; el
+# resto lo atiende el proceso principal, dueño de los índices en memoria y del
+# mutex de asignación
+PUBLICACION_LEASE = 0.02  # cada cuánto copia el proceso principal su lease a memoria compartida
+VIGILANCIA_PADRE = 0.5
+
+def ruta_canal(node_id):
+    return os.path.join("data", f"nodo_{node_id}_maestro.sock")
+
+class EspejoLease:
+    """
+    Copia del lease del proceso principal en memoria compartida: líder, fin del
+    lease (reloj monotónico, común a todos los procesos), término y versión de la
+    membresía. Los trabajadores solo la usan para lecturas; una escritura siempre
+    la decide el proceso principal con su propio estado.
+    """
+    def __init__(self, arreglo=None):
+        self.arreglo = arreglo if arreglo is not None else multiprocessing.get_context("spawn").Array("d", 4, lock=False)
+
+    def publicar(self, estado_termino):
+        leader_id, hasta, term = estado_termino.instantanea()
+        self.arreglo[0] = -1 if leader_id is None else leader_id
+        self.arreglo[1] = hasta
+        self.arreglo[2] = term
+        self.arreglo[3] = get_topologia().version
+
+    def tengo_lease(self, node_id):
+        return self.arreglo[0] == node_id and time.monotonic() < self.arreglo[1]
+
+    @property
+    def leader_id(self):
+        return None if self.arreglo[0] < 0 else int(self.arreglo[0])
+
+    @property
+    def version_membresia(self):
+        return int(self.arreglo[3])
+
+def publicar_lease(espejo, estado_termino):
+    while True:
+        espejo.publicar(estado_termino)
+        time.sleep(PUBLICACION_LEASE)
+
+class TrabajadorMaestro(MasterService):
+    """Listener adicional del puerto del maestro en otro proceso (SO_REUSEPORT)."""
+    def __init__(self, node_id, db_path, port, espejo, ruta, memoria_cuotas):
+        super().__init__(node_id, db_path, port, reuseport=True)
+        self.espejo = espejo
+        # Las cubetas por cliente son las del proceso principal, no unas propias
+        self.limitador = LimitadorCompartido.desde_config(load_cluster_config(), memoria_cuotas)
+        self.ruta_canal = ruta
+        self._canal = None
+        self._lock_canal = threading.Lock()
+        self._padre = os.getppid()
+
+    def _tareas_de_fondo(self):
+        # Archivo y anti-entropía son del proceso principal; aquí solo se vigila que siga
+        # vivo y se sigue la membresía que él cambia
+        threading.Thread(target=self._vigilar_padre, daemon=True).start()
+        threading.Thread(target=self._seguir_membresia, daemon=True).start()
+
+    def _vigilar_padre(self):
+        while os.getppid() == self._padre:
+            time.sleep(VIGILANCIA_PADRE)
+        # Sin proceso principal no hay a quién delegar: liberar el puerto ya
+        os._exit(0)
+
+    def _seguir_membresia(self):
+        """JOIN y LEAVE los aplica el proceso principal, que deja la membresía en el archivo del nodo."""
+        while True:
+            time.sleep(PUBLICACION_LEASE)
+            if self.espejo.version_membresia <= get_topologia().version: continue
+            try:
+                config = leer_config_en_disco()
+            except (OSError, ValueError) as e:
+                log.error("membresia_ilegible", error=e)
+                continue
+            # Si el archivo aún no trae la versión publicada, se reintenta en la siguiente vuelta
+            if update_cluster_config(config, persist=False):
+                log.info("membresia_actualizada", version=get_topologia().version)
+
+    def _sin_lease(self):
+        if self.espejo.tengo_lease(self.node_id):
+            return None
+        return {"status": MSG_NOT_LEADER, "msg": "Este nodo no tiene el liderazgo", "leader_id": self.espejo.leader_id}
+
+    def estado_lider(self):
+        return self.espejo.tengo_lease(self.node_id)
+
+    def handle_request(self, conn, data=None, llegada=None):
+        data = data or self._recibir(conn)
+        if not data:
+            conn.close()
+            return
+        try:
+            request, _ = self._decodificar(data)
+        except ValueError:
+            request = None
+        tipo = request.get("type") if isinstance(request, dict) else None
+        # Con sharding hasta las lecturas se enrutan según la topología: las resuelve el proceso principal.
+        # Un reporte en el líder no se calcula aquí tampoco: _atender lo manda a una réplica (lease del espejo)
+        if tipo in REPORTES or (tipo in LECTURAS and not sharding_habilitado()):
+            return super().handle_request(conn, data, llegada)
+        self._delegar(conn, data, request)
+
+    def _delegar(self, conn, data, request):
+        # Longitud total y bytes ya leídos; lo que no cabe en el primer paquete va en los siguientes
+        mensaje = struct.pack(">I", len(data)) + data
+        try:
+            with self._lock_canal:
+                if self._canal is None:
+                    self._canal = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+                    self._canal.connect(self.ruta_canal)
+                socket.send_fds(self._canal, [mensaje[:TAM_PAQUETE_CANAL]], [conn.fileno()])
+                for inicio in range(TAM_PAQUETE_CANAL, len(mensaje), TAM_PAQUETE_CANAL):
+                    self._canal.send(mensaje[inicio:inicio + TAM_PAQUETE_CANAL])
+        except OSError as e:
+            log.error("delegacion_fallida", error=e)
+            # Un envío cortado deja el canal a medias: la siguiente delegación abre otro
+            canal, self._canal = self._canal, None
+            if canal is not None: canal.close()
+            try:
+                self._responder(conn, request, {"status": MSG_ERROR, "msg": "Proceso principal no disponible"})
+            except OSError: pass
+        finally:
+            # El proceso principal tiene su propia copia del descriptor (y, si la
+            # conexión es persistente, atiende desde ahí sus siguientes peticiones)
+            conn.close()
+
+def _proceso_trabajador(node_id, db_path, port, ruta, arreglo, memoria_cuotas):
+    set_db_context(db_path)
+    set_membership_context(os.path.join(os.path.dirname(db_path), f"nodo_{node_id}_membresia.json"))
+    TRAZAS.node_id = node_id
+    TrabajadorMaestro(node_id, db_path, port, EspejoLease(arreglo), ruta, memoria_cuotas).start()
+
+def lanzar_trabajadores(node_id, db_path, port, cantidad, espejo, memoria_cuotas):
+    # spawn: el proceso principal ya tiene hilos y locks tomados; fork los copiaría a medias
+    contexto = multiprocessing.get_context("spawn")
+    procesos = []
+    for _ in range(cantidad):
+        proceso = contexto.Process(target=_proceso_trabajador, daemon=True,
+                                   args=(node_id, db_path, port, ruta_canal(node_id), espejo.arreglo, memoria_cuotas))
+        proceso.start()
+        procesos.append(proceso)
+    log.info("trabajadores_iniciados", cantidad=cantidad, puerto=port)
+    return procesos
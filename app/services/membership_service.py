@@ -0,0 +1,85 @@
+import json
+import socket
+
+from app.common.config_loader import load_cluster_config, update_cluster_config, with_nodes
+from app.common.constants import MSG_OK, MSG_ERROR, MSG_JOIN, MSG_LEAVE, MSG_MEMBERSHIP
+from app.data_access.db_manager import export_snapshot
+from app.services.replication_service import broadcast_to_slaves
+from app.common.protocol import codecs_disponibles, recv_respuesta
+from app.common.log import get_logger
+
+log = get_logger("MEMBRESIA")
+
+JOIN_TIMEOUT = 30
+CAMPOS_NODO = ("id", "host", "port_db", "port_manager")
+
+#   LADO MAESTRO
+
+def procesar_join(request, sender_id):
+    """
+    Da de alta un nodo nuevo. Debe llamarse con las escrituras congeladas
+    (mutex de asignación tomado) para que el snapshot y el cambio de membresía
+    sean atómicos respecto a la replicación.
+    """
+    nodo = request.get("node") or {}
+    if any(campo not in nodo for campo in CAMPOS_NODO):
+        return {"status": MSG_ERROR, "msg": f"JOIN requiere los campos {CAMPOS_NODO}"}
+    nodo = {campo: nodo[campo] for campo in CAMPOS_NODO}
+
+    config = load_cluster_config()
+    existente = next((n for n in config["nodes"] if n["id"] == nodo["id"]), None)
+    if existente and existente != nodo:
+        return {"status": MSG_ERROR, "msg": f"El ID {nodo['id']} ya está en uso"}
+
+    # El snapshot se toma ANTES de publicar la membresía: toda escritura posterior
+    # ya incluirá al nodo nuevo en el broadcast.
+    snapshot = export_snapshot()
+
+    if not existente:
+        nuevos_nodos = config["nodes"] + [nodo]
+        nueva_config = with_nodes(nuevos_nodos)
+        update_cluster_config(nueva_config)
+        broadcast_to_slaves({"type": MSG_MEMBERSHIP, "config": nueva_config}, sender_id=sender_id)
+        log.info("nodo_unido", nodo=nodo['id'], host=nodo['host'])
+
+    return {"status": MSG_OK, "config": load_cluster_config(), "snapshot": snapshot, "master_id": sender_id}
+
+def procesar_leave(request, sender_id):
+    """Da de baja un nodo y avisa a todos, incluido el que sale."""
+    node_id = request.get("node_id")
+    if node_id == sender_id:
+        return {"status": MSG_ERROR, "msg": "El maestro no puede salir del clúster"}
+
+    config = load_cluster_config()
+    restantes = [n for n in config["nodes"] if n["id"] != node_id]
+    if len(restantes) == len(config["nodes"]):
+        return {"status": MSG_ERROR, "msg": f"Nodo {node_id} no pertenece al clúster"}
+
+    nodos_previos = config["nodes"]
+    nueva_config = with_nodes(restantes)
+    update_cluster_config(nueva_config)
+    broadcast_to_slaves({"type": MSG_MEMBERSHIP, "config": nueva_config}, sender_id=sender_id, nodes=nodos_previos)
+    log.info("nodo_baja", nodo=node_id)
+    return {"status": MSG_OK, "config": nueva_config}
+
+#   LADO NODO NUEVO / SALIENTE
+
+def _enviar_al_maestro(host, port, data):
+    # La respuesta puede traer el snapshot completo: se pide comprimida y en fragmentos
+    with socket.create_connection((host, port), timeout=JOIN_TIMEOUT) as s:
+        s.sendall(json.dumps(dict(data, compresion=codecs_disponibles())).encode("utf-8"))
+        s.shutdown(socket.SHUT_WR)
+        return recv_respuesta(s)
+
+def solicitar_union(master_host, master_port, my_node):
+    """Pide al maestro entrar al clúster. Devuelve (config, snapshot, id_maestro)."""
+    resp = _enviar_al_maestro(master_host, master_port, {"type": MSG_JOIN, "node": my_node})
+    if resp.get("status") != MSG_OK:
+        raise RuntimeError(f"JOIN rechazado: {resp.get('msg')}")
+    return resp["config"], resp["snapshot"], resp["master_id"]
+
+def solicitar_salida(master_host, master_port, node_id):
+    resp = _enviar_al_maestro(master_host, master_port, {"type": MSG_LEAVE, "node_id": node_id})
+    if resp.get("status") != MSG_OK:
+        raise RuntimeError(f"LEAVE rechazado: {resp.get('msg')}")
+    return resp["config"]
@@ -0,0 +1,158 @@
+import datetime
+import time
+
+from app.data_access.db_manager import fetch_all
+from app.services.replication_service import confirmar_lote
+from app.core.term_state import get_term_state
+from app.core.sharding import sharding_habilitado, salas_de_nodo
+from app.core.metrics import METRICAS
+from app.common.constants import MSG_OK, MSG_ERROR, CAMA_LIBRE, CAMA_OCUPADA
+from app.common.log import get_logger
+
+log = get_logger("RECONCILIACION")
+
+INTERVALO_RECONCILIACION = 120  # segundos entre pasadas
+ESTANCIA_MAX_HORAS = 72         # visitas abiertas por más tiempo se marcan como excedidas
+LIMITE_EXCEDIDAS = 100          # folios que se listan en el reporte (el conteo es completo)
+
+class ServicioReconciliacion:
+    """
+    Recalcula la carga de cada doctor y el estado de cada cama a partir de las
+    visitas EN_PROCESO, que son la fuente de verdad: un alta que nunca se
+    registró, o que se cortó entre sus escrituras, deja doctores cargados y camas
+    OCUPADAS para siempre. Todas las diferencias de una pasada se corrigen en una
+    sola transacción, y se replican como un solo lote con sus eventos para los
+    índices en memoria.
+
+    Sin sharding revisa todo el líder con el mutex de asignación tomado, así que
+    lo que ve es exacto. Con sharding cada dueño revisa las camas de sus salas y
+    el coordinador a los doctores; una reserva de doctor cuya visita todavía no
+    llega por replicación parece una deriva, por eso ahí una diferencia de doctor
+    solo se corrige si se repite igual en dos pasadas seguidas.
+    """
+    def __init__(self, node_id, estado, mutex_asignacion, mutex_doctores):
+        self.node_id = node_id
+        self.estado = estado
+        self.mutex_asignacion = mutex_asignacion
+        self.mutex_doctores = mutex_doctores
+        self._sospechas = {}  # id_doctor -> (carga vista, corrección) de la pasada anterior
+
+    def revisar(self, estancia_max_horas=ESTANCIA_MAX_HORAS):
+        """Una pasada; devuelve cuántas filas se corrigieron y las visitas excedidas."""
+        inicio = time.perf_counter()
+        corregidas = []
+        if sharding_habilitado():
+            salas = salas_de_nodo(self.node_id, [c["id_sala"] for c in fetch_all("SELECT DISTINCT id_sala FROM camas")])
+            with self.mutex_asignacion:
+                corregidas += self._corregir(self._deriva_camas(salas))
+            with self.mutex_doctores:
+                if get_term_state().tengo_lease(self.node_id):
+                    corregidas += self._corregir(self._confirmadas(self._deriva_doctores()))
+        else:
+            salas = None
+            with self.mutex_asignacion:
+                # El lease pudo vencer mientras se esperaba el mutex: un líder depuesto no corrige
+                if not get_term_state().tengo_lease(self.node_id):
+                    return {"status": MSG_ERROR, "msg": "Este nodo no tiene el liderazgo"}
+                corregidas = self._corregir(self._deriva_doctores() + self._deriva_camas(None))
+
+        reporte = {
+            "doctores": sum(1 for op in corregidas if op["evento"]["tipo"] == "doctor"),
+            "camas": sum(1 for op in corregidas if op["evento"]["tipo"] == "cama"),
+            "excedidas": self._excedidas(salas, estancia_max_horas)
+        }
+        METRICAS.histograma("reconciliacion_segundos").observar(time.perf_counter() - inicio)
+        return dict(reporte, status=MSG_OK)
+
+    #   DERIVAS (con el mutex correspondiente tomado)
+
+    def _deriva_doctores(self):
+        filas = fetch_all("""
+            SELECT d.id_doctor, d.carga_actual, d.capacidad_max, d.estado, COALESCE(v.abiertas, 0) AS abiertas
+            FROM doctores d LEFT JOIN (
+                SELECT id_doctor, COUNT(*) AS abiertas FROM visitas WHERE estado = 'EN_PROCESO' GROUP BY id_doctor
+            ) v ON v.id_doctor = d.id_doctor
+        """)
+        ops = []
+        for d in filas:
+            estado = "SATURADO" if d["abiertas"] >= d["capacidad_max"] else "DISPONIBLE"
+            if (d["carga_actual"], d["estado"]) == (d["abiertas"], estado): continue
+            ops.append({
+                "sql": "UPDATE doctores SET carga_actual = ?, estado = ? WHERE id_doctor = ?",
+                "params": (d["abiertas"], estado, d["id_doctor"]),
+                "evento": {"tipo": "doctor", "id_doctor": d["id_doctor"], "carga_actual": d["abiertas"],
+                           "capacidad_max": d["capacidad_max"]},
+                "antes": d["carga_actual"]
+            })
+        return ops
+
+    def _deriva_camas(self, salas):
+        if salas is not None and not salas: return []
+        filtro, params = "", ()
+        if salas is not None:
+            filtro, params = f"WHERE c.id_sala IN ({','.join('?' * len(salas))})", tuple(salas)
+        filas = fetch_all(f"""
+            SELECT c.id_cama, c.id_sala, c.estado, v.id_cama IS NOT NULL AS ocupada
+            FROM camas c LEFT JOIN (
+                SELECT DISTINCT id_cama FROM visitas WHERE estado = 'EN_PROCESO'
+            ) v ON v.id_cama = c.id_cama {filtro}
+        """, params)
+        ops = []
+        for c in filas:
+            estado = CAMA_OCUPADA if c["ocupada"] else CAMA_LIBRE
+            if c["estado"] == estado: continue
+            ops.append({
+                "sql": "UPDATE camas SET estado = ? WHERE id_cama = ?",
+                "params": (estado, c["id_cama"]),
+                "evento": {"tipo": "cama", "id_cama": c["id_cama"], "id_sala": c["id_sala"], "estado": estado},
+                "antes": c["estado"]
+            })
+        return ops
+
+    def _confirmadas(self, ops):
+        """Solo las derivas que ya se vieron idénticas en la pasada anterior."""
+        previas, self._sospechas = self._sospechas, {}
+        confirmadas = []
+        for op in ops:
+            clave, firma = op["evento"]["id_doctor"], (op["antes"], op["params"])
+            if previas.get(clave) == firma:
+                confirmadas.append(op)
+            else:
+                self._sospechas[clave] = firma
+        return confirmadas
+
+    def _corregir(self, ops):
+        """Aplica las correcciones en una transacción y las replica; devuelve las aplicadas."""
+        if not ops: return []
+        # Como líder el lote se numera igual que los de las peticiones: las réplicas lo aplican en orden
+        res, _ = confirmar_lote(ops, self.node_id)
+        if res["status"] != MSG_OK:
+            # La transacción no dejó nada a medias: la siguiente pasada lo vuelve a intentar
+            return []
+        for op in ops:
+            self.estado.aplicar_evento(op["evento"])
+            tabla = "doctores" if op["evento"]["tipo"] == "doctor" else "camas"
+            METRICAS.contador("reconciliacion_filas_corregidas_total", tabla=tabla).inc()
+            log.aviso("deriva_corregida", tabla=tabla, id=op["params"][-1], antes=op["antes"], ahora=op["params"][0])
+        return ops
+
+    #   ESTANCIAS EXCEDIDAS
+
+    def _excedidas(self, salas, estancia_max_horas):
+        """Visitas abiertas hace más de `estancia_max_horas`: se reportan, no se cierran."""
+        if salas is not None and not salas:
+            METRICAS.medidor("visitas_estancia_excedida").fijar(0)
+            return {"total": 0, "visitas": []}
+        corte = (datetime.datetime.now() - datetime.timedelta(hours=estancia_max_horas)).strftime("%Y-%m-%d %H:%M:%S")
+        filtro, params = "", (corte,)
+        if salas is not None:
+            filtro, params = f"AND id_sala IN ({','.join('?' * len(salas))})", (corte, *salas)
+        visitas = fetch_all(f"""
+            SELECT folio, id_paciente, id_doctor, id_cama, id_sala, fecha_ingreso FROM visitas
+            WHERE estado = 'EN_PROCESO' AND fecha_ingreso < ? {filtro} ORDER BY fecha_ingreso
+        """, params)
+        METRICAS.medidor("visitas_estancia_excedida").fijar(len(visitas))
+        if visitas:
+            log.aviso("estancias_excedidas", cantidad=len(visitas), horas=estancia_max_horas,
+                      mas_antigua=visitas[0]["folio"], desde=visitas[0]["fecha_ingreso"])
+        return {"total": len(visitas), "horas": estancia_max_horas, "visitas": visitas[:LIMITE_EXCEDIDAS]}
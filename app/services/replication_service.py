@@ -3,10 +3,18 @@ import json
 import threading
 import time
 import os
+from collections import OrderedDict
 
-from app.data_access.db_manager import execute_sql
-from app.common.config_loader import load_cluster_config
+from app.data_access.db_manager import execute_sql, execute_batch, leer_posicion, SQL_AVANZAR_POSICION
+from app.common.config_loader import get_topologia
 from app.common.protocol import send_json as protocol_send_json, recv_json
+from app.common.constants import MSG_STALE_TERM, MSG_BUSY, MSG_WRITE_BATCH, MSG_OUT_OF_ORDER
+from app.core.term_state import get_term_state
+from app.core.metrics import METRICAS
+from app.core.tracing import TRAZAS, contexto_actual
+from app.common.log import get_logger, DEBUG
+
+log = get_logger("REPLICATION")
 
 
 #   CONFIGURACIÓN GENERAL
@@ -14,8 +22,63 @@ REPLICATION_PORT = 9001
 REPLICATION_TIMEOUT = 0.5  
 REPLICATION_RETRIES = 1 
 BUFFER_SIZE = 4096
+# Envíos simultáneos a un mismo esclavo; si no hay lugar en este plazo, la réplica cuenta como fallida
+EN_VUELO_POR_NODO = 8
+ESPERA_EN_VUELO = 2.0
+# Reintentos extra cuando el esclavo contesta BUSY (no cuentan como fallo)
+REINTENTOS_OCUPADO = 5
+# Lotes recientes que el líder guarda para poner al día a una réplica que perdió alguno
+LOTES_EN_MEMORIA = 2000
+
+_en_vuelo = {}
+_lock_en_vuelo = threading.Lock()
+
+def _cupo_nodo(node_id):
+    with _lock_en_vuelo:
+        if node_id not in _en_vuelo:
+            _en_vuelo[node_id] = threading.BoundedSemaphore(EN_VUELO_POR_NODO)
+        return _en_vuelo[node_id]
+
+
+
+class RegistroLotes:
+    """
+    Últimos lotes que este nodo numeró como líder, indexados por su posición previa.
+    Una réplica que perdió alguno contesta OUT_OF_ORDER con su posición y recibe de
+    aquí los que le faltan, en orden. Si ya no están (o la réplica tiene lotes que
+    este líder no), queda marcada y la pone al día la anti-entropía.
+    """
+    def __init__(self, maximo=LOTES_EN_MEMORIA):
+        # Numerar, confirmar y difundir un lote es una sola sección: las réplicas los reciben en orden
+        self.lock = threading.Lock()
+        self.maximo = maximo
+        self._por_previa = OrderedDict()
+        self._desfasadas = set()
+        self.hay_desfasadas = threading.Event()
+
+    def agregar(self, mensaje):
+        self._por_previa[tuple(mensaje["previa"])] = mensaje
+        while len(self._por_previa) > self.maximo:
+            self._por_previa.popitem(last=False)
+
+    def desde(self, posicion):
+        """Lotes posteriores a `posicion`, en orden; None si el registro no llega hasta ella."""
+        lotes, actual = [], tuple(posicion)
+        while actual in self._por_previa:
+            lotes.append(self._por_previa[actual])
+            actual = tuple(lotes[-1]["posicion"])
+        return lotes or None
+
+    def marcar_desfasada(self, node_id):
+        self._desfasadas.add(node_id)
+        self.hay_desfasadas.set()
 
+    def tomar_desfasadas(self):
+        self.hay_desfasadas.clear()
+        desfasadas, self._desfasadas = self._desfasadas, set()
+        return desfasadas
 
+REGISTRO = RegistroLotes()
 
 #  ENVIAR JSON
 def send_json(ip, port, data):
@@ -31,54 +94,141 @@ def send_json(ip, port, data):
         response = s.recv(BUFFER_SIZE).decode("utf-8")
         return json.loads(response)
     except Exception as e:
-        print(f"[REPLICATION] Error enviando a {ip}:{port} -> {e}")
+        log.error("envio_fallido", destino=f"{ip}:{port}", error=e)
         return None
     finally:
         s.close()
 
 
 
+#   LOTES DEL LÍDER
+
+def confirmar_lote(ops, node_id):
+    """
+    Confirma `ops` ([{"sql", "params", "evento"}]) en la BD local en una sola transacción
+    y las difunde como un WRITE_BATCH. Con el lease, el lote lleva su posición
+    (término, índice) y la previa, que avanzan en la misma transacción en cada nodo.
+    Devuelve (resultado local, cuántos nodos lo aplicaron contando a este); sin lease
+    el lote no se numera y no se cuentan (escrituras de una sala con sharding).
+    """
+    estado = get_term_state()
+    mensaje = {"type": MSG_WRITE_BATCH, "term": estado.current_term, "ops": [
+        {"sql": op["sql"], "params": op["params"], "evento": op.get("evento")} for op in ops
+    ]}
+    escrituras = [(op["sql"], op["params"]) for op in ops]
+    with REGISTRO.lock:
+        if estado.tengo_lease(node_id):
+            previa = leer_posicion()
+            posicion = (estado.current_term, previa[1] + 1)
+            escrituras.append((SQL_AVANZAR_POSICION, posicion))
+            mensaje.update(previa=list(previa), posicion=list(posicion))
+        with TRAZAS.subspan("sql.lote"):
+            res = execute_batch(escrituras)
+        if res["status"] != "OK":
+            return res, 0
+        if "posicion" in mensaje:
+            REGISTRO.agregar(mensaje)
+        resultados = broadcast_to_slaves(mensaje, sender_id=node_id)
+    if "posicion" not in mensaje:
+        return res, None
+    return res, 1 + sum(1 for aplicado in resultados.values() if aplicado)
+
 #   BROADCAST DESDE EL MAESTRO
-def broadcast_to_slaves(operation_json, sender_id=None):
-    print(f"[REPLICATION] Difundiendo: {operation_json.get('sql')[:30]}...")
+def broadcast_to_slaves(operation_json, sender_id=None, nodes=None):
+    # Alta frecuencia: una línea por escritura solo en DEBUG y muestreada
+    log.muestreado(100, DEBUG, "difusion", tipo=operation_json.get("type"))
+
+    # La membresía puede cambiar en caliente: se lee la vigente en cada difusión
+    if nodes is None:
+        nodes = get_topologia().nodos
 
-    config = load_cluster_config()
-    nodes = config["nodes"]
+    # Cada escritura viaja con el término del maestro: los esclavos rechazan términos viejos
+    estado = get_term_state()
+    if "term" not in operation_json:
+        operation_json = dict(operation_json, term=estado.current_term)
     
     results = {}
+    with TRAZAS.subspan("replicacion", tipo=operation_json.get("type")):
+        for node in nodes:
+            if sender_id is not None and node['id'] == sender_id:
+                continue
+            with TRAZAS.subspan("replica", nodo=node['id']):
+                results[node['id']] = _replicar_en(node, operation_json, estado)
+    return results
+
+def _replicar_en(node, operation_json, estado):
+    """Envía la operación a un esclavo (con reintentos); True si la aplicó."""
+    traza = contexto_actual()
+    if traza:
+        operation_json = dict(operation_json, traza=traza)
+
+    inicio = time.perf_counter()
+    cupo = _cupo_nodo(node['id'])
+    # La escritura ya está confirmada en el maestro: el plazo del cliente no decide si se replica
+    if not cupo.acquire(timeout=ESPERA_EN_VUELO):
+        log.aviso("replica_saturada", nodo=node['id'])
+        METRICAS.contador("replicacion_fallos_total", nodo=node['id']).inc()
+        return False
+    try:
+        success = _enviar_replica(node, operation_json, estado)
+    finally:
+        cupo.release()
 
-    for node in nodes:
-        if sender_id is not None and node['id'] == sender_id:
-            continue
-        target_ip = node["host"]
-        target_port = node["port_db"] 
-        
-        node_id = f"{target_ip}:{target_port}"
-
-        success = False
-        for attempt in range(REPLICATION_RETRIES):
-            try:
-                with socket.create_connection((target_ip, target_port), timeout=REPLICATION_TIMEOUT) as sock:
-
-                    protocol_send_json(sock, operation_json)
-                    
-                    response = recv_json(sock)
-                    
-                    if response and response.get("status") == "OK":
-                        print(f" Réplica exitosa en Nodo {node['id']}")
-                        success = True
-                        break 
-                    else:
-                         print(f"Respuesta inesperada de Nodo {node['id']}: {response}")
-
-            except ConnectionRefusedError:
-                pass
-            except Exception as e:
-                print(f"Error replicando a {node_id}: {e}")
+    METRICAS.histograma("replicacion_segundos", nodo=node['id']).observar(time.perf_counter() - inicio)
+    if not success:
+        METRICAS.contador("replicacion_fallos_total", nodo=node['id']).inc()
+    return success
+
+def _enviar_replica(node, operation_json, estado, al_dia=False):
+    target_ip = node["host"]
+    target_port = node["port_db"] 
+    
+    node_id = f"{target_ip}:{target_port}"
+
+    intentos = REPLICATION_RETRIES
+    ocupado = 0
+    while intentos > 0:
+        intentos -= 1
+        try:
+            with socket.create_connection((target_ip, target_port), timeout=REPLICATION_TIMEOUT) as sock:
+
+                protocol_send_json(sock, operation_json)
                 
-        results[node['id']] = success
+                response = recv_json(sock)
+                if response and response.get("spans"):
+                    TRAZAS.agregar(response["spans"])
 
-    return results
+                if response and response.get("status") == "OK":
+                    log.debug("replica_ok", nodo=node['id'])
+                    return True
+                elif response and response.get("status") == MSG_BUSY and ocupado < REINTENTOS_OCUPADO:
+                    # El esclavo está saturado pero vivo: esperar lo que pide y reintentar
+                    ocupado += 1
+                    intentos += 1
+                    time.sleep(response.get("retry_after", REPLICATION_TIMEOUT))
+                elif response and response.get("status") == MSG_OUT_OF_ORDER and not al_dia:
+                    # Le faltan lotes anteriores: se le mandan en orden, terminando con este
+                    faltantes = REGISTRO.desde(response.get("posicion") or (0, 0))
+                    if faltantes is None:
+                        log.aviso("replica_desfasada", nodo=node['id'], posicion=response.get("posicion"))
+                        REGISTRO.marcar_desfasada(node['id'])
+                        return False
+                    # Cada lote conserva su posición, pero viaja con el término de quien lo reenvía
+                    extra = {k: operation_json[k] for k in ("term", "traza") if k in operation_json}
+                    return all(_enviar_replica(node, dict(lote, **extra), estado, al_dia=True) for lote in faltantes)
+                elif response and response.get("status") == MSG_STALE_TERM:
+                    # Hay un término más nuevo: este nodo ya no es el maestro
+                    log.aviso("termino_rechazado", nodo=node['id'], term=operation_json['term'], vigente=response.get('term'))
+                    estado.observar_termino(response.get("term"))
+                    return False
+                else:
+                     log.aviso("respuesta_inesperada", nodo=node['id'], status=response and response.get("status"))
+
+        except ConnectionRefusedError:
+            pass
+        except Exception as e:
+            log.error("replica_fallida", destino=node_id, error=e)
+    return False
 
 #   FUNCION 2: LISTENER DEL ESCLAVO
 
@@ -90,8 +240,7 @@ def handle_replication(connection):
         data = connection.recv(BUFFER_SIZE).decode("utf-8")
         operation = json.loads(data)
 
-        print("\n[REPLICATION] Mensaje recibido:")
-        print(operation)
+        log.debug("mensaje_recibido", tipo=operation.get("type"))
 
         if operation["type"] != "REPLICATION":
             connection.sendall(json.dumps({"status": "ERROR"}).encode("utf-8"))
@@ -105,7 +254,7 @@ def handle_replication(connection):
 
         connection.sendall(json.dumps({"status": "OK"}).encode("utf-8"))
     except Exception as e:
-        print("[REPLICATION] Error procesando operación:", e)
+        log.error("operacion_fallida", error=e)
         connection.sendall(json.dumps({"status": "ERROR"}).encode("utf-8"))
     finally:
         connection.close()
@@ -120,7 +269,7 @@ def replication_listener():
     server.bind(("0.0.0.0", REPLICATION_PORT))
     server.listen()
 
-    print(f"[REPLICATION] Escuchando replicación en puerto {REPLICATION_PORT}...")
+    log.info("escuchando", puerto=REPLICATION_PORT)
 
     while True:
         conn, addr = server.accept()
@@ -0,0 +1,261 @@
+import calendar
+import datetime
+import threading
+from collections import defaultdict
+
+from app.data_access.archive import conexion_historica
+from app.data_access.db_manager import fetch_all
+from app.core.metrics import METRICAS
+from app.common.log import get_logger
+from app.common.constants import MSG_REPORT_LOS, MSG_REPORT_OCCUPANCY, MSG_REPORT_DOCTORS, MSG_REPORT_TRIAGE
+
+# NumPy es opcional y su importación pesa más que el resto del nodo: se carga con
+# el primer reporte, no al arrancar
+np = None
+_numpy_buscado = False
+
+def cargar_numpy():
+    global np, _numpy_buscado
+    if not _numpy_buscado:
+        _numpy_buscado = True
+        try:
+            import numpy as np
+        except ImportError:  # sin NumPy se agrega en Python puro
+            np = None
+    return np
+
+log = get_logger("REPORTES")
+
+REPORTES = {MSG_REPORT_LOS, MSG_REPORT_OCCUPANCY, MSG_REPORT_DOCTORS, MSG_REPORT_TRIAGE}
+
+INTERVALOS = {"hora": 3600, "dia": 86400}
+LOTE_CARGA = 50000
+FORMATO_FECHA = "%Y-%m-%d %H:%M:%S"
+
+def _segundos(texto):
+    """Fecha de la BD -> segundos, con la misma convención que strftime('%s') de SQLite."""
+    if len(texto) == 10: texto += " 00:00:00"
+    return calendar.timegm(datetime.datetime.strptime(texto, FORMATO_FECHA).timetuple())
+
+def _fecha(segundos):
+    return datetime.datetime.fromtimestamp(segundos, datetime.timezone.utc).strftime(FORMATO_FECHA)
+
+def _ahora():
+    return calendar.timegm(datetime.datetime.now().timetuple())
+
+def _percentil(valores_ordenados, q):
+    if len(valores_ordenados) == 0: return None
+    return valores_ordenados[min(len(valores_ordenados) - 1, int(q * len(valores_ordenados)))]
+
+class ServicioReportes:
+    """
+    Reportes sobre el historial de visitas (tabla caliente + archivo) pensados
+    para correr en una réplica, no en el maestro. Las columnas se cargan por
+    lotes en arreglos (NumPy si está instalado) y se agregan de forma vectorizada.
+
+    Los resultados se guardan por intervalo (hora o día): un intervalo ya
+    terminado no cambia, así que cada consulta solo carga las filas de los
+    intervalos que faltan y del intervalo en curso.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = defaultdict(dict)  # (reporte, intervalo) -> {indice_intervalo: resultado}
+
+    @property
+    def motor(self):
+        return "numpy" if np is not None else "python"
+
+    def atender(self, req_type, request):
+        cargar_numpy()
+        try:
+            intervalo = INTERVALOS[request.get("intervalo", "dia")]
+            hoy = datetime.date.today()
+            desde = _segundos(request.get("desde") or (hoy - datetime.timedelta(days=7)).strftime("%Y-%m-%d"))
+            hasta = _segundos(request["hasta"]) if request.get("hasta") else _ahora() + 1
+        except (KeyError, ValueError):
+            return {"status": "ERROR", "msg": "Parámetros inválidos (desde/hasta 'YYYY-MM-DD[ HH:MM:SS]', intervalo hora|dia)"}
+
+        with METRICAS.cronometro("reporte_segundos", tipo=req_type):
+            try:
+                series = self._serie(req_type, intervalo, desde, hasta)
+            except ValueError as e:
+                return {"status": "ERROR", "msg": str(e)}
+        return {"status": "OK", "reporte": req_type, "motor": self.motor, "series": series}
+
+    def _serie(self, reporte, intervalo, desde, hasta):
+        primero, ultimo = desde // intervalo, (hasta - 1) // intervalo
+        en_curso = _ahora() // intervalo
+        cache = self._cache[(reporte, intervalo)]
+        calculados = {}
+        with self._lock:
+            faltan = [b for b in range(primero, ultimo + 1) if b not in cache or b >= en_curso]
+        if faltan:
+            calculados = self._calcular(reporte, intervalo, faltan[0], faltan[-1])
+            with self._lock:
+                for b in faltan:
+                    resultado = calculados.get(b, {})
+                    # Solo los intervalos cerrados son definitivos
+                    if b < en_curso: cache[b] = resultado
+                    else: cache.pop(b, None)
+            METRICAS.contador("reporte_intervalos_calculados_total", tipo=reporte).inc(len(faltan))
+        with self._lock:
+            return [dict(inicio=_fecha(b * intervalo), **(cache.get(b) or calculados.get(b, {})))
+                    for b in range(primero, ultimo + 1)]
+
+    #   CARGA COLUMNAR
+
+    def _cargar(self, sql, params, columnas, mes_desde, mes_hasta=None):
+        """Ejecuta `sql` y devuelve {columna: arreglo}, leyendo por lotes."""
+        datos = {c: [] for c in columnas}
+        conn = conexion_historica(mes_desde, mes_hasta)
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                filas = cursor.fetchmany(LOTE_CARGA)
+                if not filas: break
+                for nombre, valores in zip(columnas, zip(*filas)):
+                    datos[nombre].extend(valores)
+        finally:
+            conn.close()
+        if np is not None:
+            datos = {c: np.asarray(v, dtype=np.int64) for c, v in datos.items()}
+        return datos
+
+    def _calcular(self, reporte, intervalo, b_ini, b_fin):
+        ini, fin = b_ini * intervalo, (b_fin + 1) * intervalo
+        f_ini, f_fin = _fecha(ini), _fecha(fin)
+        mes_ini, mes_fin = f_ini[:7], f_fin[:7]
+        ts = "CAST(strftime('%s', {}) AS INTEGER)"
+        salida = f"COALESCE({ts.format('fecha_salida')}, -1)"
+
+        if reporte == MSG_REPORT_LOS:
+            d = self._cargar(
+                f"SELECT id_sala, {ts.format('fecha_ingreso')}, {salida} FROM visitas_historicas "
+                "WHERE estado = 'CERRADA' AND fecha_salida >= ? AND fecha_salida < ?",
+                (f_ini, f_fin), ("sala", "ingreso", "salida"), mes_ini, mes_fin)
+            return self._estancia(d, intervalo)
+
+        if reporte == MSG_REPORT_TRIAGE:
+            d = self._cargar(
+                f"SELECT COALESCE(p.triage, -1), {ts.format('v.fecha_ingreso')} FROM visitas_historicas v "
+                "LEFT JOIN main.pacientes p ON p.id_paciente = v.id_paciente "
+                "WHERE v.fecha_ingreso >= ? AND v.fecha_ingreso < ?",
+                (f_ini, f_fin), ("triage", "ingreso"), mes_ini)
+            return self._triage(d, intervalo)
+
+        # Ocupación y doctores: toda visita que se traslape con [ini, fin)
+        columna = "id_sala" if reporte == MSG_REPORT_OCCUPANCY else "id_doctor"
+        d = self._cargar(
+            f"SELECT {columna}, {ts.format('fecha_ingreso')}, {salida} FROM visitas_historicas "
+            "WHERE fecha_ingreso < ? AND (fecha_salida IS NULL OR fecha_salida >= ?)",
+            (f_fin, f_ini), ("clave", "ingreso", "salida"), mes_ini)
+        if reporte == MSG_REPORT_OCCUPANCY:
+            camas = dict(self._cargar_tabla("SELECT id_sala, COUNT(*) FROM camas GROUP BY id_sala"))
+            return self._ocupacion(d, intervalo, b_ini, b_fin, camas)
+        capacidad = dict(self._cargar_tabla("SELECT id_doctor, capacidad_max FROM doctores"))
+        return self._doctores(d, intervalo, b_ini, b_fin, capacidad)
+
+    def _cargar_tabla(self, sql):
+        return [tuple(fila.values()) for fila in fetch_all(sql)]
+
+    #   AGREGACIONES (cada una con su versión NumPy y su versión en Python puro)
+
+    def _estancia(self, d, intervalo):
+        resultado = defaultdict(dict)
+        if np is not None:
+            if not len(d["sala"]): return {}
+            horas = (d["salida"] - d["ingreso"]) / 3600.0
+            buckets = d["salida"] // intervalo
+            claves = buckets * 1_000_000 + d["sala"]
+            orden = np.argsort(claves, kind="stable")
+            claves, horas = claves[orden], horas[orden]
+            unicas, inicios = np.unique(claves, return_index=True)
+            for clave, grupo in zip(unicas, np.split(horas, inicios[1:])):
+                grupo = np.sort(grupo)
+                resultado[int(clave // 1_000_000)][str(int(clave % 1_000_000))] = {
+                    "visitas": int(grupo.size), "media_h": round(float(grupo.mean()), 3),
+                    "p50_h": round(float(_percentil(grupo, 0.5)), 3), "p90_h": round(float(_percentil(grupo, 0.9)), 3)}
+        else:
+            grupos = defaultdict(list)
+            for sala, ingreso, salida in zip(d["sala"], d["ingreso"], d["salida"]):
+                grupos[(salida // intervalo, sala)].append((salida - ingreso) / 3600.0)
+            for (b, sala), horas in sorted(grupos.items()):
+                horas.sort()
+                resultado[b][str(sala)] = {
+                    "visitas": len(horas), "media_h": round(sum(horas) / len(horas), 3),
+                    "p50_h": round(_percentil(horas, 0.5), 3), "p90_h": round(_percentil(horas, 0.9), 3)}
+        return {b: {"salas": salas} for b, salas in resultado.items()}
+
+    def _horas_por_clave(self, d, intervalo, b_ini, b_fin):
+        """
+        {intervalo: {clave: (horas, visitas)}}: horas-paciente dentro de cada intervalo
+        y visitas presentes en él, por sala o por doctor. Las visitas abiertas cuentan hasta ahora.
+        """
+        ahora = _ahora()
+        resultado = {}
+        if np is not None:
+            if not len(d["clave"]): return {}
+            claves, idx = np.unique(d["clave"], return_inverse=True)
+            salida = np.where(d["salida"] < 0, ahora, d["salida"])
+            for b in range(b_ini, b_fin + 1):
+                inicio, fin = b * intervalo, (b + 1) * intervalo
+                traslape = np.clip(np.minimum(salida, fin) - np.maximum(d["ingreso"], inicio), 0, None)
+                horas = np.bincount(idx, weights=traslape, minlength=len(claves)) / 3600.0
+                visitas = np.bincount(idx, weights=traslape > 0, minlength=len(claves))
+                por_clave = {int(c): (float(h), int(v)) for c, h, v in zip(claves, horas, visitas) if v}
+                if por_clave: resultado[b] = por_clave
+            return resultado
+        # Sin NumPy: cada visita recorre solo los intervalos que toca (suelen ser uno o dos)
+        acumulado = defaultdict(lambda: defaultdict(lambda: [0.0, 0]))
+        for clave, ingreso, salida in zip(d["clave"], d["ingreso"], d["salida"]):
+            salida = ahora if salida < 0 else salida
+            for b in range(max(b_ini, ingreso // intervalo), min(b_fin, salida // intervalo) + 1):
+                traslape = min(salida, (b + 1) * intervalo) - max(ingreso, b * intervalo)
+                if traslape > 0:
+                    celda = acumulado[b][clave]
+                    celda[0] += traslape / 3600.0
+                    celda[1] += 1
+        return {b: {c: tuple(v) for c, v in por_clave.items()} for b, por_clave in acumulado.items()}
+
+    def _ocupacion(self, d, intervalo, b_ini, b_fin, camas):
+        """Camas ocupadas en promedio durante cada intervalo y visitas que pasaron por la sala."""
+        horas_intervalo = intervalo / 3600.0
+        resultado = {}
+        for b, por_sala in self._horas_por_clave(d, intervalo, b_ini, b_fin).items():
+            salas = {}
+            for sala, (horas, visitas) in sorted(por_sala.items()):
+                promedio = horas / horas_intervalo
+                total = camas.get(sala)
+                salas[str(sala)] = {"visitas": visitas, "camas_ocupadas_prom": round(promedio, 3),
+                                    "pct": round(100.0 * promedio / total, 1) if total else None}
+            resultado[b] = {"salas": salas}
+        return resultado
+
+    def _doctores(self, d, intervalo, b_ini, b_fin, capacidad):
+        """Horas-paciente de cada doctor sobre las que podría atender con su capacidad máxima."""
+        horas_intervalo = intervalo / 3600.0
+        resultado = {}
+        for b, por_doctor in self._horas_por_clave(d, intervalo, b_ini, b_fin).items():
+            doctores = {}
+            for doctor, (horas, visitas) in sorted(por_doctor.items()):
+                disponible = capacidad.get(doctor, 0) * horas_intervalo
+                doctores[str(doctor)] = {"visitas": visitas, "horas": round(horas, 3),
+                                         "utilizacion": round(horas / disponible, 4) if disponible else None}
+            resultado[b] = {"doctores": doctores}
+        return resultado
+
+    def _triage(self, d, intervalo):
+        resultado = defaultdict(lambda: {"triage": {}})
+        if np is not None:
+            if not len(d["triage"]): return {}
+            claves = (d["ingreso"] // intervalo) * 100 + (d["triage"] + 1)
+            unicas, conteos = np.unique(claves, return_counts=True)
+            for clave, conteo in zip(unicas, conteos):
+                nivel = int(clave % 100) - 1
+                resultado[int(clave // 100)]["triage"][str(nivel) if nivel >= 0 else "sin_triage"] = int(conteo)
+            return dict(resultado)
+        for nivel, ingreso in zip(d["triage"], d["ingreso"]):
+            mezcla = resultado[ingreso // intervalo]["triage"]
+            nombre = str(nivel) if nivel >= 0 else "sin_triage"
+            mezcla[nombre] = mezcla.get(nombre, 0) + 1
+        return {b: {"triage": dict(sorted(v["triage"].items()))} for b, v in resultado.items()}
@@ -1,60 +1,110 @@
 import socket
 import threading
 from app.common.protocol import recv_json, send_json
-from app.common.constants import MSG_ERROR, MSG_OK
-from app.data_access.db_manager import DatabaseManager
+from app.common.constants import (
+    MSG_ERROR, MSG_OK, MSG_MEMBERSHIP, MSG_STALE_TERM, MSG_ARCHIVE, MSG_BUSY, MSG_MERKLE, MSG_REPAIR, MSG_WRITE_BATCH,
+    MSG_OUT_OF_ORDER, MSG_POSITION
+)
+from app.core.term_state import get_term_state
+from app.core.metrics import METRICAS
+from app.core.tracing import TRAZAS
+from app.common.log import get_logger
+from app.common.config_loader import update_cluster_config, load_cluster_config
+from app.core.admission_control import PoolAcotado, limites_listener
+from app.data_access.db_manager import DatabaseManager, import_snapshot, execute_batch, leer_posicion, SQL_AVANZAR_POSICION
+from app.data_access.archive import archivar_visitas
+from app.data_access import merkle
+
+log = get_logger("STORAGE")
 
 class StorageService:
-    def __init__(self, db_path, port, host='0.0.0.0'):
+    def __init__(self, db_path, port, host='0.0.0.0', estado_caliente=None):
         self.host = host
         self.port = port
         self.db_path = db_path
         self.running = False
+        self.pool = None
+        self._server = None
+        # Índices del maestro que este nodo mantiene calientes (standby)
+        self.estado_caliente = estado_caliente
+
+        # Mientras un nodo nuevo carga su snapshot, las escrituras replicadas
+        # se encolan y se aplican al terminar (si no, el snapshot las borraría)
+        self._bootstrap_lock = threading.Lock()
+        self._en_bootstrap = False
+        self._escrituras_pendientes = []
+        # Revisar la posición y aplicar el lote que la avanza es una sola operación
+        self._lock_lotes = threading.Lock()
+        self._arboles = merkle.CacheArboles()
         
         # Instanciamos el gestor de BD 
         self.db = DatabaseManager(db_path, "config/schema.sql")
 
+    def escuchar(self):
+        """Abre el puerto ya: los peers pueden conectar mientras el nodo termina de arrancar."""
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.port))
+        self._server.listen(128)
+        return self._server
+
     def start(self):
         self.running = True
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        
         try:
-            server_socket.bind((self.host, self.port))
-            server_socket.listen(5)
-            print(f"[Storage] Nodo escuchando en {self.host}:{self.port} (BD: {self.db_path})")
+            server_socket = self._server or self.escuchar()
+            # Hilos fijos y cola acotada: SQLite tiene un solo escritor, más hilos
+            # solo alargan la fila detrás de su lock
+            hilos, cola = limites_listener("storage", load_cluster_config())
+            self.pool = PoolAcotado("storage", hilos, cola)
+            log.info("escuchando", host=self.host, puerto=self.port, bd=self.db_path, hilos=hilos, cola=cola)
 
             while self.running:
                 try:
                     client_sock, addr = server_socket.accept()
-                    # Cada petición se maneja en un hilo separado para no bloquear al nodo
-                    client_handler = threading.Thread(
-                        target=self._handle_client,
-                        args=(client_sock,)
-                    )
-                    client_handler.start()
+                    if not self.pool.enviar(self._handle_client, client_sock):
+                        self._rechazar(client_sock)
                 except OSError:
                     break
                     
         except Exception as e:
-            print(f"[Storage Error] No se pudo iniciar el servidor: {e}")
+            log.error("inicio_fallido", error=e)
         finally:
-            server_socket.close()
+            if self._server: self._server.close()
+
+    def _rechazar(self, client_socket):
+        """Cola llena: el maestro reintenta tras retry_after (ver _replicar_en)."""
+        try:
+            # Se descarta lo ya recibido para que el cierre no sea un RST
+            client_socket.setblocking(False)
+            try: client_socket.recv(65536)
+            except BlockingIOError: pass
+            client_socket.setblocking(True)
+            send_json(client_socket, {"status": MSG_BUSY, "retry_after": self.pool.reintentar_en()})
+        except OSError: pass
+        finally: client_socket.close()
 
     def _handle_client(self, client_socket):
+        request = None
         try:
             request = recv_json(client_socket)
             if not request:
                 return
 
-            print(f"[Storage] Petición recibida: {request}")
-            response = self._process_request(request)
-            send_json(client_socket, response)
+            # Solo el tipo: el SQL y sus parámetros llevan datos de pacientes
+            log.debug("peticion", tipo=request.get("type"))
+            traza = request.get("traza")
+            with METRICAS.cronometro("storage_peticion_segundos", tipo=request.get("type")), \
+                 TRAZAS.span(f"storage.{request.get('type')}", traza_remota=traza) as span_id:
+                response = self._process_request(request)
+            if traza:
+                # El llamador incorpora estos spans a su árbol
+                response = dict(response, spans=TRAZAS.subarbol(span_id))
+            send_json(client_socket, response, request.get("compresion"))
             
         except Exception as e:
-            print(f"[Storage Error] Procesando cliente: {e}")
+            log.error("peticion_fallida", error=e)
             error_response = {"status": MSG_ERROR, "message": str(e)}
-            send_json(client_socket, error_response)
+            send_json(client_socket, error_response, request and request.get("compresion"))
         finally:
             client_socket.close()
 
@@ -63,11 +113,118 @@ class StorageService:
         sql = request.get("sql")
         params = tuple(request.get("params", []))
 
+        # Fencing: escrituras de un maestro con término viejo se rechazan
+        if req_type in ("WRITE", MSG_WRITE_BATCH, MSG_MEMBERSHIP, MSG_ARCHIVE, MSG_REPAIR, MSG_POSITION) and "term" in request:
+            estado = get_term_state()
+            if not estado.observar_termino(request["term"]):
+                return {"status": MSG_STALE_TERM, "term": estado.current_term}
+
         if req_type == "WRITE":
-            return self.db.ejecutar_escritura(sql, params)
+            with self._bootstrap_lock:
+                if self._en_bootstrap:
+                    self._escrituras_pendientes.append({"ops": [{"sql": sql, "params": params, "evento": request.get("evento")}]})
+                    return {"status": MSG_OK, "encolada": True}
+            res = self.db.ejecutar_escritura(sql, params)
+            if self.estado_caliente and res["status"] == MSG_OK:
+                evento = request.get("evento")
+                if evento:
+                    self.estado_caliente.aplicar_evento(evento)
+                else:
+                    self.estado_caliente.marcar_sucio(sql)
+            return res
+
+        elif req_type == MSG_WRITE_BATCH:
+            with self._bootstrap_lock:
+                if self._en_bootstrap:
+                    self._escrituras_pendientes.append(request)
+                    return {"status": MSG_OK, "encolada": True}
+            return self._aplicar_lote(request)
+
+        elif req_type == MSG_POSITION:
+            if "fijar" in request:
+                # La anti-entropía dejó esta réplica con todas las filas del líder hasta esa posición
+                with self._lock_lotes:
+                    res = self.db.ejecutar_escritura(SQL_AVANZAR_POSICION, tuple(request["fijar"]))
+                if res["status"] != MSG_OK: return res
+            return {"status": MSG_OK, "posicion": list(leer_posicion())}
+
+        elif req_type == MSG_ARCHIVE:
+            with self._bootstrap_lock:
+                # Sin problema si se omite: la siguiente pasada del líder cubre estas filas
+                if self._en_bootstrap:
+                    return {"status": MSG_OK, "omitida": True}
+            return archivar_visitas(request["hasta"])
+
+        elif req_type == MSG_MERKLE:
+            tabla = request["tabla"]
+            if tabla not in merkle.TABLAS_MERKLE:
+                return {"status": MSG_ERROR, "msg": f"Tabla no comparable: {tabla}"}
+            if "indices" not in request:
+                return {"status": MSG_OK, "tamano": merkle.tamano(tabla)}
+            # La raíz abre un descenso nuevo: se reconstruye; los niveles siguientes usan ese mismo árbol
+            arbol = self._arboles.obtener(tabla, request["hojas"], nuevo=request["indices"] == [0])
+            return {"status": MSG_OK, "hashes": [arbol[i].hex() for i in request["indices"]]}
+
+        elif req_type == MSG_REPAIR:
+            with self._bootstrap_lock:
+                if self._en_bootstrap:
+                    return {"status": MSG_OK, "omitida": True}
+            res = merkle.reparar_hojas(request["tabla"], request["hojas"], request["primera"], request["ultima"],
+                                       request["columnas"], request["filas"])
+            if self.estado_caliente and res["status"] == MSG_OK:
+                self.estado_caliente.marcar_sucio()
+            return res
+
+        elif req_type == MSG_MEMBERSHIP:
+            cambio = update_cluster_config(request["config"])
+            return {"status": MSG_OK, "aplicada": cambio}
         
         elif req_type == "READ":
             # Usado para SELECT
             return self.db.ejecutar_lectura(sql, params)
             
-        return {"status": MSG_ERROR, "message": "Tipo de petición desconocido"}
\ No newline at end of file
+        return {"status": MSG_ERROR, "message": "Tipo de petición desconocido"}
+
+    def _aplicar_lote(self, request):
+        """
+        Un lote numerado por el líder solo se aplica si viene justo después del último
+        aplicado; si no, se contesta OUT_OF_ORDER con la posición de este nodo y el
+        líder manda primero los que faltan. Así la posición nunca salta un lote.
+        """
+        escrituras = [(op["sql"], tuple(op["params"])) for op in request["ops"]]
+        with self._lock_lotes:
+            if "posicion" in request:
+                actual = leer_posicion()
+                if actual != tuple(request["previa"]):
+                    return {"status": MSG_OUT_OF_ORDER, "posicion": list(actual)}
+                escrituras.append((SQL_AVANZAR_POSICION, tuple(request["posicion"])))
+            res = execute_batch(escrituras)
+        if self.estado_caliente and res["status"] == MSG_OK:
+            for op in request["ops"]:
+                if op.get("evento"):
+                    self.estado_caliente.aplicar_evento(op["evento"])
+                else:
+                    self.estado_caliente.marcar_sucio(op["sql"])
+        return res
+
+    # ARRANQUE DESDE SNAPSHOT (nodos que se unen en caliente)
+
+    def begin_bootstrap(self):
+        with self._bootstrap_lock:
+            self._en_bootstrap = True
+            self._escrituras_pendientes = []
+
+    def finish_bootstrap(self, snapshot):
+        """Carga el snapshot del maestro y reproduce las escrituras recibidas mientras tanto."""
+        res = import_snapshot(snapshot)
+        with self._bootstrap_lock:
+            pendientes = self._escrituras_pendientes
+            self._escrituras_pendientes = []
+            self._en_bootstrap = False
+            # Se aplican con el lock tomado para conservar el orden de llegada; cada lote, entero o nada
+            for lote in pendientes:
+                self._aplicar_lote(lote)
+            if self.estado_caliente:
+                self.estado_caliente.cargar_desde_bd(self.db)
+        log.info("snapshot_cargado", pendientes=len(pendientes))
+        return res
@@ -0,0 +1,130 @@
+"""
+Benchmark del cliente asíncrono (app.client.aio).
+
+Levanta N nodos locales (igual que cluster_bench) y, desde un solo proceso,
+manda lotes de peticiones con muchas en vuelo a la vez: registra pacientes,
+los ingresa, consulta disponibilidad y da de alta. Reporta throughput y
+latencias por fase. Con --conexion-por-peticion cada petición abre su propio
+socket con JSON plano (como la terminal interactiva), para comparar contra el
+pool de conexiones persistentes.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.async_client_bench --nodos 3 --pacientes 2000 --concurrencia 256
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import time
+
+from benchmarks.cluster_bench import preparar_directorio, lanzar_nodos, esperar_lider, percentil
+from app.client.aio import ClienteUrgencias, ClusterNoDisponible
+from app.client.aio.client import CONEXIONES_POR_NODO
+
+class ClienteConexionPorPeticion(ClienteUrgencias):
+    """Mismos reintentos, pero un socket nuevo y JSON plano por intento."""
+    async def _pedir(self, node_id, mensaje, vence):
+        host, port = self.nodos[node_id]
+        timeout = min(self.timeout, vence - time.monotonic())
+        return await asyncio.wait_for(self._una_conexion(host, port, dict(mensaje, plazo_ms=int(timeout * 1000))), timeout)
+
+    @staticmethod
+    async def _una_conexion(host, port, mensaje):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            mensaje = {k: v for k, v in mensaje.items() if k != "compresion"}
+            writer.write(json.dumps(mensaje).encode("utf-8"))
+            writer.write_eof()
+            return json.loads((await reader.read()).decode("utf-8"))
+        finally:
+            writer.close()
+
+async def medir(cliente, mensajes, concurrencia):
+    latencias = []
+    cupo = asyncio.Semaphore(concurrencia)
+    async def una(mensaje):
+        async with cupo:
+            inicio = time.perf_counter()
+            try:
+                respuesta = await cliente.enviar(mensaje)
+            except ClusterNoDisponible:
+                respuesta = None
+            latencias.append(time.perf_counter() - inicio)
+            return respuesta
+    inicio = time.perf_counter()
+    respuestas = await asyncio.gather(*(una(m) for m in mensajes))
+    duracion = time.perf_counter() - inicio
+    latencias.sort()
+    ok = sum(1 for r in respuestas if r and r.get("status") == "OK")
+    resumen = {
+        "peticiones": len(mensajes), "ok": ok, "duracion_s": duracion,
+        "throughput_rps": len(mensajes) / duracion if duracion else 0.0,
+        "p50_ms": percentil(latencias, 50) * 1000, "p99_ms": percentil(latencias, 99) * 1000,
+    }
+    return respuestas, resumen
+
+async def escenario(args, config):
+    clase = ClienteConexionPorPeticion if args.conexion_por_peticion else ClienteUrgencias
+    fases = {}
+    async with clase.desde_config(config, conexiones_por_nodo=args.conexiones) as cliente:
+        seguros = [f"ASYNC-{i}" for i in range(args.pacientes)]
+        _, fases["registro"] = await medir(cliente, [
+            {"type": "REGISTER_PATIENT", "nombre": f"Paciente {s}", "seguro": s} for s in seguros
+        ], args.concurrencia)
+        admisiones, fases["ingreso"] = await medir(cliente, [
+            {"type": "NEW_VISIT", "seguro": s} for s in seguros
+        ], args.concurrencia)
+        _, fases["disponibilidad"] = await medir(cliente, [{"type": "CHECK_AVAIL"}] * args.pacientes, args.concurrencia)
+        folios = [r["folio"] for r in admisiones if r and r.get("folio")]
+        _, fases["alta"] = await medir(cliente, [{"type": "CLOSE_VISIT", "folio": f} for f in folios], args.concurrencia)
+    return fases
+
+def correr(args):
+    workdir, config = preparar_directorio(args)
+    # La cuota del maestro es por dirección de origen: todo el proceso cuenta como un solo cliente
+    config["admision"] = {"tasa_cliente": args.tasa_cliente, "rafaga_cliente": args.tasa_cliente}
+    with open(os.path.join(workdir, "config", "cluster_config.json"), "w") as f:
+        json.dump(config, f, indent=4)
+    procesos = lanzar_nodos(workdir, config, args.procesos_maestro)
+    try:
+        esperar_lider(config)
+        fases = asyncio.run(escenario(args, config))
+    finally:
+        for p in procesos.values(): p.kill()
+        for p in procesos.values(): p.wait()
+        if args.conservar:
+            print(f"[ASYNC] Directorio conservado: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    modo = "conexion_por_peticion" if args.conexion_por_peticion else "pool_persistente"
+    for fase, r in fases.items():
+        print(f"[ASYNC] {modo} {fase:<15} {r['ok']}/{r['peticiones']} OK  {r['throughput_rps']:.0f} req/s  "
+              f"p50 {r['p50_ms']:.1f} ms  p99 {r['p99_ms']:.1f} ms")
+    resultado = {"modo": modo, "nodos": args.nodos, "concurrencia": args.concurrencia, "fases": fases}
+    with open(args.salida, "w") as f:
+        json.dump(resultado, f, indent=2)
+    print(f"[ASYNC] Resultados en {args.salida}")
+    return resultado
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del cliente asíncrono")
+    parser.add_argument("--nodos", type=int, default=3)
+    parser.add_argument("--pacientes", type=int, default=2000, help="Peticiones por fase")
+    parser.add_argument("--concurrencia", type=int, default=256, help="Peticiones en vuelo a la vez")
+    parser.add_argument("--conexiones", type=int, default=CONEXIONES_POR_NODO, help="Conexiones persistentes por nodo")
+    parser.add_argument("--conexion-por-peticion", action="store_true", help="Sin pool: un socket por petición")
+    parser.add_argument("--procesos-maestro", type=int, default=0, help="Procesos trabajadores extra por nodo (--procesos)")
+    parser.add_argument("--tasa-cliente", type=int, default=10000, help="Cuota del maestro para este cliente (req/s)")
+    parser.add_argument("--sharding", action="store_true", help="Habilitar sharding por sala")
+    parser.add_argument("--camas-por-sala", type=int, default=1000)
+    parser.add_argument("--doctores", type=int, default=400)
+    parser.add_argument("--capacidad-doctor", type=int, default=10)
+    parser.add_argument("--puerto-base", type=int, default=18500, help="port_manager = base + id, port_db = base + 1000 + id")
+    parser.add_argument("--salida", default="async_resultado.json")
+    parser.add_argument("--conservar", action="store_true", help="No borrar el directorio temporal (logs y BDs)")
+    correr(parser.parse_args(argv))
+
+if __name__ == "__main__":
+    main()
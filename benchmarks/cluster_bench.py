@@ -0,0 +1,345 @@
+"""
+Benchmark de extremo a extremo del clúster.
+
+Levanta N nodos locales en 127.0.0.1 (cada uno con su propia BD en un
+directorio temporal), reproduce una mezcla de carga de urgencias con semilla
+fija y reporta throughput y latencias p50/p99/p999 por tipo de petición.
+Opcionalmente mata al maestro a mitad de la corrida para medir el failover.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.cluster_bench --nodos 3 --duracion 30 --clientes 16 \\
+        --mezcla register=1,admit=3,avail=4,discharge=2 --matar-maestro-en 10 \\
+        --salida resultados.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+RAIZ_REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SCHEMA_PATH = os.path.join(RAIZ_REPO, "config", "schema.sql")
+
+TIMEOUT_PETICION = 2.0
+LIMITE_REINTENTOS = 10.0
+TIPOS = {
+    "register": "REGISTER_PATIENT",
+    "admit": "NEW_VISIT",
+    "avail": "CHECK_AVAIL",
+    "discharge": "CLOSE_VISIT",
+}
+
+#   PREPARACIÓN DEL CLÚSTER
+
+def generar_config(n_nodos, puerto_base, sharding):
+    nodos = [
+        {"id": i, "host": "127.0.0.1", "port_db": puerto_base + 1000 + i, "port_manager": puerto_base + i}
+        for i in range(1, n_nodos + 1)
+    ]
+    return {
+        "initial_master_id": 1,
+        "sharding": {"habilitado": sharding, "duenos_sala": {str(i): i for i in range(1, n_nodos + 1)}},
+        "nodes": nodos,
+    }
+
+def sembrar(ruta_db, n_salas, camas_por_sala, n_doctores, capacidad_doctor):
+    """Mismos datos en todos los nodos, en una sola transacción."""
+    conn = sqlite3.connect(ruta_db)
+    with open(SCHEMA_PATH) as f:
+        conn.executescript(f.read())
+    conn.executemany(
+        "INSERT INTO nodos (id_sala, nombre, ip, puerto) VALUES (?, ?, '127.0.0.1', 0)",
+        [(s, f"Sala {s}") for s in range(1, n_salas + 1)]
+    )
+    conn.executemany(
+        "INSERT INTO camas (id_sala, numero_cama, estado) VALUES (?, ?, 'LIBRE')",
+        [(s, f"{s}-{c}") for s in range(1, n_salas + 1) for c in range(camas_por_sala)]
+    )
+    conn.executemany(
+        "INSERT INTO doctores (nombre, especialidad, carga_actual, capacidad_max) VALUES (?, 'Urgencias', 0, ?)",
+        [(f"Dr. {d}", capacidad_doctor) for d in range(n_doctores)]
+    )
+    conn.commit()
+    conn.close()
+
+def preparar_directorio(args):
+    workdir = tempfile.mkdtemp(prefix="bench_cluster_")
+    os.makedirs(os.path.join(workdir, "config"))
+    os.makedirs(os.path.join(workdir, "data"))
+    shutil.copy(SCHEMA_PATH, os.path.join(workdir, "config", "schema.sql"))
+    config = generar_config(args.nodos, args.puerto_base, args.sharding)
+    with open(os.path.join(workdir, "config", "cluster_config.json"), "w") as f:
+        json.dump(config, f, indent=4)
+    for nodo in config["nodes"]:
+        sembrar(os.path.join(workdir, "data", f"nodo_{nodo['id']}.db"),
+                args.nodos, args.camas_por_sala, args.doctores, args.capacidad_doctor)
+    return workdir, config
+
+def lanzar_nodos(workdir, config, procesos_maestro=0):
+    env = dict(os.environ, PYTHONPATH=RAIZ_REPO + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    procesos = {}
+    for nodo in config["nodes"]:
+        log = open(os.path.join(workdir, f"nodo_{nodo['id']}.log"), "w")
+        procesos[nodo["id"]] = subprocess.Popen(
+            [sys.executable, "-u", "-m", "app.main", str(nodo["id"]), "--procesos", str(procesos_maestro)],
+            cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+    return procesos
+
+#   CLIENTE
+
+def enviar(host, port, data, timeout=TIMEOUT_PETICION):
+    with socket.create_connection((host, port), timeout=timeout) as s:
+        s.settimeout(timeout)
+        # El nodo abandona la petición cuando este intento ya se dio por perdido
+        s.sendall(json.dumps(dict(data, plazo_ms=int(timeout * 1000))).encode("utf-8"))
+        s.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = s.recv(65536)
+            if not chunk: break
+            chunks.append(chunk)
+    return json.loads(b"".join(chunks).decode("utf-8"))
+
+def estado_nodos(config):
+    estados = {}
+    for nodo in config["nodes"]:
+        try:
+            estados[nodo["id"]] = enviar(nodo["host"], nodo["port_manager"], {"type": "STATUS"}, timeout=0.5)
+        except (OSError, ValueError):
+            pass
+    return estados
+
+def esperar_lider(config, limite=30):
+    fin = time.time() + limite
+    while time.time() < fin:
+        for node_id, estado in estado_nodos(config).items():
+            if estado.get("es_lider"): return node_id
+        time.sleep(0.2)
+    raise RuntimeError("El clúster no eligió líder a tiempo")
+
+class Cliente:
+    """Un operador simulado: su secuencia de operaciones depende solo de la semilla."""
+    def __init__(self, idx, config, semilla, mezcla, registro):
+        self.idx = idx
+        self.nodos = config["nodes"]
+        self.rng = random.Random(semilla * 1000 + idx)
+        self.tipos = list(mezcla.keys())
+        self.pesos = list(mezcla.values())
+        self.registro = registro
+        self.preferido = idx % len(self.nodos)
+        self.pacientes = []
+        self.folios = []
+        self.n = 0
+        self.ocupados = 0
+        self.vencidas = 0
+
+    def _peticion(self, data):
+        """Reintenta entre nodos con la misma clave hasta obtener respuesta del maestro."""
+        limite = time.time() + LIMITE_REINTENTOS
+        while time.time() < limite:
+            for k in range(len(self.nodos)):
+                nodo = self.nodos[(self.preferido + k) % len(self.nodos)]
+                try:
+                    resp = enviar(nodo["host"], nodo["port_manager"], data)
+                except (OSError, ValueError):
+                    continue
+                if resp.get("status") == "BUSY":
+                    # Mismo nodo, tras la espera que indica
+                    self.ocupados += 1
+                    self.preferido = (self.preferido + k) % len(self.nodos)
+                    time.sleep(resp.get("retry_after", 0.05))
+                    break
+                if resp.get("status") == "DEADLINE_EXCEEDED":
+                    # Equivale a un timeout de este intento: reintentar con la misma clave
+                    self.vencidas += 1
+                    continue
+                if resp.get("status") == "NOT_LEADER":
+                    lider = resp.get("leader_id")
+                    if lider is not None:
+                        self.preferido = next((i for i, n in enumerate(self.nodos) if n["id"] == lider), self.preferido)
+                    continue
+                self.preferido = (self.preferido + k) % len(self.nodos)
+                return resp
+            else:
+                time.sleep(0.05)
+        return None
+
+    def paso(self):
+        tipo = self.rng.choices(self.tipos, self.pesos)[0]
+        if tipo == "admit" and not self.pacientes: tipo = "register"
+        if tipo == "discharge" and not self.folios: tipo = "avail"
+
+        self.n += 1
+        data = {"type": TIPOS[tipo]}
+        if tipo == "register":
+            seguro = f"B{self.idx}-{self.n}"
+            data.update(nombre=f"Paciente {self.idx}-{self.n}", seguro=seguro)
+        elif tipo == "admit":
+            data["seguro"] = self.rng.choice(self.pacientes)
+        elif tipo == "discharge":
+            data["folio"] = self.folios.pop(self.rng.randrange(len(self.folios)))
+        if tipo != "avail":
+            data["idempotency_key"] = uuid.uuid4().hex
+
+        inicio = time.perf_counter()
+        resp = self._peticion(data)
+        latencia = time.perf_counter() - inicio
+
+        ok = bool(resp) and resp.get("status") == "OK"
+        if ok and tipo == "register": self.pacientes.append(data["seguro"])
+        if ok and tipo == "admit": self.folios.append(resp["folio"])
+        self.registro(tipo, time.time(), latencia, ok, resp is None)
+
+#   MÉTRICAS
+
+def percentil(valores_ordenados, p):
+    if not valores_ordenados: return None
+    k = max(0, min(len(valores_ordenados) - 1, int(round(p / 100.0 * len(valores_ordenados) + 0.5)) - 1))
+    return valores_ordenados[k]
+
+def resumir(muestras, duracion):
+    resumen = {}
+    for tipo in sorted({m[0] for m in muestras}):
+        propias = [m for m in muestras if m[0] == tipo]
+        latencias = sorted(m[2] * 1000 for m in propias if m[3])
+        resumen[tipo] = {
+            "total": len(propias),
+            "ok": len(latencias),
+            "errores": sum(1 for m in propias if not m[3] and not m[4]),
+            "sin_respuesta": sum(1 for m in propias if m[4]),
+            "throughput_ok_s": round(len(latencias) / duracion, 2),
+            "p50_ms": percentil(latencias, 50),
+            "p99_ms": percentil(latencias, 99),
+            "p999_ms": percentil(latencias, 99.9),
+        }
+    return resumen
+
+#   CORRIDA
+
+def parse_mezcla(texto):
+    mezcla = {}
+    for parte in texto.split(","):
+        nombre, peso = parte.split("=")
+        if nombre not in TIPOS: raise ValueError(f"Tipo desconocido en la mezcla: {nombre}")
+        mezcla[nombre] = float(peso)
+    return mezcla
+
+def correr(args):
+    mezcla = parse_mezcla(args.mezcla)
+    workdir, config = preparar_directorio(args)
+    # La cuota del maestro es por dirección de origen y todos los operadores salen de
+    # esta máquina: se les da la suma de lo que tendría cada uno en su terminal
+    config["admision"] = {"tasa_cliente": 100 * args.clientes, "rafaga_cliente": 200 * args.clientes}
+    with open(os.path.join(workdir, "config", "cluster_config.json"), "w") as f:
+        json.dump(config, f, indent=4)
+    procesos = lanzar_nodos(workdir, config, args.procesos_maestro)
+    muestras = []
+    lock = threading.Lock()
+    failover = None
+
+    def registro(tipo, t, latencia, ok, sin_respuesta):
+        with lock: muestras.append((tipo, t, latencia, ok, sin_respuesta))
+
+    try:
+        t_arranque = time.time()
+        lider_inicial = esperar_lider(config)
+        print(f"[BENCH] Líder inicial: Nodo {lider_inicial} ({time.time() - t_arranque:.2f}s)")
+
+        fin = time.time() + args.duracion
+        clientes = [Cliente(i, config, args.semilla, mezcla, registro) for i in range(args.clientes)]
+
+        def bucle(cliente):
+            while time.time() < fin:
+                cliente.paso()
+
+        hilos = [threading.Thread(target=bucle, args=(c,), daemon=True) for c in clientes]
+        t_inicio = time.time()
+        for h in hilos: h.start()
+
+        if args.matar_maestro_en is not None:
+            time.sleep(args.matar_maestro_en)
+            lider = esperar_lider(config)
+            t_kill = time.time()
+            procesos[lider].kill()
+            print(f"[BENCH] Maestro (Nodo {lider}) eliminado en t={t_kill - t_inicio:.2f}s")
+            failover = {"nodo_eliminado": lider, "t_kill_s": round(t_kill - t_inicio, 3)}
+
+        for h in hilos: h.join()
+        duracion = time.time() - t_inicio
+
+        if failover:
+            t_kill = t_inicio + failover["t_kill_s"]
+            escrituras_ok = sorted(m[1] for m in muestras if m[3] and m[0] in ("register", "admit", "discharge") and m[1] > t_kill)
+            estados = estado_nodos(config)
+            nuevo = next((nid for nid, e in estados.items() if e.get("es_lider")), None)
+            failover.update(
+                nuevo_lider=nuevo,
+                primera_escritura_tras_kill_s=round(escrituras_ok[0] - t_kill, 3) if escrituras_ok else None,
+                promocion_a_primera_admision_ms=estados.get(nuevo, {}).get("ultimo_failover_ms"),
+                fallos_tras_kill=sum(1 for m in muestras if not m[3] and m[1] > t_kill),
+            )
+
+        # Desglose interno de cada nodo vivo (mutex, SQL, replicación)
+        metricas = {}
+        for nodo in config["nodes"]:
+            try:
+                metricas[nodo["id"]] = enviar(nodo["host"], nodo["port_manager"], {"type": "METRICS"}).get("metricas")
+            except (OSError, ValueError):
+                pass
+
+        resultado = {
+            "parametros": vars(args),
+            "duracion_s": round(duracion, 3),
+            "total_ok": sum(1 for m in muestras if m[3]),
+            "throughput_total_ok_s": round(sum(1 for m in muestras if m[3]) / duracion, 2),
+            "por_tipo": resumir(muestras, duracion),
+            "respuestas_busy": sum(c.ocupados for c in clientes),
+            "respuestas_plazo_vencido": sum(c.vencidas for c in clientes),
+            "failover": failover,
+            "metricas_nodos": metricas,
+        }
+    finally:
+        for p in procesos.values(): p.kill()
+        for p in procesos.values(): p.wait()
+        if args.conservar:
+            print(f"[BENCH] Directorio de la corrida: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.salida, "w") as f:
+        json.dump(resultado, f, indent=2)
+    print(json.dumps(resultado["por_tipo"], indent=2))
+    if failover: print(f"[BENCH] Failover: {failover}")
+    print(f"[BENCH] Resultados en {args.salida}")
+    return resultado
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo del clúster")
+    parser.add_argument("--nodos", type=int, default=3)
+    parser.add_argument("--duracion", type=float, default=20, help="Segundos de carga")
+    parser.add_argument("--clientes", type=int, default=8, help="Operadores concurrentes")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--mezcla", default="register=1,admit=3,avail=4,discharge=2",
+                        help="Pesos por tipo: register, admit, avail, discharge")
+    parser.add_argument("--matar-maestro-en", type=float, default=None, help="Segundos tras el inicio para matar al maestro")
+    parser.add_argument("--sharding", action="store_true", help="Habilitar sharding por sala")
+    parser.add_argument("--camas-por-sala", type=int, default=50)
+    parser.add_argument("--doctores", type=int, default=40)
+    parser.add_argument("--capacidad-doctor", type=int, default=5)
+    parser.add_argument("--procesos-maestro", type=int, default=0, help="Procesos trabajadores extra por nodo (--procesos)")
+    parser.add_argument("--puerto-base", type=int, default=18000, help="port_manager = base + id, port_db = base + 1000 + id")
+    parser.add_argument("--salida", default="bench_resultado.json")
+    parser.add_argument("--conservar", action="store_true", help="No borrar el directorio temporal (logs y BDs)")
+    return correr(parser.parse_args(argv))
+
+if __name__ == "__main__":
+    main()
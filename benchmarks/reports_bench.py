@@ -0,0 +1,125 @@
+"""
+Benchmark del motor de reportes contra el SQL equivalente.
+
+Genera una BD con N visitas (1 millón por defecto) repartidas en los últimos
+`--dias` días y mide cada reporte diario: SQL agrupado en SQLite, el motor
+columnar en frío (sin caché), en caliente (solo el intervalo en curso) y,
+si NumPy está instalado, también el motor en Python puro.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.reports_bench --visitas 1000000 --dias 30
+"""
+import argparse
+import datetime
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from app.data_access.db_manager import set_db_context
+from app.services import report_service
+from app.common.constants import MSG_REPORT_LOS, MSG_REPORT_OCCUPANCY, MSG_REPORT_DOCTORS, MSG_REPORT_TRIAGE
+
+RAIZ_REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+FORMATO = "%Y-%m-%d %H:%M:%S"
+
+SQL_EQUIVALENTE = {
+    MSG_REPORT_LOS: """
+        SELECT substr(fecha_salida, 1, 10) AS dia, id_sala, COUNT(*),
+               AVG((julianday(fecha_salida) - julianday(fecha_ingreso)) * 24)
+        FROM visitas WHERE estado = 'CERRADA' AND fecha_salida >= :desde
+        GROUP BY dia, id_sala""",
+    MSG_REPORT_OCCUPANCY: """
+        WITH RECURSIVE dias(d) AS (SELECT date(:desde) UNION ALL SELECT date(d, '+1 day') FROM dias WHERE d < date('now', 'localtime'))
+        SELECT d, id_sala, COUNT(*) FROM dias JOIN visitas
+          ON fecha_ingreso < date(d, '+1 day') AND (fecha_salida IS NULL OR fecha_salida >= d)
+        GROUP BY d, id_sala""",
+    MSG_REPORT_DOCTORS: """
+        WITH RECURSIVE dias(d) AS (SELECT date(:desde) UNION ALL SELECT date(d, '+1 day') FROM dias WHERE d < date('now', 'localtime'))
+        SELECT d, id_doctor,
+               SUM(MAX(0, MIN(julianday(COALESCE(fecha_salida, datetime('now', 'localtime'))), julianday(d, '+1 day'))
+                        - MAX(julianday(fecha_ingreso), julianday(d))) * 24)
+        FROM dias JOIN visitas
+          ON fecha_ingreso < date(d, '+1 day') AND (fecha_salida IS NULL OR fecha_salida >= d)
+        GROUP BY d, id_doctor""",
+    MSG_REPORT_TRIAGE: """
+        SELECT substr(v.fecha_ingreso, 1, 10) AS dia, p.triage, COUNT(*)
+        FROM visitas v LEFT JOIN pacientes p ON p.id_paciente = v.id_paciente
+        WHERE v.fecha_ingreso >= :desde GROUP BY dia, p.triage""",
+}
+
+def generar(ruta, n_visitas, dias, semilla, n_salas=4, n_doctores=40, n_pacientes=100000):
+    rng = random.Random(semilla)
+    conn = sqlite3.connect(ruta)
+    with open(os.path.join(RAIZ_REPO, "config", "schema.sql")) as f:
+        conn.executescript(f.read())
+    conn.executemany("INSERT INTO nodos (id_sala, nombre) VALUES (?, ?)", [(s, f"Sala {s}") for s in range(1, n_salas + 1)])
+    conn.executemany("INSERT INTO camas (id_sala, numero_cama) VALUES (?, ?)",
+                     [(s, f"{s}-{c}") for s in range(1, n_salas + 1) for c in range(50)])
+    conn.executemany("INSERT INTO doctores (nombre, capacidad_max) VALUES (?, 5)", [(f"Dr. {d}",) for d in range(n_doctores)])
+    conn.executemany("INSERT INTO pacientes (nombre, seguro_social, triage) VALUES (?, ?, ?)",
+                     [(f"P{p}", f"SS{p}", rng.randint(1, 5)) for p in range(n_pacientes)])
+    ahora = datetime.datetime.now()
+    inicio = ahora - datetime.timedelta(days=dias)
+    rango = int((ahora - inicio).total_seconds())
+
+    def visitas():
+        for i in range(n_visitas):
+            ingreso = inicio + datetime.timedelta(seconds=rng.randrange(rango))
+            salida = ingreso + datetime.timedelta(minutes=rng.expovariate(1 / 240))
+            cerrada = salida < ahora
+            yield (f"F{i}", rng.randint(1, n_pacientes), rng.randint(1, n_doctores), None, rng.randint(1, n_salas),
+                   ingreso.strftime(FORMATO), salida.strftime(FORMATO) if cerrada else None,
+                   "CERRADA" if cerrada else "EN_PROCESO")
+
+    conn.executemany("INSERT INTO visitas (folio, id_paciente, id_doctor, id_cama, id_sala, fecha_ingreso, fecha_salida, estado) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", visitas())
+    conn.commit()
+    conn.close()
+    return inicio.strftime("%Y-%m-%d")
+
+def cronometrar(funcion):
+    t0 = time.perf_counter()
+    funcion()
+    return time.perf_counter() - t0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Motor de reportes vs SQL equivalente")
+    parser.add_argument("--visitas", type=int, default=1_000_000)
+    parser.add_argument("--dias", type=int, default=30)
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench_reportes_")
+    try:
+        ruta = os.path.join(workdir, "data", "nodo_1.db")
+        os.makedirs(os.path.dirname(ruta))
+        t0 = time.perf_counter()
+        desde = generar(ruta, args.visitas, args.dias, args.semilla)
+        print(f"BD con {args.visitas} visitas generada en {time.perf_counter() - t0:.1f}s")
+        set_db_context(ruta)
+
+        motores = ["numpy", "python"] if report_service.cargar_numpy() is not None else ["python"]
+        numpy_real = report_service.np
+        print(f"{'reporte':<18}{'SQL':>10}" + "".join(f"{m + ' frío':>14}{m + ' caliente':>16}" for m in motores))
+        for reporte, sql in SQL_EQUIVALENTE.items():
+            conn = sqlite3.connect(ruta)
+            t_sql = cronometrar(lambda: conn.execute(sql, {"desde": desde}).fetchall())
+            conn.close()
+            fila = f"{reporte:<18}{t_sql:>9.2f}s"
+            for motor in motores:
+                report_service.np = numpy_real if motor == "numpy" else None
+                servicio = report_service.ServicioReportes()
+                peticion = {"desde": desde, "intervalo": "dia"}
+                t_frio = cronometrar(lambda: servicio.atender(reporte, peticion))
+                t_caliente = cronometrar(lambda: servicio.atender(reporte, peticion))
+                fila += f"{t_frio:>13.2f}s{t_caliente:>15.3f}s"
+            report_service.np = numpy_real
+            print(fila)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Benchmark del arranque de un nodo.
+
+Levanta N nodos locales sobre BDs sintéticas (generar_datos.py) y mide, desde
+que se lanza cada proceso: cuándo acepta conexiones su puerto de
+almacenamiento, cuándo responde STATUS su puerto de gestión y cuándo el
+clúster tiene líder y atiende CHECK_AVAIL. Después reinicia varias veces un
+esclavo (el caso de un simulacro de failover) y reporta el tiempo hasta que
+vuelve a atender y a reconocer al líder, y si el reinicio depuso al líder.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.startup_bench --nodos 3 --visitas 100000 --reinicios 5
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.cluster_bench import generar_config, enviar
+
+RAIZ_REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SONDEO = 0.005
+LIMITE = 60.0
+
+def preparar_directorio(args):
+    workdir = tempfile.mkdtemp(prefix="bench_arranque_")
+    os.makedirs(os.path.join(workdir, "config"))
+    shutil.copy(os.path.join(RAIZ_REPO, "config", "schema.sql"), os.path.join(workdir, "config", "schema.sql"))
+    config = generar_config(args.nodos, args.puerto_base, False)
+    with open(os.path.join(workdir, "config", "cluster_config.json"), "w") as f:
+        json.dump(config, f, indent=4)
+    ids = [str(n["id"]) for n in config["nodes"]]
+    subprocess.run(
+        [sys.executable, os.path.join(RAIZ_REPO, "generar_datos.py"), "--nodos", *ids,
+         "--pacientes", str(args.pacientes), "--visitas", str(args.visitas), "--dias", str(args.dias)],
+        cwd=workdir, env=_entorno(), check=True, stdout=subprocess.DEVNULL
+    )
+    return workdir, config
+
+def _entorno():
+    return dict(os.environ, PYTHONPATH=RAIZ_REPO + os.pathsep + os.environ.get("PYTHONPATH", ""))
+
+def lanzar(workdir, node_id):
+    log = open(os.path.join(workdir, f"nodo_{node_id}.log"), "a")
+    return subprocess.Popen([sys.executable, "-u", "-m", "app.main", str(node_id)],
+                            cwd=workdir, env=_entorno(), stdout=log, stderr=subprocess.STDOUT)
+
+def _acepta(port):
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+        return True
+    except OSError:
+        return False
+
+def _responde(nodo, tipo):
+    try:
+        return enviar(nodo["host"], nodo["port_manager"], {"type": tipo}, timeout=0.5)
+    except (OSError, ValueError):
+        return None
+
+def esperar(condicion, inicio):
+    """Segundos desde `inicio` hasta que `condicion()` se cumple."""
+    while time.perf_counter() - inicio < LIMITE:
+        if condicion():
+            return time.perf_counter() - inicio
+        time.sleep(SONDEO)
+    raise RuntimeError("El nodo no terminó de arrancar a tiempo")
+
+def medir_nodo(nodo, inicio):
+    return {
+        "storage_s": esperar(lambda: _acepta(nodo["port_db"]), inicio),
+        "maestro_s": esperar(lambda: _responde(nodo, "STATUS") is not None, inicio),
+    }
+
+def lider(config):
+    for nodo in config["nodes"]:
+        estado = _responde(nodo, "STATUS")
+        if estado and estado.get("es_lider"):
+            return nodo
+    return None
+
+def _resumen(valores):
+    return {"mediana": statistics.median(valores), "max": max(valores)} if valores else None
+
+def correr(args):
+    workdir, config = preparar_directorio(args)
+    procesos = {}
+    try:
+        # ARRANQUE EN FRÍO: todos los nodos a la vez
+        inicio = time.perf_counter()
+        for nodo in config["nodes"]:
+            procesos[nodo["id"]] = lanzar(workdir, nodo["id"])
+        frio = {nodo["id"]: medir_nodo(nodo, inicio) for nodo in config["nodes"]}
+        t_lider = esperar(lambda: lider(config) is not None, inicio)
+        maestro = lider(config)
+        t_atiende = esperar(lambda: (_responde(maestro, "CHECK_AVAIL") or {}).get("status") == "OK", inicio)
+        print(f"[ARRANQUE] en frío: líder en {t_lider:.2f}s, atiende en {t_atiende:.2f}s")
+
+        # REINICIOS: un esclavo muere y vuelve con la misma BD; no debería mover al líder
+        reinicios = []
+        for _ in range(args.reinicios):
+            esperar(lambda: lider(config) is not None, time.perf_counter())
+            maestro = lider(config)
+            term = _responde(maestro, "STATUS")["term"]
+            esclavo = next(n for n in config["nodes"] if n["id"] != maestro["id"])
+            procesos[esclavo["id"]].kill()
+            procesos[esclavo["id"]].wait()
+            inicio = time.perf_counter()
+            procesos[esclavo["id"]] = lanzar(workdir, esclavo["id"])
+            medida = medir_nodo(esclavo, inicio)
+            # Útil de verdad cuando reconoce al líder (redirige a los clientes hacia él)
+            medida["reconoce_s"] = esperar(lambda: (_responde(esclavo, "STATUS") or {}).get("leader_id") is not None, inicio)
+            time.sleep(args.observar)
+            despues = _responde(maestro, "STATUS") or {}
+            medida["lider_depuesto"] = not despues.get("es_lider") or despues.get("term") != term
+            reinicios.append(medida)
+            print(f"[ARRANQUE] reinicio del nodo {esclavo['id']}: storage {medida['storage_s']:.3f}s, "
+                  f"maestro {medida['maestro_s']:.3f}s, reconoce al líder {medida['reconoce_s']:.3f}s, "
+                  f"líder depuesto: {'sí' if medida['lider_depuesto'] else 'no'}")
+    finally:
+        for p in procesos.values(): p.kill()
+        for p in procesos.values(): p.wait()
+        if args.conservar:
+            print(f"[ARRANQUE] Directorio conservado: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    resultado = {
+        "nodos": args.nodos, "visitas": args.visitas, "pacientes": args.pacientes,
+        "frio": {"por_nodo": frio, "lider_s": t_lider, "atiende_s": t_atiende},
+        "reinicio": dict({clave: _resumen([r[clave] for r in reinicios]) for clave in ("storage_s", "maestro_s", "reconoce_s")},
+                         lideres_depuestos=sum(r["lider_depuesto"] for r in reinicios)),
+    }
+    with open(args.salida, "w") as f:
+        json.dump(resultado, f, indent=2)
+    print(json.dumps(resultado["reinicio"], indent=2))
+    print(f"[ARRANQUE] Resultados en {args.salida}")
+    return resultado
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del arranque de los nodos")
+    parser.add_argument("--nodos", type=int, default=3)
+    parser.add_argument("--pacientes", type=int, default=50000)
+    parser.add_argument("--visitas", type=int, default=100000)
+    parser.add_argument("--dias", type=int, default=90)
+    parser.add_argument("--reinicios", type=int, default=5, help="Veces que se reinicia un esclavo")
+    parser.add_argument("--observar", type=float, default=2.0, help="Segundos tras cada reinicio para ver si el líder cambió")
+    parser.add_argument("--puerto-base", type=int, default=19000, help="port_manager = base + id, port_db = base + 1000 + id")
+    parser.add_argument("--salida", default="arranque_resultado.json")
+    parser.add_argument("--conservar", action="store_true", help="No borrar el directorio temporal (logs y BDs)")
+    correr(parser.parse_args(argv))
+
+if __name__ == "__main__":
+    main()
@@ -48,4 +48,23 @@ CREATE TABLE IF NOT EXISTS visitas (
     FOREIGN KEY(id_doctor) REFERENCES doctores(id_doctor),
     FOREIGN KEY(id_cama) REFERENCES camas(id_cama),
     FOREIGN KEY(id_sala) REFERENCES nodos(id_sala)
-);
\ No newline at end of file
+);
+
+-- Respuestas ya entregadas por clave de idempotencia (sobreviven a un failover)
+CREATE TABLE IF NOT EXISTS idempotencia (
+    clave TEXT PRIMARY KEY,
+    respuesta TEXT,
+    creado REAL
+);
+
+-- Un folio identifica una sola visita; el alta busca por este índice
+CREATE UNIQUE INDEX IF NOT EXISTS idx_visitas_folio ON visitas(folio);
+
+-- Posición de replicación: (término, índice) del último lote del líder aplicado en
+-- este nodo. Sube de uno en uno; un candidato más atrás que quien vota no recibe su voto
+CREATE TABLE IF NOT EXISTS registro_replicacion (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    term INTEGER NOT NULL,
+    indice INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO registro_replicacion (id, term, indice) VALUES (1, 0, 0);
@@ -0,0 +1,197 @@
+"""
+Generador de hospitales sintéticos a gran escala (reemplazo de seeds.py para
+pruebas de volumen): muchas salas y camas, cientos de doctores, millones de
+pacientes y visitas históricas, más un censo activo coherente (camas ocupadas
+y carga de doctores que cuadran con las visitas EN_PROCESO).
+
+Todo se inserta con executemany en transacciones grandes. Con la misma semilla
+el resultado es idéntico; con varios nodos se genera una vez y se copia el
+archivo, así todas las réplicas quedan iguales. Ejecutar con los nodos detenidos.
+
+Uso:
+    python generar_datos.py --nodos 1 2 3 4 --salas 40 --camas-por-sala 50 \\
+        --doctores 400 --pacientes 2000000 --visitas 5000000 --dias 365
+"""
+import argparse
+import datetime
+import itertools
+import math
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '.')))
+
+from app.core.folios import formatear_folio, MAX_SECUENCIA
+from app.data_access.db_manager import set_db_context
+from app.data_access.archive import archivar_visitas
+
+SCHEMA_PATH = "config/schema.sql"
+FORMATO = "%Y-%m-%d %H:%M:%S"
+
+NOMBRES = ["Ana", "Luis", "María", "José", "Carmen", "Jorge", "Lucía", "Miguel", "Sofía", "Pedro",
+           "Elena", "Diego", "Paula", "Andrés", "Valeria", "Raúl", "Daniela", "Hugo", "Fernanda", "Iván"]
+APELLIDOS = ["García", "Hernández", "López", "Martínez", "González", "Pérez", "Rodríguez", "Sánchez",
+             "Ramírez", "Cruz", "Flores", "Gómez", "Morales", "Vázquez", "Reyes", "Jiménez", "Torres", "Ruiz"]
+ESPECIALIDADES = ["Urgencias", "Medicina Interna", "Pediatría", "Traumatología", "Cardiología",
+                  "Cirugía", "Neurología", "Ginecología"]
+ORIENTACIONES = ["Norte", "Sur", "Este", "Oeste", "Centro"]
+
+# Llegadas por hora del día (más de día que de madrugada)
+PESOS_HORA = [2, 1.5, 1, 1, 1, 1.5, 3, 5, 7, 8, 8, 7, 6, 6, 6, 6, 7, 7, 6, 5, 4, 4, 3, 2.5]
+HORAS_ACUM = list(itertools.accumulate(PESOS_HORA))
+
+def _nombre(rng):
+    return f"{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}"
+
+def _por_lotes(conn, sql, filas, lote):
+    """executemany en transacciones de `lote` filas."""
+    pendientes = []
+    total = 0
+    for fila in filas:
+        pendientes.append(fila)
+        if len(pendientes) >= lote:
+            with conn: conn.executemany(sql, pendientes)
+            total += len(pendientes)
+            pendientes = []
+    if pendientes:
+        with conn: conn.executemany(sql, pendientes)
+        total += len(pendientes)
+    return total
+
+def generar(db_path, args):
+    rng = random.Random(args.semilla)
+    conn = sqlite3.connect(db_path)
+    # Carga masiva: sin diario ni fsync (si se interrumpe, se regenera)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    with open(SCHEMA_PATH) as f:
+        conn.executescript(f.read())
+    if conn.execute("SELECT COUNT(*) FROM pacientes").fetchone()[0]:
+        conn.close()
+        raise SystemExit(f"{db_path} ya tiene datos (use --reemplazar)")
+
+    t0 = time.perf_counter()
+    salas = [(s, f"Sala {ORIENTACIONES[(s - 1) % len(ORIENTACIONES)]} {(s - 1) // len(ORIENTACIONES) + 1}")
+             for s in range(1, args.salas + 1)]
+    _por_lotes(conn, "INSERT INTO nodos (id_sala, nombre) VALUES (?, ?)", salas, args.lote)
+
+    camas = [(s, f"{s}-{c:03d}") for s in range(1, args.salas + 1) for c in range(args.camas_por_sala)]
+    _por_lotes(conn, "INSERT INTO camas (id_sala, numero_cama, estado) VALUES (?, ?, 'LIBRE')", camas, args.lote)
+
+    capacidades = [max(1, int(rng.gauss(args.capacidad_doctor, 1))) for _ in range(args.doctores)]
+    doctores = ((f"Dr. {_nombre(rng)}", rng.choice(ESPECIALIDADES), capacidades[d]) for d in range(args.doctores))
+    _por_lotes(conn, "INSERT INTO doctores (nombre, especialidad, carga_actual, capacidad_max) VALUES (?, ?, 0, ?)",
+               doctores, args.lote)
+
+    triage_pesos = list(itertools.accumulate(float(p) for p in args.triage.split(",")))
+    niveles = range(1, len(triage_pesos) + 1)
+    pacientes = ((_nombre(rng), f"SS{p:010d}", f"{rng.randint(1930, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                  rng.choices(niveles, cum_weights=triage_pesos)[0])
+                 for p in range(1, args.pacientes + 1))
+    _por_lotes(conn, "INSERT INTO pacientes (nombre, seguro_social, fecha_nac, triage) VALUES (?, ?, ?, ?)",
+               pacientes, args.lote)
+    print(f"  catálogos y {args.pacientes} pacientes: {time.perf_counter() - t0:.1f}s")
+
+    # HISTORIAL: llegadas con patrón diario, estancia log-normal (mediana --estancia-horas)
+    t0 = time.perf_counter()
+    ahora = datetime.datetime.now().replace(microsecond=0)
+    inicio = ahora - datetime.timedelta(days=args.dias)
+    mu = math.log(args.estancia_horas * 3600)
+    n_camas = len(camas)
+
+    def historicas():
+        for i in range(args.visitas):
+            dia = inicio + datetime.timedelta(days=rng.randrange(args.dias))
+            hora = rng.choices(range(24), cum_weights=HORAS_ACUM)[0]
+            ingreso = dia.replace(hour=hora, minute=rng.randrange(60), second=rng.randrange(60))
+            salida = ingreso + datetime.timedelta(seconds=int(rng.lognormvariate(mu, args.dispersion)))
+            if salida >= ahora:
+                salida = ahora - datetime.timedelta(seconds=1)
+            id_cama = rng.randrange(1, n_camas + 1)
+            ms = int(ingreso.timestamp() * 1000)
+            # Nodo 0 = carga sintética; el término hace de contador alto para que no se repitan
+            yield (formatear_folio(ms, 0, i // MAX_SECUENCIA, i % MAX_SECUENCIA), rng.randint(1, args.pacientes), rng.randint(1, args.doctores),
+                   id_cama, (id_cama - 1) // args.camas_por_sala + 1,
+                   ingreso.strftime(FORMATO), salida.strftime(FORMATO))
+
+    _por_lotes(conn, "INSERT INTO visitas (folio, id_paciente, id_doctor, id_cama, id_sala, fecha_ingreso, fecha_salida, estado) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, 'CERRADA')", historicas(), args.lote)
+    print(f"  {args.visitas} visitas históricas: {time.perf_counter() - t0:.1f}s")
+
+    # CENSO ACTIVO: cada visita abierta ocupa una cama y un cupo de doctor
+    cupos = [d for d in range(1, args.doctores + 1) for _ in range(capacidades[d - 1])]
+    rng.shuffle(cupos)
+    camas_ocupadas = rng.sample(range(1, n_camas + 1), min(int(n_camas * args.ocupacion), len(cupos)))
+    pacientes_activos = rng.sample(range(1, args.pacientes + 1), min(len(camas_ocupadas), args.pacientes))
+    activas = []
+    for i, (id_cama, id_paciente) in enumerate(zip(camas_ocupadas, pacientes_activos)):
+        ingreso = ahora - datetime.timedelta(seconds=int(rng.lognormvariate(mu, args.dispersion) / 2))
+        n = args.visitas + i
+        activas.append((formatear_folio(int(ingreso.timestamp() * 1000), 0, n // MAX_SECUENCIA, n % MAX_SECUENCIA), id_paciente,
+                        cupos[i], id_cama, (id_cama - 1) // args.camas_por_sala + 1, ingreso.strftime(FORMATO)))
+    with conn:
+        conn.executemany("INSERT INTO visitas (folio, id_paciente, id_doctor, id_cama, id_sala, fecha_ingreso, estado) "
+                         "VALUES (?, ?, ?, ?, ?, ?, 'EN_PROCESO')", activas)
+        conn.executemany("UPDATE camas SET estado = 'OCUPADA' WHERE id_cama = ?", [(a[3],) for a in activas])
+        conn.execute("""
+            UPDATE doctores SET carga_actual = (SELECT COUNT(*) FROM visitas v
+                WHERE v.id_doctor = doctores.id_doctor AND v.estado = 'EN_PROCESO')""")
+        conn.execute("UPDATE doctores SET estado = CASE WHEN carga_actual >= capacidad_max THEN 'SATURADO' ELSE 'DISPONIBLE' END")
+    print(f"  censo activo: {len(activas)} visitas EN_PROCESO de {n_camas} camas")
+    conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera un hospital sintético a gran escala")
+    parser.add_argument("--nodos", type=int, nargs="+", default=[1], help="IDs de nodo cuyas BDs se generan")
+    parser.add_argument("--salas", type=int, default=20)
+    parser.add_argument("--camas-por-sala", type=int, default=50)
+    parser.add_argument("--doctores", type=int, default=200)
+    parser.add_argument("--capacidad-doctor", type=float, default=4, help="Pacientes simultáneos por doctor (media)")
+    parser.add_argument("--pacientes", type=int, default=500000)
+    parser.add_argument("--visitas", type=int, default=1000000, help="Visitas históricas (cerradas)")
+    parser.add_argument("--dias", type=int, default=365, help="Días de historial")
+    parser.add_argument("--estancia-horas", type=float, default=4, help="Mediana de la estancia")
+    parser.add_argument("--dispersion", type=float, default=0.8, help="Sigma de la estancia log-normal")
+    parser.add_argument("--ocupacion", type=float, default=0.6, help="Fracción de camas ocupadas ahora")
+    parser.add_argument("--triage", default="5,15,40,30,10", help="Pesos de los niveles de triage 1..N")
+    parser.add_argument("--lote", type=int, default=50000, help="Filas por transacción")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--retencion-dias", type=int, default=None,
+                        help="Archivar después las visitas cerradas con más de N días")
+    parser.add_argument("--reemplazar", action="store_true", help="Borrar las BDs existentes")
+    args = parser.parse_args(argv)
+
+    rutas = [f"data/nodo_{n}.db" for n in args.nodos]
+    os.makedirs("data", exist_ok=True)
+    if args.reemplazar:
+        for ruta in rutas:
+            if os.path.exists(ruta): os.remove(ruta)
+
+    inicio = time.perf_counter()
+    print(f"--- GENERANDO {rutas[0]} ---")
+    generar(rutas[0], args)
+    if args.retencion_dias is not None:
+        set_db_context(rutas[0])
+        hasta = (datetime.datetime.now() - datetime.timedelta(days=args.retencion_dias)).strftime(FORMATO)
+        print(f"  archivo: {archivar_visitas(hasta)}")
+
+    # Réplicas idénticas: se copia la BD (y su archivo) en vez de regenerar
+    for ruta in rutas[1:]:
+        if os.path.exists(ruta) and not args.reemplazar:
+            print(f"  {ruta} ya existe, se omite (use --reemplazar)")
+            continue
+        shutil.copyfile(rutas[0], ruta)
+        origen_archivo = f"data/archivo_nodo_{args.nodos[0]}"
+        if os.path.isdir(origen_archivo):
+            destino = f"data/archivo_{os.path.splitext(os.path.basename(ruta))[0]}"
+            shutil.rmtree(destino, ignore_errors=True)
+            shutil.copytree(origen_archivo, destino)
+        print(f"  copiada a {ruta}")
+    print(f"Listo en {time.perf_counter() - inicio:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from app.core import term_state
+from app.core.term_state import EstadoTermino, set_term_context
+from app.common.constants import MSG_OK, MSG_STALE_TERM, MSG_WRITE_BATCH
+from app.data_access import db_manager
+from app.services.storage_service import StorageService
+
+RAIZ = os.path.join(os.path.dirname(__file__), "..")
+
+class VotoTest(unittest.TestCase):
+    """Reglas de voto de EstadoTermino: un voto por término, lease y candidato al día."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.ruta = os.path.join(self.dir, "nodo_1_term.json")
+        self.estado = EstadoTermino(self.ruta)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_un_solo_voto_por_termino(self):
+        self.assertTrue(self.estado.conceder_voto(3, 2))
+        # El mismo candidato puede pedirlo otra vez (reintento); otro no
+        self.assertTrue(self.estado.conceder_voto(3, 2))
+        self.assertFalse(self.estado.conceder_voto(3, 3))
+        self.assertEqual(self.estado.voted_for, 2)
+
+    def test_el_voto_sobrevive_a_un_reinicio(self):
+        self.assertTrue(self.estado.conceder_voto(3, 2))
+        reiniciado = EstadoTermino(self.ruta)
+        self.assertFalse(reiniciado.conceder_voto(3, 3))
+
+    def test_termino_viejo_no_recibe_voto(self):
+        self.estado.observar_termino(5)
+        self.assertFalse(self.estado.conceder_voto(4, 2))
+
+    def test_sin_voto_mientras_se_respeta_el_lease_de_otro(self):
+        self.assertTrue(self.estado.renovar_lease_seguidor(3, 2))
+        self.assertFalse(self.estado.conceder_voto(4, 3))
+        self.assertEqual(self.estado.current_term, 3)
+
+    def test_lider_con_lease_no_vota(self):
+        term = self.estado.iniciar_candidatura(1)
+        self.assertTrue(self.estado.asumir_liderazgo(term, 1, time.monotonic()))
+        self.assertFalse(self.estado.conceder_voto(term + 1, 2))
+        self.assertTrue(self.estado.tengo_lease(1))
+
+    def test_candidato_atrasado_no_recibe_voto(self):
+        self.assertFalse(self.estado.conceder_voto(3, 2, candidato_al_dia=False))
+        # Adopta el término pero no gasta el voto: otro candidato al día puede ganarlo
+        self.assertEqual(self.estado.current_term, 3)
+        self.assertIsNone(self.estado.voted_for)
+        self.assertTrue(self.estado.conceder_voto(3, 3))
+
+class LoteConTerminoViejoTest(unittest.TestCase):
+    """Fencing en StorageService: una réplica no aplica lotes de un maestro depuesto."""
+
+    def setUp(self):
+        self._ruta_previa = db_manager.CURRENT_DB_PATH
+        self._estado_previo = term_state.get_term_state()
+        self._cwd = os.getcwd()
+        # StorageService carga config/schema.sql relativo a la raíz del repo
+        os.chdir(RAIZ)
+        self.dir = tempfile.mkdtemp()
+        ruta_db = os.path.join(self.dir, "nodo_2.db")
+        db_manager.set_db_context(ruta_db)
+        self.estado = set_term_context(os.path.join(self.dir, "nodo_2_term.json"))
+        self.estado.observar_termino(5)
+        self.storage = StorageService(ruta_db, 0)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        db_manager.CURRENT_DB_PATH = self._ruta_previa
+        term_state._estado_actual = self._estado_previo
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def lote(self, term, nombre):
+        return {"type": MSG_WRITE_BATCH, "term": term, "ops": [{
+            "sql": "INSERT INTO doctores (nombre) VALUES (?)", "params": [nombre]}]}
+
+    def doctores(self):
+        return [d["nombre"] for d in db_manager.fetch_all("SELECT nombre FROM doctores")]
+
+    def test_lote_con_termino_viejo_se_rechaza(self):
+        res = self.storage._process_request(self.lote(4, "Dr. Depuesto"))
+
+        self.assertEqual(res, {"status": MSG_STALE_TERM, "term": 5})
+        self.assertEqual(self.doctores(), [])
+
+    def test_lote_del_termino_vigente_se_aplica(self):
+        res = self.storage._process_request(self.lote(5, "Dra. Vigente"))
+
+        self.assertEqual(res["status"], MSG_OK)
+        self.assertEqual(self.doctores(), ["Dra. Vigente"])
+
+    def test_termino_mayor_se_adopta(self):
+        self.assertEqual(self.storage._process_request(self.lote(7, "Dr. Nuevo"))["status"], MSG_OK)
+        self.assertEqual(self.estado.current_term, 7)
+        self.assertEqual(self.storage._process_request(self.lote(6, "Dr. Viejo"))["status"], MSG_STALE_TERM)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from app.data_access import db_manager, merkle
+from app.data_access.archive import archivar_visitas, ruta_particion
+
+ESQUEMA = os.path.join(os.path.dirname(__file__), "..", "config", "schema.sql")
+
+# folio, id_paciente, id_cama, fecha_salida, estado
+VISITAS = {
+    "A": ("FOLIO-A", 1, 1, "2026-01-15 10:00:00", "CERRADA"),
+    "B": ("FOLIO-B", 2, 2, "2026-02-10 10:00:00", "CERRADA"),
+    "C": ("FOLIO-C", 3, 3, None, "EN_PROCESO"),
+    "D": ("FOLIO-D", 1, 1, None, "EN_PROCESO"),
+}
+
+class ReparacionVisitasTest(unittest.TestCase):
+    """Anti-entropía entre un líder y una réplica, sin red de por medio."""
+
+    def setUp(self):
+        self._ruta_previa = db_manager.CURRENT_DB_PATH
+        self.dir = tempfile.mkdtemp()
+        self.lider = os.path.join(self.dir, "nodo_1.db")
+        self.replica = os.path.join(self.dir, "nodo_2.db")
+        for ruta in (self.lider, self.replica):
+            db_manager.set_db_context(ruta)
+            db_manager.DatabaseManager(ruta, ESQUEMA)
+            db_manager.execute_batch([
+                ("INSERT INTO nodos (id_sala, nombre) VALUES (1, 'Sala 1')", ()),
+                ("INSERT INTO doctores (id_doctor, nombre) VALUES (1, 'Dra. Prueba')", ()),
+            ] + [("INSERT INTO pacientes (id_paciente, nombre, seguro_social) VALUES (?, ?, ?)", (i, f"P{i}", f"SS-{i}"))
+                 for i in (1, 2, 3)]
+              + [("INSERT INTO camas (id_cama, id_sala, numero_cama) VALUES (?, 1, ?)", (i, str(i))) for i in (1, 2, 3)])
+
+    def tearDown(self):
+        db_manager.CURRENT_DB_PATH = self._ruta_previa
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def insertar(self, ruta, *visitas):
+        db_manager.set_db_context(ruta)
+        db_manager.execute_batch([(
+            "INSERT INTO visitas (folio, id_paciente, id_doctor, id_cama, id_sala, fecha_ingreso, fecha_salida, estado) "
+            "VALUES (?, ?, 1, ?, 1, '2026-01-01 08:00:00', ?, ?)", VISITAS[v]
+        ) for v in visitas])
+
+    def folios(self, ruta, consulta="SELECT folio FROM visitas"):
+        conn = sqlite3.connect(ruta)
+        try:
+            return {r[0] for r in conn.execute(consulta)}
+        finally:
+            conn.close()
+
+    def sincronizar(self, tabla="visitas"):
+        """Lo que hace ServicioAntiEntropia con una réplica: comparar hojas y reparar las distintas."""
+        db_manager.set_db_context(self.lider)
+        tamano = merkle.tamano(tabla)
+        db_manager.set_db_context(self.replica)
+        hojas = merkle.hojas_para(max(tamano, merkle.tamano(tabla)))
+        arbol_replica = merkle.construir_arbol(tabla, hojas)
+        db_manager.set_db_context(self.lider)
+        arbol_lider = merkle.construir_arbol(tabla, hojas)
+
+        resultados = []
+        for hoja in range(hojas):
+            if arbol_lider[hojas - 1 + hoja] == arbol_replica[hojas - 1 + hoja]: continue
+            db_manager.set_db_context(self.lider)
+            columnas, filas = merkle.filas_hojas(tabla, hojas, hoja, hoja)
+            db_manager.set_db_context(self.replica)
+            resultados.append(merkle.reparar_hojas(tabla, hojas, hoja, hoja, columnas, [list(f) for f in filas]))
+        return resultados
+
+    def test_id_visita_local_no_cuenta_como_diferencia(self):
+        # Mismas visitas, insertadas en otro orden: cada réplica les dio otro id_visita
+        self.insertar(self.lider, "A", "B", "C")
+        self.insertar(self.replica, "C", "B", "A")
+        self.assertEqual(self.sincronizar(), [])
+
+    def test_archive_perdido_se_archiva_en_la_replica(self):
+        self.insertar(self.lider, "A", "B", "C")
+        self.insertar(self.replica, "B", "A", "C")
+        # El líder archiva enero; la réplica no recibe el ARCHIVE
+        db_manager.set_db_context(self.lider)
+        self.assertEqual(archivar_visitas("2026-02-01 00:00:00")["archivadas"], 1)
+
+        resultados = self.sincronizar()
+
+        self.assertEqual(len(resultados), 1)
+        self.assertEqual(resultados[0]["status"], "OK")
+        self.assertEqual(resultados[0]["archivadas"], 1)
+        self.assertEqual(resultados[0]["conservadas"], [])
+        self.assertEqual(self.folios(self.replica), {"FOLIO-B", "FOLIO-C"})
+        # La historia no se pierde: quedó en la partición de enero de la réplica
+        db_manager.set_db_context(self.replica)
+        self.assertEqual(self.folios(ruta_particion("2026-01")), {"FOLIO-A"})
+        self.assertEqual(self.sincronizar(), [])
+
+    def test_visita_abierta_que_el_lider_no_tiene_se_conserva(self):
+        self.insertar(self.lider, "A", "C")
+        self.insertar(self.replica, "A", "C", "D")
+
+        resultados = self.sincronizar()
+
+        # Pudo ser una admisión confirmada que el líder no recibió: no se borra, se reporta
+        self.assertEqual([(r["conservadas"], r["archivadas"]) for r in resultados], [(["FOLIO-D"], 0)])
+        self.assertEqual(self.folios(self.replica), {"FOLIO-A", "FOLIO-C", "FOLIO-D"})
+
+    def test_paciente_que_el_lider_no_tiene_se_conserva(self):
+        db_manager.set_db_context(self.replica)
+        db_manager.execute_sql("INSERT INTO pacientes (id_paciente, nombre, seguro_social) VALUES (4, 'P4', 'SS-4')")
+        db_manager.execute_sql("UPDATE pacientes SET nombre = 'Otro' WHERE id_paciente = 2")
+
+        resultados = self.sincronizar("pacientes")
+
+        self.assertEqual([(r["status"], r["conservadas"], r["en_conflicto"]) for r in resultados], [("OK", [4], [])])
+        conn = sqlite3.connect(self.replica)
+        try:
+            pacientes = dict(conn.execute("SELECT id_paciente, nombre FROM pacientes"))
+        finally:
+            conn.close()
+        self.assertEqual(pacientes, {1: "P1", 2: "P2", 3: "P3", 4: "P4"})
+
+    def test_version_del_lider_gana_por_folio(self):
+        self.insertar(self.lider, "B", "C")
+        self.insertar(self.replica, "C")
+        db_manager.set_db_context(self.replica)
+        db_manager.execute_sql("UPDATE visitas SET estado = 'CERRADA', fecha_salida = '2026-03-01 09:00:00' WHERE folio = 'FOLIO-C'")
+
+        self.sincronizar()
+
+        self.assertEqual(self.folios(self.replica, "SELECT folio FROM visitas WHERE estado = 'EN_PROCESO'"), {"FOLIO-C"})
+        self.assertEqual(self.folios(self.replica, "SELECT folio FROM visitas WHERE estado = 'CERRADA'"), {"FOLIO-B"})
+
+if __name__ == "__main__":
+    unittest.main()